@@ -44,6 +44,31 @@ export default function BillScanner({ externalOpen, onClose, hideButton }) {
         }
     };
 
+    // Poll a bill processing job until every page is done, giving up after BILL_JOB_TIMEOUT_MS
+    const BILL_JOB_POLL_MS = 2000;
+    const BILL_JOB_TIMEOUT_MS = 5 * 60 * 1000;
+    const waitForBillJob = async (jobId) => {
+        const deadline = Date.now() + BILL_JOB_TIMEOUT_MS;
+        while (Date.now() < deadline) {
+            const response = await fetch(`http://localhost:5000/bill-scanner/jobs/${jobId}`, {
+                credentials: 'include'
+            });
+            if (!response.ok) {
+                throw new Error(`Failed to check bill status: ${response.statusText}`);
+            }
+
+            const job = await response.json();
+            if (job.status === 'completed') {
+                return job;
+            }
+            if (job.status === 'failed') {
+                throw new Error(job.error || 'Failed to process bill');
+            }
+            await new Promise(resolve => setTimeout(resolve, BILL_JOB_POLL_MS));
+        }
+        throw new Error('The bill is taking too long to process. Please check back later or try again.');
+    };
+
     // Process the uploaded image - modified to support multiple bills
     const processImage = async (imageData, fileType, filename = "bill.jpg", isLastFile = true) => {
         try {
@@ -74,10 +99,23 @@ export default function BillScanner({ externalOpen, onClose, hideButton }) {
                 throw new Error(`Failed to process bill: ${response.statusText}`);
             }
 
-            const data = await response.json();
+            const job = await response.json();
+            
+            if (job.error) {
+                throw new Error(job.error);
+            }
+            
+            // Processing runs in the background; wait for the job to finish
+            const data = await waitForBillJob(job.job_id);
             
-            if (data.error) {
-                throw new Error(data.error);
+            // Pages that could not be read are reported rather than dropped silently
+            const failedPages = (data.pages || []).filter(page => page.status === 'failed');
+            const failureNote = failedPages.length > 0
+                ? ` ${failedPages.length} page(s) could not be processed: ` +
+                  failedPages.map(page => `page ${page.page + 1} (${page.error || 'unknown error'})`).join(', ')
+                : '';
+            if (!data.results || data.results.length === 0) {
+                throw new Error(failureNote ? failureNote.trim() : 'No bill could be read from this file');
             }
             
             // Handle results - can be one or multiple bills
@@ -117,7 +155,7 @@ export default function BillScanner({ externalOpen, onClose, hideButton }) {
                 
                 if (isLastFile) {
                     setViewMode('list');
-                    setResult(`Successfully processed ${newBills.length} bill(s)`);
+                    setResult(`Successfully processed ${newBills.length} bill(s).${failureNote}`);
                     setIsProcessing(false);
                 }
             }
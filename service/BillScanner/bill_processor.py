@@ -1,13 +1,15 @@
+import io
 import os
 import re
 import json
-import uuid
+import base64
 import logging
-import tempfile
 from datetime import datetime
 from together import Together
+from Prescription.services.llm_cache import llm_cache
+from Prescription.services.image_preprocessing import prepare_image
+from BillScanner.pdf_render import render_pool, DEFAULT_DPI, DEFAULT_JPEG_QUALITY
 import cloudinary.uploader
-import requests
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Configure logging
@@ -23,6 +25,11 @@ class BillProcessor:
             
         self.client = Together(api_key=self.together_api_key)
         self.num_attempts = 2  # Number of parallel API calls
+        # Pages of a PDF processed at the same time
+        self.page_parallelism = int(os.getenv('BILL_PAGE_PARALLELISM', 4))
+        # PDF pages are rendered in memory at this resolution and JPEG quality
+        self.pdf_dpi = DEFAULT_DPI
+        self.pdf_jpeg_quality = DEFAULT_JPEG_QUALITY
         
         # # Setup logging directory
         # self.debug_dir = os.path.join(os.path.dirname(__file__), 'debug_logs')
@@ -165,56 +172,10 @@ class BillProcessor:
             logging.error(f"Failed to log API call: {str(e)}")
             return False
 
-    def get_mime_type_from_url(self, url):
-        """Determine MIME type from URL or response headers"""
+    def convert_pdf_to_images(self, pdf_bytes, skip_pages=()):
+        """Render PDF pages to in-memory JPEGs in the shared render pool, returning a RenderedPage per page"""
         try:
-            response = requests.head(url)
-            content_type = response.headers.get('content-type', '')
-            if content_type.startswith('image/'):
-                return content_type
-        except:
-            pass
-        
-        # Fallback to extension-based detection
-        extension = os.path.splitext(url)[1].lower()
-        mime_types = {
-            '.png': 'image/png',
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg',
-            '.gif': 'image/gif',
-            '.webp': 'image/webp'
-        }
-        return mime_types.get(extension, 'image/jpeg')
-        
-    def convert_pdf_to_images(self, pdf_path):
-        """Convert PDF to images and return a list of image paths"""
-        temp_dir = tempfile.mkdtemp()
-        image_paths = []
-        
-        try:
-            if self.use_pdf2image:
-                # Use pdf2image/poppler method
-                from pdf2image import convert_from_path
-                images = convert_from_path(pdf_path, output_folder=temp_dir)
-                
-                for i, image in enumerate(images):
-                    image_path = os.path.join(temp_dir, f'page_{i}.jpg')
-                    image.save(image_path, 'JPEG')
-                    image_paths.append(image_path)
-            elif self.pymupdf_available:
-                # Use PyMuPDF as alternative
-                import fitz
-                pdf_document = fitz.open(pdf_path)
-                
-                for i, page in enumerate(pdf_document):
-                    pix = page.get_pixmap(matrix=fitz.Matrix(300/72, 300/72))
-                    image_path = os.path.join(temp_dir, f'page_{i}.jpg')
-                    pix.save(image_path)
-                    image_paths.append(image_path)
-            else:
-                raise ValueError("No PDF conversion method available. Install either poppler (for pdf2image) or PyMuPDF.")
-                
-            return image_paths
+            return render_pool.render(pdf_bytes, self.pdf_dpi, self.pdf_jpeg_quality, skip_pages)
         except Exception as e:
             logging.error(f"Error converting PDF to images: {str(e)}")
             raise
@@ -224,20 +185,23 @@ class BillProcessor:
         try:
             with ThreadPoolExecutor(max_workers=self.num_attempts) as executor:
                 # Create multiple futures for parallel API calls
-                futures = [
-                    executor.submit(self._make_extraction_api_call, image_url)
-                    for _ in range(self.num_attempts)
-                ]
+                # Each sample is cached separately, keyed on the image itself
+                futures = {
+                    executor.submit(self._make_extraction_api_call, image_url, sample): sample
+                    for sample in range(self.num_attempts)
+                }
                 
                 # Collect all responses
-                responses = []
+                results = {}
                 for future in as_completed(futures):
                     try:
                         result = future.result()
                         if result:
-                            responses.append(result)
+                            results[futures[future]] = result
                     except Exception as e:
                         logging.error(f"Text extraction API call error: {str(e)}")
+                # Sample order, so the same page always yields the same text for the processing cache key
+                responses = [results[sample] for sample in sorted(results)]
                 
                 # Combine responses if we have any
                 if responses:
@@ -250,30 +214,44 @@ class BillProcessor:
             logging.error(f"Error extracting text from image: {str(e)}")
             raise
             
-    def _make_extraction_api_call(self, image_url):
-        """Make a single API call to Together AI for text extraction"""
+    def _is_valid_extraction_response(self, extracted_text):
+        # A readable bill always has amounts, dates or quantities in it
+        return bool(extracted_text and extracted_text.strip()) and any(c.isdigit() for c in extracted_text)
+
+    def _make_extraction_api_call(self, image_url, sample=0):
+        """Make a single API call to Together AI for text extraction
+
+        Args:
+            image_url: Data URL (or URL) of the page image, part of the cache key
+            sample: Index of this call among the parallel samples, part of the cache key
+        """
         try:
-            mime_type = self.get_mime_type_from_url(image_url)
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that extracts text from images."},
-                    {"role": "user", "content": [
-                        {"type": "text", "text": self.text_extraction_prompt},
-                        {"type": "image_url", "image_url": {"url": image_url}}
-                    ]}
-                ],
-                temperature=0.3,
-                max_tokens=2048
+            messages = [
+                {"role": "system", "content": "You are a helpful assistant that extracts text from images."},
+                {"role": "user", "content": [
+                    {"type": "text", "text": self.text_extraction_prompt},
+                    {"type": "image_url", "image_url": {"url": image_url}}
+                ]}
+            ]
+            params = {"temperature": 0.3, "max_tokens": 2048}
+
+            def call():
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    **params
+                )
+                result = response.choices[0].message.content
+                
+                # Log this API call to the extraction log file
+                attempt_num = id(response) % 1000  # Generate a pseudo-unique ID for this attempt
+                self.log_api_call("extraction", attempt_num, result)
+                return result
+
+            return llm_cache.get_or_call(
+                self.model, messages, call, params=params, sample=sample,
+                validate=self._is_valid_extraction_response
             )
-            
-            result = response.choices[0].message.content
-            
-            # Log this API call to the extraction log file
-            attempt_num = id(response) % 1000  # Generate a pseudo-unique ID for this attempt
-            self.log_api_call("extraction", attempt_num, result)
-            
-            return result
         except Exception as e:
             logging.error(f"API call attempt error: {str(e)}")
             # Log the error
@@ -285,9 +263,10 @@ class BillProcessor:
         try:
             with ThreadPoolExecutor(max_workers=self.num_attempts) as executor:
                 # Create multiple futures for parallel API calls
+                # Each sample is cached separately so a retried bill replays all of them
                 futures = [
-                    executor.submit(self._make_processing_api_call, text)
-                    for _ in range(self.num_attempts)
+                    executor.submit(self._make_processing_api_call, text, sample)
+                    for sample in range(self.num_attempts)
                 ]
                 
                 # Collect all responses
@@ -304,18 +283,7 @@ class BillProcessor:
                 all_results = []
                 for processed_text in responses:
                     try:
-                        # Extract the JSON part from the response
-                        json_match = re.search(r'```json\s*([\s\S]*?)\s*```', processed_text)
-                        if json_match:
-                            json_str = json_match.group(1)
-                        else:
-                            # Try to find any JSON-like structure
-                            json_match = re.search(r'(\{[\s\S]*\})', processed_text)
-                            if json_match:
-                                json_str = json_match.group(1)
-                            else:
-                                json_str = processed_text
-                        
+                        json_str = self._extract_json_string(processed_text)
                         parsed_data = json.loads(json_str)
                         all_results.append(parsed_data)
                     except json.JSONDecodeError as e:
@@ -336,26 +304,55 @@ class BillProcessor:
             logging.error(f"Error processing bill text: {str(e)}")
             raise
             
-    def _make_processing_api_call(self, text):
-        """Make a single API call to Together AI for text processing"""
+    def _extract_json_string(self, processed_text):
+        """The JSON part of a processing response"""
+        json_match = re.search(r'```json\s*([\s\S]*?)\s*```', processed_text)
+        if json_match:
+            return json_match.group(1)
+        # Try to find any JSON-like structure
+        json_match = re.search(r'(\{[\s\S]*\})', processed_text)
+        if json_match:
+            return json_match.group(1)
+        return processed_text
+
+    def _is_valid_processing_response(self, processed_text):
+        try:
+            json.loads(self._extract_json_string(processed_text))
+            return True
+        except json.JSONDecodeError:
+            return False
+
+    def _make_processing_api_call(self, text, sample=0):
+        """Make a single API call to Together AI for text processing
+
+        Args:
+            text: Extracted bill text
+            sample: Index of this call among the parallel samples, part of the cache key
+        """
         try:
-            response = self.client.chat.completions.create(
-                model=self.text_processing_model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that analyzes bill text and extracts structured information. You're assigned to process and structure the text according to the given prompt."},
-                    {"role": "user", "content": f"{self.data_processing_prompt}\n\nBill Text: {text}"}
-                ],
-                temperature=0.3,
-                max_tokens=2048
+            messages = [
+                {"role": "system", "content": "You are a helpful assistant that analyzes bill text and extracts structured information. You're assigned to process and structure the text according to the given prompt."},
+                {"role": "user", "content": f"{self.data_processing_prompt}\n\nBill Text: {text}"}
+            ]
+            params = {"temperature": 0.3, "max_tokens": 2048}
+
+            def call():
+                response = self.client.chat.completions.create(
+                    model=self.text_processing_model,
+                    messages=messages,
+                    **params
+                )
+                processed_text = response.choices[0].message.content
+                
+                # Log this API call to the processing log file
+                attempt_num = id(response) % 1000  # Generate a pseudo-unique ID for this attempt
+                self.log_api_call("processing", attempt_num, processed_text)
+                return processed_text
+
+            return llm_cache.get_or_call(
+                self.text_processing_model, messages, call, params=params, sample=sample,
+                validate=self._is_valid_processing_response
             )
-            
-            processed_text = response.choices[0].message.content
-            
-            # Log this API call to the processing log file
-            attempt_num = id(response) % 1000  # Generate a pseudo-unique ID for this attempt
-            self.log_api_call("processing", attempt_num, processed_text)
-            
-            return processed_text
         except Exception as e:
             logging.error(f"API call attempt error: {str(e)}")
             # Log the error
@@ -404,85 +401,117 @@ class BillProcessor:
         
         return merged
     
-    def process_bill_file(self, file_data, original_filename):
-        """Process a bill file (either PDF or image)"""
-        # Generate a unique filename for the temporary file
+    def process_bill_file(self, file_data, original_filename, on_page=None, skip_pages=()):
+        """Process a bill file (either PDF or image)
+
+        The file is handled in memory throughout: PDF pages are rendered to
+        JPEG bytes, which are uploaded and sent to the model directly.
+        Pages go through upload, text extraction and processing
+        concurrently, at most page_parallelism at a time. A page that fails
+        is reported with an error instead of failing the whole file.
+
+        Args:
+            file_data: Uploaded file (anything with a read() method) or its bytes
+            original_filename: Name the file was uploaded with
+            on_page: Optional callback(page_index, result, error) run as each
+                page finishes; error is None for a successful page
+            skip_pages: Page indexes already processed, e.g. by an interrupted job
+
+        Returns:
+            list: One result per processed page, in page order
+        """
+        file_bytes = file_data.read() if hasattr(file_data, 'read') else bytes(file_data)
         extension = os.path.splitext(original_filename)[1].lower()
-        unique_filename = f"{uuid.uuid4()}{extension}"
-        temp_path = os.path.join(tempfile.gettempdir(), unique_filename)
-        
-        # Save the file temporarily
-        file_data.save(temp_path)
+
+        if extension == '.pdf':
+            rendered = self.convert_pdf_to_images(file_bytes, skip_pages)
+            base_name = os.path.splitext(original_filename)[0]
+            pages = [
+                (page.index, page, f"{base_name}_page_{page.index}{extension}")
+                for page in rendered
+            ]
+            return self._process_pages(pages, on_page)
+
+        if 0 not in skip_pages:
+            # Handle single image upload
+            result = self._process_page(file_bytes, original_filename)
+            if on_page:
+                on_page(0, result, None)
+            return [result]
         
-        try:
-            results = []
-            
-            # Process based on file type
-            if extension == '.pdf':
-                # Check if PDF processing is available
-                if not self.use_pdf2image and not self.pymupdf_available:
-                    raise ValueError("PDF processing is not available. Please install either poppler (for pdf2image) or PyMuPDF.")
-                    
-                # Convert PDF to images
-                image_paths = self.convert_pdf_to_images(temp_path)
-                
-                # Process each image as a separate bill
-                for i, image_path in enumerate(image_paths):
-                    # Upload to cloudinary
-                    upload_result = cloudinary.uploader.upload(image_path)
-                    image_url = upload_result['secure_url']
-                    
-                    # Extract text from the image
-                    extracted_text = self.extract_text_from_image(image_url)
-                    
-                    # Process the extracted text
-                    processed_data = self.process_bill_text(extracted_text)
-                    
-                    # Prepare result data
-                    page_filename = f"{os.path.splitext(original_filename)[0]}_page_{i}{extension}"
+        return []
+
+    def _process_pages(self, pages, on_page=None):
+        """Run _process_page over (index, page, filename) tuples concurrently
+
+        Returns:
+            list: Results in page order; failed pages carry an error
+        """
+        results = {}
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.page_parallelism) as executor:
+            futures = {
+                executor.submit(self._process_page, page, page_filename): (i, page_filename)
+                for i, page, page_filename in pages
+            }
+            for future in as_completed(futures):
+                i, page_filename = futures[future]
+                try:
+                    result = future.result()
+                    error = None
+                except Exception as e:
+                    logging.error(f"Error processing page {i} of bill: {str(e)}")
+                    errors.append(e)
+                    error = str(e)
                     result = {
                         "original_filename": page_filename,
-                        "image_url": image_url,
-                        "extracted_text": extracted_text,
-                        "bill_details": processed_data.get("bill_details", {}),
-                        "products": processed_data.get("products", [])
+                        "error": error,
+                        "bill_details": {},
+                        "products": []
                     }
-                    
-                    results.append(result)
-                    
-                # Clean up image paths
-                for path in image_paths:
-                    if os.path.exists(path):
-                        os.remove(path)
-            else:
-                # Handle single image upload
-                upload_result = cloudinary.uploader.upload(temp_path)
-                image_url = upload_result['secure_url']
-                
-                # Extract text from the image
-                extracted_text = self.extract_text_from_image(image_url)
-                
-                # Process the extracted text
-                processed_data = self.process_bill_text(extracted_text)
-                
-                result = {
-                    "original_filename": original_filename,
-                    "image_url": image_url,
-                    "extracted_text": extracted_text,
-                    "bill_details": processed_data.get("bill_details", {}),
-                    "products": processed_data.get("products", [])
-                }
-                
-                results.append(result)
-            
-            # Clean up temporary file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-                
-            return results
-            
-        except Exception as e:
-            # Clean up temporary file in case of error
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            raise e
\ No newline at end of file
+                results[i] = result
+                if on_page:
+                    on_page(i, result, error)
+        
+        # Nothing to show for the file at all: let the caller retry or report it
+        if pages and len(errors) == len(pages):
+            raise errors[0]
+        return [results[i] for i in sorted(results)]
+
+    def _process_page(self, page, page_filename):
+        """Upload one page image, extract its text and structure it
+
+        Args:
+            page: RenderedPage, or the bytes of an uploaded image
+        """
+        if isinstance(page, bytes):
+            # Photos are oriented, cropped and downscaled once for both the upload and the model
+            image = prepare_image(page, "bill")
+            image_bytes, mime_type, stats = image.image_bytes, image.mime_type, {"image_stats": image.stats()}
+        elif page.error:
+            # Rendering the same page again would fail the same way
+            raise ValueError(page.error)
+        else:
+            # Rendered pages are already sized by BILL_PDF_DPI and need no second JPEG pass
+            image_bytes, mime_type, stats = page.image_bytes, page.mime_type, {"render_stats": page.stats()}
+
+        # Upload to cloudinary straight from memory
+        upload_result = cloudinary.uploader.upload(io.BytesIO(image_bytes))
+        image_url = upload_result['secure_url']
+        
+        # The model gets the same bytes inline instead of fetching them back from cloudinary
+        data_url = f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+        extracted_text = self.extract_text_from_image(data_url)
+        
+        # Process the extracted text
+        processed_data = self.process_bill_text(extracted_text)
+        
+        result = {
+            "original_filename": page_filename,
+            "image_url": image_url,
+            "extracted_text": extracted_text,
+            "bill_details": processed_data.get("bill_details", {}),
+            "products": processed_data.get("products", [])
+        }
+        result.update(stats)
+        return result
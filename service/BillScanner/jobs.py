@@ -0,0 +1,184 @@
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from bson import ObjectId, Binary
+from pymongo import ReturnDocument
+
+# Uploads are kept in the job document until processed, below Mongo's 16 MB limit
+MAX_UPLOAD_BYTES = 15 * 1024 * 1024
+
+class BillJobQueue:
+    """Runs BillProcessor.process_bill_file in the background with job state in Mongo
+
+    Each upload becomes a BillJobs document holding the file, its status
+    (queued, running, completed, failed) and a result entry per finished
+    page. Workers claim queued jobs with a lease; a job whose lease expires
+    because its worker died or restarted is claimed again by any worker, and
+    pages it already finished are skipped. Jobs are retried up to
+    max_attempts times.
+    """
+
+    def __init__(self, jobs_collection, processor, bill_model, max_workers=2,
+                 lease=timedelta(minutes=10), max_attempts=3, poll_interval=5):
+        self.collection = jobs_collection
+        self.processor = processor
+        self.bill_model = bill_model
+        self.max_workers = max_workers
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bill-job")
+        self._active = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._dispatcher = None
+
+    def start(self):
+        """Start claiming jobs, including ones left unfinished by a previous run"""
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name="bill-job-dispatcher", daemon=True)
+            self._dispatcher.start()
+
+    def submit(self, file_bytes, original_filename, shop_owner=None):
+        """Queue a bill file for processing
+
+        Returns:
+            str: Job id
+        """
+        if len(file_bytes) > MAX_UPLOAD_BYTES:
+            raise ValueError(f"File too large, the limit is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+
+        now = datetime.utcnow()
+        job_id = self.collection.insert_one({
+            "status": "queued",
+            "original_filename": original_filename,
+            "shop_owner": shop_owner,
+            "file": Binary(file_bytes),
+            "file_size": len(file_bytes),
+            "pages": [],
+            "attempts": 0,
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        }).inserted_id
+        self._wake.set()
+        return str(job_id)
+
+    def get(self, job_id):
+        """Job status and the results of the pages finished so far, in page order"""
+        job = self.collection.find_one({"_id": ObjectId(job_id)}, {"file": 0})
+        if not job:
+            return None
+
+        job["job_id"] = str(job.pop("_id"))
+        job["pages"] = sorted(job.get("pages", []), key=lambda page: page["page"])
+        job["results"] = [page["result"] for page in job["pages"] if page.get("status") == "completed"]
+        return job
+
+    def _dispatch_loop(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                self._fail_exhausted_jobs()
+                while True:
+                    with self._lock:
+                        if self._active >= self.max_workers:
+                            break
+                    job = self._claim()
+                    if not job:
+                        break
+                    with self._lock:
+                        self._active += 1
+                    self._executor.submit(self._run, job)
+            except Exception as e:
+                logging.error(f"Bill job dispatch error: {str(e)}")
+
+    def _claimable(self, now):
+        return {"$or": [
+            {"status": "queued"},
+            # Abandoned by a worker that stopped renewing its lease
+            {"status": "running", "lease_expires_at": {"$lt": now}}
+        ]}
+
+    def _claim(self):
+        now = datetime.utcnow()
+        query = self._claimable(now)
+        query["attempts"] = {"$lt": self.max_attempts}
+        return self.collection.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    "status": "running",
+                    "worker": self.worker_id,
+                    "lease_expires_at": now + self.lease,
+                    "started_at": now,
+                    "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _fail_exhausted_jobs(self):
+        now = datetime.utcnow()
+        query = self._claimable(now)
+        query["attempts"] = {"$gte": self.max_attempts}
+        self.collection.update_many(query, {
+            "$set": {"status": "failed", "error": "Gave up after repeated interruptions", "finished_at": now, "updated_at": now},
+            "$unset": {"file": ""}
+        })
+
+    def _run(self, job):
+        job_id = job["_id"]
+        owned = {"_id": job_id, "worker": self.worker_id}
+        done_pages = {page["page"] for page in job.get("pages", []) if page.get("status") == "completed"}
+
+        def on_page(index, result, error):
+            now = datetime.utcnow()
+            if error:
+                page = {"page": index, "status": "failed", "error": error}
+            else:
+                bill_id = self.bill_model.create_bill(result)
+                page = {"page": index, "status": "completed", "bill_id": bill_id, "result": dict(result, bill_id=bill_id)}
+            # A page failed in an earlier attempt is replaced; a completed one is never recorded twice
+            self.collection.update_one(owned, {"$pull": {"pages": {"page": index, "status": "failed"}}})
+            self.collection.update_one(
+                dict(owned, **{"pages.page": {"$ne": index}}),
+                {
+                    "$push": {"pages": page},
+                    "$set": {"lease_expires_at": now + self.lease, "updated_at": now}
+                }
+            )
+
+        try:
+            self.processor.process_bill_file(
+                job["file"], job["original_filename"], on_page=on_page, skip_pages=done_pages
+            )
+            self._finish(owned, {"status": "completed"})
+        except ValueError as e:
+            # Unsupported input; retrying will not help
+            self._finish(owned, {"status": "failed", "error": str(e)})
+        except Exception as e:
+            logging.error(f"Bill job {job_id} failed: {str(e)}")
+            if job["attempts"] >= self.max_attempts:
+                self._finish(owned, {"status": "failed", "error": str(e)})
+            else:
+                self.collection.update_one(owned, {"$set": {
+                    "status": "queued", "error": str(e), "updated_at": datetime.utcnow()
+                }})
+        finally:
+            with self._lock:
+                self._active -= 1
+            self._wake.set()
+
+    def _finish(self, owned, fields):
+        now = datetime.utcnow()
+        fields.update({"finished_at": now, "updated_at": now})
+        # The upload is no longer needed once the job is settled
+        self.collection.update_one(owned, {"$set": fields, "$unset": {"file": "", "lease_expires_at": ""}})
@@ -0,0 +1,318 @@
+import io
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Vision models downscale large images anyway; 200 DPI keeps small print on A4 bills legible
+DEFAULT_DPI = int(os.getenv('BILL_PDF_DPI', 200))
+DEFAULT_JPEG_QUALITY = int(os.getenv('BILL_PDF_JPEG_QUALITY', 85))
+
+# Rendering pool limits
+RENDER_WORKERS = int(os.getenv('BILL_RENDER_WORKERS', os.cpu_count() or 2))
+PAGE_TIMEOUT = float(os.getenv('BILL_RENDER_PAGE_TIMEOUT', 30))
+WORKER_MEMORY_MB = int(os.getenv('BILL_RENDER_MEMORY_MB', 1024))
+# An A3 page at 300 DPI is about 17.5 million pixels; larger pages are rendered at a lower DPI
+MAX_PAGE_PIXELS = int(os.getenv('BILL_RENDER_MAX_PIXELS', 25_000_000))
+# PDFs each worker keeps open, so a PDF is sent to a worker once rather than once per page
+WORKER_DOCUMENTS = 2
+
+class RenderedPage:
+    """One PDF page rendered to an in-memory JPEG, or the reason it could not be"""
+
+    def __init__(self, index, image_bytes, render_ms, width, height, mime_type="image/jpeg", error=None):
+        self.index = index
+        self.image_bytes = image_bytes
+        self.render_ms = render_ms
+        self.width = width
+        self.height = height
+        self.mime_type = mime_type
+        self.error = error
+
+    @classmethod
+    def failed(cls, index, error):
+        return cls(index, None, 0, 0, 0, error=error)
+
+    @property
+    def size(self):
+        return len(self.image_bytes) if self.image_bytes else 0
+
+    def stats(self):
+        return {"render_ms": round(self.render_ms, 1), "bytes": self.size, "width": self.width, "height": self.height}
+
+def _rasterize(page, dpi, jpeg_quality, max_pixels=MAX_PAGE_PIXELS):
+    """Render a PyMuPDF page to (jpeg bytes, render ms, width, height)"""
+    import fitz
+
+    start = time.perf_counter()
+    zoom = dpi / 72
+    pixels = page.rect.width * zoom * page.rect.height * zoom
+    if pixels > max_pixels:
+        zoom *= (max_pixels / pixels) ** 0.5
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+    image_bytes = pix.tobytes("jpeg", jpg_quality=jpeg_quality)
+    return image_bytes, (time.perf_counter() - start) * 1000, pix.width, pix.height
+
+def render_pdf_pages(pdf_bytes, dpi=DEFAULT_DPI, jpeg_quality=DEFAULT_JPEG_QUALITY, skip_pages=()):
+    """Render every page of a PDF to JPEG bytes in this process, without touching the disk
+
+    Uses PyMuPDF; falls back to pdf2image (which needs poppler and spools
+    the PDF through a temporary file of its own) when PyMuPDF is missing.
+
+    Args:
+        pdf_bytes: Contents of the PDF
+        dpi: Render resolution
+        jpeg_quality: JPEG quality, 1-100
+        skip_pages: Page indexes not to render
+
+    Returns:
+        list: RenderedPage per rendered page, in page order
+    """
+    try:
+        import fitz  # PyMuPDF
+    except ImportError:
+        return _render_with_pdf2image(pdf_bytes, dpi, jpeg_quality, skip_pages)
+
+    pages = []
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as document:
+        for i, page in enumerate(document):
+            if i in skip_pages:
+                continue
+            pages.append(RenderedPage(i, *_rasterize(page, dpi, jpeg_quality)))
+    _log_render(pages, dpi, jpeg_quality)
+    return pages
+
+def _render_with_pdf2image(pdf_bytes, dpi, jpeg_quality, skip_pages):
+    try:
+        from pdf2image import convert_from_bytes
+    except ImportError:
+        raise ValueError("PDF processing is not available. Please install PyMuPDF (or poppler with pdf2image).")
+
+    pages = []
+    start = time.perf_counter()
+    for i, image in enumerate(convert_from_bytes(pdf_bytes, dpi=dpi)):
+        if i in skip_pages:
+            continue
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, "JPEG", quality=jpeg_quality)
+        # poppler renders the whole document in one call; the time is attributed per page
+        elapsed = (time.perf_counter() - start) * 1000
+        pages.append(RenderedPage(i, buffer.getvalue(), elapsed, image.width, image.height))
+        start = time.perf_counter()
+    _log_render(pages, dpi, jpeg_quality)
+    return pages
+
+def _log_render(pages, dpi, jpeg_quality):
+    for page in pages:
+        if page.error:
+            logging.error(f"Failed to render PDF page {page.index}: {page.error}")
+            continue
+        logging.info(
+            f"Rendered PDF page {page.index} at {dpi} DPI, quality {jpeg_quality}: "
+            f"{page.render_ms:.0f} ms, {page.size / 1024:.0f} KB, {page.width}x{page.height}"
+        )
+
+def _init_worker(memory_mb):
+    """Cap how much memory a render worker may allocate beyond what it inherited"""
+    try:
+        import resource
+        with open("/proc/self/statm") as f:
+            in_use = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+        limit = in_use + memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, OSError, ValueError):
+        # No rlimits or /proc (e.g. Windows, macOS): pages are still capped by MAX_PAGE_PIXELS
+        pass
+
+def _worker_main(conn, memory_mb):
+    """Render pages sent over conn until it closes
+
+    Messages are (document id, PDF bytes or None, page index, dpi, JPEG
+    quality, max pixels); the bytes are only sent with the first page of a
+    document this worker has not got open. Replies are ("ok", rasterized
+    page), ("error", message) or ("missing",) when asked for a document
+    it no longer has.
+    """
+    import fitz
+
+    _init_worker(memory_mb)
+    documents = OrderedDict()
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        doc_id, pdf_bytes, index, dpi, jpeg_quality, max_pixels = message
+        try:
+            if pdf_bytes is not None:
+                documents.pop(doc_id, None)
+                documents[doc_id] = fitz.open(stream=pdf_bytes, filetype="pdf")
+                while len(documents) > WORKER_DOCUMENTS:
+                    documents.popitem(last=False)[1].close()
+            elif doc_id in documents:
+                documents.move_to_end(doc_id)
+            else:
+                conn.send(("missing",))
+                continue
+            reply = ("ok", _rasterize(documents[doc_id][index], dpi, jpeg_quality, max_pixels))
+        except MemoryError:
+            reply = ("error", f"Page needs more than {memory_mb} MB to render")
+        except Exception as e:
+            # MuPDF's own exceptions cannot be sent back from the worker
+            reply = ("error", str(e))
+        conn.send(reply)
+
+class _RenderTask:
+    def __init__(self, doc_id, pdf_bytes, index, dpi, jpeg_quality):
+        self.doc_id = doc_id
+        self.pdf_bytes = pdf_bytes
+        self.index = index
+        self.dpi = dpi
+        self.jpeg_quality = jpeg_quality
+        self.future = Future()
+
+class RenderPool:
+    """Renders PDF pages in a bounded set of worker processes shared by every request
+
+    Rasterization is CPU-bound and holds the GIL, so it runs outside the
+    web and job threads, one page per task so pages of several PDFs spread
+    across cores. Each worker process is driven by its own thread here,
+    which hands it one page at a time: the page timeout starts when the
+    worker actually gets the page, and a page still rendering after
+    page_timeout seconds stops only its own worker, which is replaced.
+    Workers keep the last few PDFs open, so a PDF crosses the process
+    boundary once per worker rather than once per page. Each worker's
+    memory is capped and page size is capped in pixels.
+    """
+
+    def __init__(self, max_workers=RENDER_WORKERS, page_timeout=PAGE_TIMEOUT,
+                 memory_mb=WORKER_MEMORY_MB, max_pixels=MAX_PAGE_PIXELS):
+        self.max_workers = max_workers
+        self.page_timeout = page_timeout
+        self.memory_mb = memory_mb
+        self.max_pixels = max_pixels
+        self._tasks = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._serve, name=f"pdf-render-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _spawn(self):
+        # fork starts workers without re-importing app.py, which connects to Mongo at import time
+        context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else multiprocessing
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(target=_worker_main, args=(child_conn, self.memory_mb), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def _stop(self, process, conn):
+        conn.close()
+        if process.is_alive():
+            process.terminate()
+        process.join(1)
+
+    def _serve(self):
+        """Feed one worker process pages from the shared queue, replacing it when it hangs or dies"""
+        process, conn = None, None
+        loaded = OrderedDict()
+        while True:
+            task = self._tasks.get()
+            try:
+                if process is None or not process.is_alive():
+                    if process is not None:
+                        self._stop(process, conn)
+                    process, conn = self._spawn()
+                    loaded.clear()
+                status, value = self._run(task, conn, loaded)
+            except (EOFError, OSError) as e:
+                status, value = "stopped", f"The rendering worker stopped: {str(e) or type(e).__name__}"
+            except Exception as e:
+                status, value = "error", str(e)
+
+            if status == "ok":
+                task.future.set_result(value)
+                continue
+            if status in ("timeout", "stopped"):
+                self._stop(process, conn)
+                process, conn = None, None
+            loaded.pop(task.doc_id, None)
+            task.future.set_exception(RuntimeError(value))
+
+    def _run(self, task, conn, loaded):
+        """Send a page to the worker behind conn and wait for it at most page_timeout seconds"""
+        send_bytes = task.doc_id not in loaded
+        while True:
+            conn.send((
+                task.doc_id, task.pdf_bytes if send_bytes else None,
+                task.index, task.dpi, task.jpeg_quality, self.max_pixels
+            ))
+            if send_bytes:
+                # Mirrors the worker's own list of open documents
+                loaded[task.doc_id] = True
+                while len(loaded) > WORKER_DOCUMENTS:
+                    loaded.popitem(last=False)
+            else:
+                loaded.move_to_end(task.doc_id)
+            if not conn.poll(self.page_timeout):
+                return "timeout", f"Rendering timed out after {self.page_timeout:g} s"
+            reply = conn.recv()
+            if reply[0] == "missing" and not send_bytes:
+                send_bytes = True
+                continue
+            return reply if reply[0] == "ok" else ("error", reply[-1])
+
+    def render(self, pdf_bytes, dpi=DEFAULT_DPI, jpeg_quality=DEFAULT_JPEG_QUALITY, skip_pages=()):
+        """Render the pages of a PDF in the pool
+
+        Returns:
+            list: RenderedPage per page not in skip_pages, in page order;
+                a page that failed, timed out or exceeded the memory cap
+                carries an error instead of image bytes
+
+        Raises:
+            ValueError: The file is not a readable PDF
+        """
+        try:
+            import fitz  # PyMuPDF
+        except ImportError:
+            return render_pdf_pages(pdf_bytes, dpi, jpeg_quality, skip_pages)
+
+        # Only the page tree is read here; pages are parsed and drawn in the workers
+        try:
+            with fitz.open(stream=pdf_bytes, filetype="pdf") as document:
+                page_count = document.page_count
+        except Exception as e:
+            raise ValueError(f"Could not read PDF: {str(e)}")
+
+        self._start()
+        doc_id = uuid.uuid4().hex
+        tasks = [
+            _RenderTask(doc_id, pdf_bytes, index, dpi, jpeg_quality)
+            for index in range(page_count)
+            if index not in skip_pages
+        ]
+        for task in tasks:
+            self._tasks.put(task)
+
+        rendered = []
+        for task in tasks:
+            try:
+                rendered.append(RenderedPage(task.index, *task.future.result()))
+            except Exception as e:
+                rendered.append(RenderedPage.failed(task.index, str(e)))
+        _log_render(rendered, dpi, jpeg_quality)
+        return rendered
+
+# Shared by every request and bill job in the process; workers start on first use
+render_pool = RenderPool()
@@ -0,0 +1,44 @@
+import threading
+import time
+
+class ActivityCache:
+    """Short-lived per-shop cache of the recent activity feed
+
+    The dashboard polls /customers/recent-activity, so the feed is kept for a
+    few seconds and dropped as soon as a sale for the shop is written or
+    deleted. Entries live in process memory; with several workers the TTL
+    bounds how stale another worker's copy can be.
+    """
+
+    def __init__(self, ttl_seconds=15):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, shop_owner, limit):
+        """Return up to limit cached activities, or None if not cached for that many"""
+        with self._lock:
+            entry = self._entries.get(shop_owner)
+            if not entry:
+                return None
+
+            expires_at, cached_limit, activities = entry
+            if expires_at < time.monotonic():
+                del self._entries[shop_owner]
+                return None
+
+        # A feed cached for a larger limit also answers smaller ones
+        if cached_limit < limit and len(activities) >= cached_limit:
+            return None
+        return activities[:limit]
+
+    def set(self, shop_owner, limit, activities):
+        with self._lock:
+            self._entries[shop_owner] = (time.monotonic() + self.ttl_seconds, limit, activities)
+
+    def invalidate(self, shop_owner):
+        with self._lock:
+            self._entries.pop(shop_owner, None)
+
+# Shared by the customers and sales blueprints
+activity_cache = ActivityCache()
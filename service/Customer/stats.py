@@ -0,0 +1,124 @@
+from bson import ObjectId
+from pymongo import UpdateOne
+import logging
+
+def _customer_filter(customer_id, shop_owner):
+    """Sales store the customer id as a string"""
+    if not customer_id or not ObjectId.is_valid(str(customer_id)):
+        return None
+    return {'_id': ObjectId(str(customer_id)), 'shop_owner': shop_owner}
+
+def _sale_amount(sale):
+    try:
+        return float(sale.get('total_amount') or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def record_sale(customer_collection, sale, session=None):
+    """Add a new sale to its customer's lifetime-value counters"""
+    customer_filter = _customer_filter(sale.get('customer_id'), sale.get('shop_owner'))
+    if not customer_filter:
+        return
+
+    customer_collection.update_one(
+        customer_filter,
+        {
+            '$inc': {'total_spent': _sale_amount(sale), 'order_count': 1},
+            '$max': {'last_purchase_at': sale['created_at']}
+        },
+        session=session
+    )
+
+def revert_sale(customer_collection, sales_collection, sale, session=None):
+    """Remove a deleted sale from its customer's counters
+
+    Must run after the sale itself is deleted so last_purchase_at can be
+    recomputed from the customer's remaining sales.
+    """
+    customer_filter = _customer_filter(sale.get('customer_id'), sale.get('shop_owner'))
+    if not customer_filter:
+        return
+
+    latest = sales_collection.find_one(
+        {'shop_owner': sale.get('shop_owner'), 'customer_id': sale.get('customer_id')},
+        {'created_at': 1},
+        sort=[('created_at', -1)],
+        session=session
+    )
+    customer_collection.update_one(
+        customer_filter,
+        {
+            '$inc': {'total_spent': -_sale_amount(sale), 'order_count': -1},
+            '$set': {'last_purchase_at': latest.get('created_at') if latest else None}
+        },
+        session=session
+    )
+
+def rebuild_customer_stats(customer_collection, sales_collection, batch_size=500):
+    """Recompute total_spent, order_count and last_purchase_at from the Sales collection
+
+    Each customer's counters are replaced by their recomputed values in a
+    single $set, never zeroed first, so a concurrent record_sale is not
+    wiped while the rebuild runs. A sale recorded between the aggregation
+    reading it and the customer's $set can still be lost or counted
+    twice, so run this while no sales are being taken.
+
+    Returns:
+        dict: Number of customers updated from sales and reset for having none
+    """
+    totals = sales_collection.aggregate([
+        {'$match': {'customer_id': {'$nin': [None, '']}}},
+        {'$group': {
+            '_id': {'shop_owner': '$shop_owner', 'customer_id': '$customer_id'},
+            'total_spent': {'$sum': {
+                '$convert': {'input': '$total_amount', 'to': 'double', 'onError': 0, 'onNull': 0}
+            }},
+            'order_count': {'$sum': 1},
+            'last_purchase_at': {'$max': '$created_at'}
+        }}
+    ], allowDiskUse=True)
+
+    stats = {'updated': 0, 'reset': 0}
+    operations = []
+
+    def flush(stat):
+        nonlocal operations
+        if operations:
+            stats[stat] += customer_collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+
+    with_sales = set()
+    for total in totals:
+        customer_filter = _customer_filter(total['_id']['customer_id'], total['_id']['shop_owner'])
+        if not customer_filter:
+            continue
+
+        with_sales.add((customer_filter['_id'], customer_filter['shop_owner']))
+        operations.append(UpdateOne(customer_filter, {'$set': {
+            'total_spent': total['total_spent'],
+            'order_count': total['order_count'],
+            'last_purchase_at': total['last_purchase_at']
+        }}))
+        if len(operations) >= batch_size:
+            flush('updated')
+    flush('updated')
+
+    # Customers without any sales end up with zeroed counters
+    counted = customer_collection.find(
+        {'$or': [{'order_count': {'$ne': 0}}, {'total_spent': {'$ne': 0}}]},
+        {'shop_owner': 1, 'order_count': 1}
+    )
+    for customer in counted:
+        if (customer['_id'], customer.get('shop_owner')) in with_sales:
+            continue
+        # Matches only while order_count is unchanged, so a sale recorded since is kept
+        operations.append(UpdateOne(
+            {'_id': customer['_id'], 'order_count': customer.get('order_count')},
+            {'$set': {'total_spent': 0, 'order_count': 0, 'last_purchase_at': None}}
+        ))
+        if len(operations) >= batch_size:
+            flush('reset')
+    flush('reset')
+
+    logging.info(f"Customer stats rebuild finished: {stats}")
+    return stats
@@ -0,0 +1,212 @@
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from .product_search import ProductSearchHelper
+from .search_index import normalize_search_text
+
+# Fields kept in memory for each medicine, enough to render a suggestion
+CATALOGUE_FIELDS = {
+    "product_name": 1,
+    "product_manufactured": 1,
+    "salt_composition": 1,
+    "sub_category": 1,
+    "product_price": 1,
+    "image_url": 1,
+    "updated_at": 1
+}
+
+def name_trigrams(name):
+    """Character trigrams of a normalized name, padded so short words still match"""
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class MedicineCatalogue:
+    """Memory-resident copy of the medicine catalogue for typo-tolerant autocomplete
+
+    Holds a pre-tokenized name table (normalized names and their trigrams) and
+    an id map, so suggestions are served without a round trip to Mongo.
+    Candidates sharing the most trigrams with the query are scored with
+    ProductSearchHelper.fuzzy_match_products. The copy is refreshed
+    incrementally from documents whose updated_at moved past the newest one
+    already loaded, at most once per refresh_interval seconds; medicines
+    deleted from Mongo are dropped by an id-only scan at most once per
+    prune_interval seconds.
+    """
+
+    def __init__(self, medicine_collection, refresh_interval=60, candidate_limit=200, prune_interval=600):
+        self.medicine_collection = medicine_collection
+        self.refresh_interval = refresh_interval
+        self.candidate_limit = candidate_limit
+        self.prune_interval = prune_interval
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self._slots = {}        # medicine id -> slot
+        self._medicines = []    # slot -> medicine summary
+        self._names = []        # slot -> normalized name
+        self._trigrams = {}     # trigram -> set of slots
+        self._last_updated_at = None
+        self._last_refresh = None
+        self._last_prune = None
+
+    def __len__(self):
+        return len(self._slots)
+
+    def load(self):
+        """Build the catalogue from the whole Medicine collection"""
+        started = time.perf_counter()
+        with self._lock:
+            self._clear()
+            self.load_documents(self.medicine_collection.find({}, CATALOGUE_FIELDS))
+            self._last_refresh = self._last_prune = time.monotonic()
+        logging.info(f"Medicine catalogue loaded {len(self)} medicines in {time.perf_counter() - started:.2f}s")
+
+    def refresh(self):
+        """Pull medicines added or changed since the last load or refresh"""
+        with self._lock:
+            if self._last_refresh is None:
+                return self.load()
+
+            query = {}
+            if self._last_updated_at is not None:
+                query["updated_at"] = {"$gt": self._last_updated_at}
+            self.load_documents(self.medicine_collection.find(query, CATALOGUE_FIELDS))
+            self._last_refresh = time.monotonic()
+
+            if time.monotonic() - self._last_prune >= self.prune_interval:
+                self.prune()
+
+    def prune(self):
+        """Drop medicines that no longer exist in the Medicine collection"""
+        with self._lock:
+            existing = {str(medicine["_id"]) for medicine in self.medicine_collection.find({}, {"_id": 1})}
+            removed = [medicine_id for medicine_id in self._slots if medicine_id not in existing]
+            for medicine_id in removed:
+                self._remove(medicine_id)
+            self._last_prune = time.monotonic()
+        if removed:
+            logging.info(f"Medicine catalogue dropped {len(removed)} deleted medicines")
+
+    def _remove(self, medicine_id):
+        # The slot stays allocated but unreachable until the next full load
+        slot = self._slots.pop(medicine_id)
+        for trigram in name_trigrams(self._names[slot]):
+            self._trigrams.get(trigram, set()).discard(slot)
+        self._medicines[slot] = None
+        self._names[slot] = ""
+
+    def load_documents(self, medicines):
+        """Insert or replace medicines in the in-memory tables"""
+        with self._lock:
+            for medicine in medicines:
+                self._upsert(medicine)
+
+    def _upsert(self, medicine):
+        medicine_id = str(medicine["_id"])
+        summary = {key: medicine.get(key) for key in CATALOGUE_FIELDS if key != "updated_at"}
+        summary["_id"] = medicine_id
+        name = normalize_search_text(medicine.get("product_name") or medicine.get("name"))
+
+        slot = self._slots.get(medicine_id)
+        if slot is None:
+            slot = len(self._medicines)
+            self._slots[medicine_id] = slot
+            self._medicines.append(summary)
+            self._names.append(name)
+        else:
+            for trigram in name_trigrams(self._names[slot]):
+                self._trigrams.get(trigram, set()).discard(slot)
+            self._medicines[slot] = summary
+            self._names[slot] = name
+
+        for trigram in name_trigrams(name):
+            self._trigrams.setdefault(trigram, set()).add(slot)
+
+        updated_at = medicine.get("updated_at")
+        # Older documents may carry local-time stamps ahead of UTC; a watermark
+        # in the future would hide every change until the clock caught up
+        if isinstance(updated_at, datetime):
+            updated_at = min(updated_at, datetime.utcnow())
+        if updated_at is not None and (self._last_updated_at is None or updated_at > self._last_updated_at):
+            self._last_updated_at = updated_at
+
+    def _maybe_refresh(self):
+        if self._last_refresh is None or time.monotonic() - self._last_refresh >= self.refresh_interval:
+            try:
+                self.refresh()
+            except Exception as e:
+                # Serve the copy we have rather than failing the request
+                logging.error(f"Medicine catalogue refresh failed: {str(e)}")
+
+    def get(self, medicine_id):
+        """Look up a medicine summary by id"""
+        slot = self._slots.get(str(medicine_id))
+        return dict(self._medicines[slot]) if slot is not None else None
+
+    def autocomplete(self, term, limit=10, threshold=60):
+        """Suggest medicines for a partially typed, possibly misspelt name
+
+        Args:
+            term: Text typed so far
+            limit: Maximum number of suggestions
+            threshold: Minimum fuzzy score (0-100) for non-prefix matches
+
+        Returns:
+            list: Medicine summaries with match_score, best first
+        """
+        self._maybe_refresh()
+
+        query = normalize_search_text(term)
+        if not query:
+            return []
+
+        with self._lock:
+            candidates = self._candidate_slots(query)
+            products = [
+                dict(self._medicines[slot], search_name=self._names[slot])
+                for slot in candidates
+            ]
+
+        # Score against as many leading words as were typed, so a misspelt
+        # brand is not penalised for the strength and form that follow it
+        query_words = len(query.split())
+        for product in products:
+            product["match_name"] = " ".join(product["search_name"].split()[:query_words])
+
+        # Names that start with what was typed always lead
+        prefix_hits = [dict(p, match_score=100) for p in products if p["search_name"].startswith(query)]
+        prefix_ids = {p["_id"] for p in prefix_hits}
+        fuzzy_hits = ProductSearchHelper.fuzzy_match_products(
+            query,
+            [p for p in products if p["_id"] not in prefix_ids],
+            threshold=threshold,
+            name_key="match_name",
+            limit=limit
+        )
+
+        prefix_hits.sort(key=lambda p: (len(p["search_name"]), p["search_name"]))
+        suggestions = (prefix_hits + fuzzy_hits)[:limit]
+        for suggestion in suggestions:
+            suggestion.pop("search_name", None)
+            suggestion.pop("match_name", None)
+        return suggestions
+
+    def _candidate_slots(self, query):
+        """Slots sharing the most trigrams with the query"""
+        grams = name_trigrams(query)
+        postings = [self._trigrams[gram] for gram in grams if gram in self._trigrams]
+        if not postings:
+            return []
+
+        # Skip grams common to a large share of the catalogue when rarer ones exist
+        common_cutoff = max(len(self._slots) // 5, self.candidate_limit)
+        selective = [posting for posting in postings if len(posting) <= common_cutoff]
+        postings = selective or postings
+
+        counts = Counter()
+        for posting in postings:
+            counts.update(posting)
+        return [slot for slot, _ in counts.most_common(self.candidate_limit)]
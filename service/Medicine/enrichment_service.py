@@ -1,8 +1,17 @@
+import copy
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from .web_scraper import MedicineWebScraper
+from .search_index import MedicineSearch, medicine_name_key, normalize_search_text
+from .negative_cache import EnrichmentMissCache
+from .single_flight import SingleFlight, MongoLease
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from Product.models import Medicine
 
+# Shared by every enrichment service in the process (product and bill scanner routes)
+enrichment_flights = SingleFlight()
+
 class MedicineEnrichmentService:
     """Service to enrich the medicine database with data from web sources"""
     
@@ -22,6 +31,19 @@ class MedicineEnrichmentService:
             logging.warning("Medicine collection not found in expected format. Trying fallback approach.")
             self.medicine_collection = db_service.get_collection('Medicine')
             
+        self.search = MedicineSearch(self.medicine_collection)
+        
+        # Names no online source could find, kept next to the Medicine collection
+        miss_collection = getattr(db_service, 'enrichment_miss_collection', None)
+        if miss_collection is None:
+            miss_collection = self.medicine_collection.database.EnrichmentMisses
+        self.miss_cache = EnrichmentMissCache(miss_collection)
+        
+        # Lets only one gunicorn worker scrape a given medicine at a time
+        lease_collection = getattr(db_service, 'enrichment_lease_collection', None)
+        if lease_collection is None:
+            lease_collection = self.medicine_collection.database.EnrichmentLeases
+        self.lease = MongoLease(lease_collection)
         self.scraper = MedicineWebScraper(debug=debug)
         self.debug = debug
         
@@ -38,102 +60,168 @@ class MedicineEnrichmentService:
         Returns:
             Dict containing medicine information and status
         """
-        try:            # First try to find in our database using a more flexible search
-            # Use a case-insensitive search that doesn't require exact match
-            query = {"product_name": {"$regex": medicine_name, "$options": "i"}}
-            if manufacturer:
-                query["product_manufactured"] = {"$regex": manufacturer, "$options": "i"}
-            
-            existing_medicine = self.medicine_collection.find_one(query)
+        try:
+            existing_medicine = self._find_existing(medicine_name, manufacturer)
+            if existing_medicine:
+                return self._found_result(existing_medicine)
             
-            # If not found with flexible search, try alternative approaches
-            if not existing_medicine:
-                # Try normalized name (remove extra spaces, convert to lowercase)
-                normalized_name = " ".join(medicine_name.lower().split())
-                alternative_queries = [
-                    {"product_name": {"$regex": f"{normalized_name}", "$options": "i"}},
-                    # Try with partial name matching
-                    {"product_name": {"$regex": f".*{normalized_name}.*", "$options": "i"}}
-                ]
-                
-                for alt_query in alternative_queries:
-                    if manufacturer:
-                        alt_query["product_manufactured"] = {"$regex": manufacturer, "$options": "i"}
-                    existing_medicine = self.medicine_collection.find_one(alt_query)
-                    if existing_medicine:
-                        break
+            # Concurrent requests for the same medicine share one online lookup
+            flight_key = "|".join([
+                normalize_search_text(medicine_name),
+                normalize_search_text(manufacturer),
+                "verify" if user_verification else "save"
+            ])
+            result = enrichment_flights.do(
+                flight_key,
+                lambda: self._enrich_under_lease(flight_key, medicine_name, manufacturer, user_verification, try_simplified)
+            )
+            # Callers that shared the lookup each get their own copy, medicine included
+            return copy.deepcopy(result)
             
+        except Exception as e:
+            logging.error(f"Error in medicine enrichment: {str(e)}")
+            return {
+                "status": "error",
+                "message": f"Error during medicine enrichment: {str(e)}"
+            }
+    
+    def _find_existing(self, medicine_name, manufacturer=None):
+        """Equality lookup on the canonical name key, then the ranked search
+        for names spelt too differently to share a key"""
+        existing_medicine = self.find_by_name_key(medicine_name, manufacturer)
+        if not existing_medicine:
+            matches = self.search.search(medicine_name, manufacturer=manufacturer, limit=1)
+            existing_medicine = matches[0] if matches else None
+        return existing_medicine
+    
+    def _found_result(self, medicine):
+        medicine["_id"] = str(medicine["_id"])
+        return {
+            "status": "found",
+            "medicine": medicine,
+            "message": "Medicine found in database"
+        }
+    
+    def _enrich_under_lease(self, flight_key, medicine_name, manufacturer, user_verification, try_simplified):
+        """Look the medicine up online while holding the cross-worker lease for it"""
+        token = self.lease.acquire(flight_key)
+        if token is None:
+            # Another worker is enriching this medicine; use what it saves
+            logging.info(f"Waiting for another worker enriching '{medicine_name}'")
+            existing_medicine = self.lease.wait(
+                flight_key,
+                done=lambda: self._find_existing(medicine_name, manufacturer)
+            )
             if existing_medicine:
-                # Medicine already exists
-                existing_medicine["_id"] = str(existing_medicine["_id"])
-                return {
-                    "status": "found",
-                    "medicine": existing_medicine,
-                    "message": "Medicine found in database"
-                }
-            
+                return self._found_result(existing_medicine)
+            if self.miss_cache.contains(medicine_name):
+                return self._not_found_result(medicine_name)
+            # The other worker gave up without a result; try ourselves
+            token = self.lease.acquire(flight_key)
+        
+        try:
+            # Saved by another worker between our lookup and taking the lease
+            existing_medicine = self._find_existing(medicine_name, manufacturer)
+            if existing_medicine:
+                return self._found_result(existing_medicine)
+            return self._enrich_online(medicine_name, manufacturer, user_verification, try_simplified)
+        finally:
+            if token:
+                self.lease.release(flight_key, token)
+    
+    def _not_found_result(self, medicine_name):
+        return {
+            "status": "not_found",
+            "message": f"Could not find information for medicine '{medicine_name}'"
+        }
+    
+    def _enrich_online(self, medicine_name, manufacturer, user_verification, try_simplified):
+        """Scrape the medicine, save it unless verification is required, and
+        retry with a simplified name if nothing was found"""
+        # Skip the online sources if they recently had nothing for this name
+        if self.miss_cache.contains(medicine_name):
+            logging.info(f"Medicine '{medicine_name}' recently not found online. Skipping scrape.")
+            medicine_data = None
+        else:
             # Medicine not in database, search online
             logging.info(f"Medicine '{medicine_name}' not found in database. Searching online...")
             
             # Scrape medicine details from online sources
             medicine_data = self.scraper.search_and_scrape_medicine(medicine_name)
+            if not medicine_data:
+                self.miss_cache.record(medicine_name)
+        
+        if medicine_data:
+            if user_verification:
+                # Return without saving for user verification
+                return {
+                    "status": "needs_verification",
+                    "medicine": medicine_data,
+                    "message": "Medicine found online. Verification required before saving."
+                }
             
-            if medicine_data:
-                if user_verification:
-                    # Return without saving for user verification
-                    return {
-                        "status": "needs_verification",
-                        "medicine": medicine_data,
-                        "message": "Medicine found online. Verification required before saving."
-                    }
-                
-                # Save the enriched medicine data
-                return self._save_enriched_medicine(medicine_data)
+            # Save the enriched medicine data
+            return self._save_enriched_medicine(medicine_data)
+        
+        # Try simplified search if enabled and original search failed
+        if try_simplified and ' ' in medicine_name:
+            # Extract basic product name (first 3 words)
+            words = medicine_name.split()
+            simplified_name = ' '.join(words[:min(3, len(words))])
             
-            # Try simplified search if enabled and original search failed
-            if try_simplified and ' ' in medicine_name:
-                # Extract basic product name (first 3 words)
-                words = medicine_name.split()
-                simplified_name = ' '.join(words[:min(3, len(words))])
+            # Compared normalized, so the retry never waits on our own lease
+            if normalize_search_text(simplified_name) != normalize_search_text(medicine_name):
+                logging.info(f"Trying simplified search for '{simplified_name}'")
+                
+                # Recursive call with simplified name, but prevent further simplification
+                simplified_result = self.find_or_enrich_medicine(
+                    simplified_name, 
+                    manufacturer=manufacturer,
+                    user_verification=user_verification,
+                    try_simplified=False  # Prevent infinite recursion
+                )
                 
-                if simplified_name != medicine_name:
-                    logging.info(f"Trying simplified search for '{simplified_name}'")
-                    
-                    # Recursive call with simplified name, but prevent further simplification
-                    simplified_result = self.find_or_enrich_medicine(
-                        simplified_name, 
-                        manufacturer=manufacturer,
-                        user_verification=user_verification,
-                        try_simplified=False  # Prevent infinite recursion
+                if simplified_result["status"] in ["found", "needs_verification", "enriched"]:
+                    # Preserve original product name on a copy, leaving the simplified lookup's result as it was
+                    medicine_data = dict(
+                        simplified_result["medicine"],
+                        product_name=medicine_name,
+                        simplified_search_term=simplified_name
                     )
-                    
-                    if simplified_result["status"] in ["found", "needs_verification", "enriched"]:
-                        medicine_data = simplified_result["medicine"]
-                        # Preserve original product name
-                        medicine_data["product_name"] = medicine_name
-                        medicine_data["simplified_search_term"] = simplified_name
-                        return simplified_result
-            
-            # Nothing found
-            return {
-                "status": "not_found",
-                "message": f"Could not find information for medicine '{medicine_name}'"
-            }
-            
-        except Exception as e:
-            logging.error(f"Error in medicine enrichment: {str(e)}")
-            return {
-                "status": "error",
-                "message": f"Error during medicine enrichment: {str(e)}"
-            }
+                    return dict(simplified_result, medicine=medicine_data)
+        
+        # Nothing found
+        return self._not_found_result(medicine_name)
     
+    def find_by_name_key(self, medicine_name, manufacturer=None):
+        """Find a medicine by canonical name key and manufacturer
+
+        Without a manufacturer, only an unambiguous match is returned.
+        """
+        name_key = medicine_name_key(medicine_name)
+        if not name_key:
+            return None
+
+        candidates = list(self.medicine_collection.find({"name_key": name_key}, MedicineSearch.projection).limit(20))
+        if not manufacturer:
+            # Several manufacturers make this product; without one there is no right answer
+            return candidates[0] if len(candidates) == 1 else None
+
+        wanted = normalize_search_text(manufacturer)
+        for candidate in candidates:
+            if normalize_search_text(candidate.get("product_manufactured")).startswith(wanted):
+                return candidate
+        return None
+
     def _save_enriched_medicine(self, medicine_data):
         """Save enriched medicine data to database"""
         try:
-            # Check if medicine with same product_name already exists
-            existing_medicine = self.medicine_collection.find_one({
-                "product_name": {"$regex": f"^{medicine_data.get('product_name')}$", "$options": "i"}
-            })
+            # Check if medicine with same name key and manufacturer already exists
+            key_filter = {
+                "name_key": medicine_name_key(medicine_data.get("product_name")),
+                "product_manufactured": medicine_data.get("product_manufactured", "Unknown")
+            }
+            existing_medicine = self.medicine_collection.find_one(key_filter, MedicineSearch.projection)
             
             if existing_medicine:
                 # Medicine already exists, return it instead of saving a duplicate
@@ -159,10 +247,20 @@ class MedicineEnrichmentService:
             )
             
             # Insert into database
-            result = self.medicine_collection.insert_one(medicine.to_dict())
+            try:
+                result = self.medicine_collection.insert_one(medicine.to_dict())
+            except DuplicateKeyError:
+                # Saved by a concurrent request since the check above
+                existing_medicine = self.medicine_collection.find_one(key_filter, MedicineSearch.projection)
+                existing_medicine["_id"] = str(existing_medicine["_id"])
+                return {
+                    "status": "found",
+                    "medicine": existing_medicine,
+                    "message": "Medicine with same name already exists in database"
+                }
             
             # Get the inserted medicine
-            enriched_medicine = self.medicine_collection.find_one({"_id": result.inserted_id})
+            enriched_medicine = self.medicine_collection.find_one({"_id": result.inserted_id}, MedicineSearch.projection)
             enriched_medicine["_id"] = str(enriched_medicine["_id"])
             
             return {
@@ -199,13 +297,68 @@ class MedicineEnrichmentService:
     
     def enrich_medicines_from_list(self, medicine_names, user_verification=False):
         """Enrich multiple medicines from a list of names"""
-        results = []
+        return self.enrich_medicines(medicine_names, user_verification=user_verification)
+    
+    def enrich_medicines(self, medicine_names, user_verification=False, max_workers=4):
+        """
+        Find or enrich many medicines at once
         
-        for medicine_name in medicine_names:
-            result = self.find_or_enrich_medicine(
-                medicine_name, 
-                user_verification=user_verification
-            )
-            results.append(result)
-            
+        Names are deduplicated by canonical name key (which keeps strength
+        and dosage form apart), medicines already in the catalogue are found
+        with one $in query, and only the misses are looked up online,
+        max_workers at a time.
+        
+        Returns:
+            List of results in the same order as medicine_names, each shaped
+            like find_or_enrich_medicine's
+        """
+        keys = [medicine_name_key(name) for name in medicine_names]
+        
+        # First spelling seen for each distinct medicine
+        names_by_key = {}
+        for name, key in zip(medicine_names, keys):
+            if key:
+                names_by_key.setdefault(key, name)
+        
+        results_by_key = {}
+        try:
+            candidates = {}
+            cursor = self.medicine_collection.find({"name_key": {"$in": list(names_by_key)}}, MedicineSearch.projection)
+            for medicine in cursor:
+                candidates.setdefault(medicine["name_key"], []).append(medicine)
+            for key, medicines in candidates.items():
+                # A key several manufacturers share is resolved by the full lookup below
+                if len(medicines) != 1:
+                    continue
+                medicine = medicines[0]
+                medicine["_id"] = str(medicine["_id"])
+                results_by_key[key] = {
+                    "status": "found",
+                    "medicine": medicine,
+                    "message": "Medicine found in database"
+                }
+        except Exception as e:
+            # Every name is then looked up on its own below
+            logging.error(f"Error in batch medicine lookup: {str(e)}")
+        
+        misses = [key for key in names_by_key if key not in results_by_key]
+        if misses:
+            logging.info(f"Batch enrichment: {len(results_by_key)} found, {len(misses)} to look up")
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                lookups = executor.map(
+                    lambda key: self.find_or_enrich_medicine(names_by_key[key], user_verification=user_verification),
+                    misses
+                )
+                results_by_key.update(zip(misses, lookups))
+        
+        results = []
+        for name, key in zip(medicine_names, keys):
+            if key in results_by_key:
+                # Repeated names share one lookup but get their own result and medicine
+                results.append(copy.deepcopy(results_by_key[key]))
+            else:
+                results.append({
+                    "status": "not_found",
+                    "message": f"Could not find information for medicine '{name}'"
+                })
         return results
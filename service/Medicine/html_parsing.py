@@ -0,0 +1,57 @@
+import re
+from bs4 import BeautifulSoup, SoupStrainer
+
+# lxml builds trees several times faster than html.parser; use it when installed
+try:
+    import lxml  # noqa: F401
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+# Containers holding product links on search result pages
+SEARCH_RESULT_CLASSES = {
+    "1mg": (
+        "style__horizontal-card___1Zwmt",
+        "style__product-card___1gbex",
+        "style__product-box___3oEU6",
+        "col-md-3"
+    )
+}
+
+# Overview, header and image containers read from product pages
+PRODUCT_CONTENT_CLASSES = {
+    "1mg": (
+        "DrugOverview__content___3nCO5",
+        "ProductDescription__content___1rfvD",
+        "DrugHeader__title-content___2ZaPo",
+        "DrugHeader__title-container___T5ZQl",
+        "DrugHeader__manufacturer___2Lo7m",
+        "ProductTitle__product-title___3QMYH",
+        "ProductTitle__manufacturer___ksLyz",
+        "style__pro-title___3jEIO",
+        "saltInfo"
+    ),
+    "Netmeds": ("inner-content", "product-detail"),
+    "PharmEasy": (
+        "MedicineOverviewSection_medicineContainer__gGsPN",
+        "style__container___2ZDHh",
+        "ProductImageCarousel_productImageContainer__cfrYX"
+    ),
+    "Apollo247": ("MedicineDetailsContent", "MuiCardContent-root")
+}
+
+def parse_html(html_content):
+    """Parse a whole page with the fastest available parser"""
+    return BeautifulSoup(html_content, PARSER)
+
+def parse_containers(html_content, class_names):
+    """Parse only elements carrying one of class_names, with their subtrees
+
+    Everything outside those containers is skipped while parsing, so no
+    tree is built for navigation, scripts and the rest of a large page.
+    """
+    if not class_names:
+        return parse_html(html_content)
+    # Matches whether bs4 compares each class or the whole class attribute
+    pattern = re.compile(r"(?:^|\s)(?:" + "|".join(re.escape(name) for name in class_names) + r")(?:\s|$)")
+    return BeautifulSoup(html_content, PARSER, parse_only=SoupStrainer(class_=pattern))
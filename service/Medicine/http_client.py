@@ -0,0 +1,151 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_HEADERS = {
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1",
+    "Cache-Control": "max-age=0"
+}
+
+# Responses worth another attempt after a pause
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+def build_session(user_agent, pool_size=4):
+    """requests.Session with pooled keep-alive connections
+
+    The transport does not retry on its own: retries go through fetch() so
+    every attempt is counted against the host's rate limit.
+    """
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    session.headers["User-Agent"] = user_agent
+    return session
+
+class TokenBucket:
+    """Allows rate requests per second on average with bursts of up to capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, cancelled=None):
+        """Take one token, waiting only if the budget is spent
+
+        Returns:
+            bool: False if cancelled (a threading.Event) was set while waiting
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait_seconds = (1 - self._tokens) / self.rate
+
+            if cancelled is not None:
+                if cancelled.wait(wait_seconds):
+                    return False
+            else:
+                time.sleep(wait_seconds)
+
+class HostRateLimiter:
+    """One token bucket per host, shared by every thread using the limiter"""
+
+    def __init__(self, rate=0.5, capacity=3):
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url, cancelled=None):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate, self.capacity)
+        return bucket.acquire(cancelled)
+
+# Shared by every MedicineWebScraper in the process, so each host sees one
+# request budget however many scrapers the routes create
+rate_limiter = HostRateLimiter(
+    rate=float(os.getenv('SCRAPER_REQUESTS_PER_SECOND', 0.5)),
+    capacity=int(os.getenv('SCRAPER_BURST', 3))
+)
+scraper_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('SCRAPER_MAX_WORKERS', 8)),
+    thread_name_prefix="medicine-scraper"
+)
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(user_agent):
+    """The process-wide pooled session for a user agent"""
+    with _sessions_lock:
+        session = _sessions.get(user_agent)
+        if session is None:
+            session = _sessions[user_agent] = build_session(user_agent)
+        return session
+
+def _retry_after(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+def fetch(session, url, cancelled=None, retries=3, backoff_factor=0.5, max_wait=30, **kwargs):
+    """GET url, retrying connection errors and 429/5xx with backoff
+
+    Every attempt, retries included, takes a token from the host's bucket in
+    rate_limiter; a Retry-After header from the site is honoured.
+
+    Returns:
+        requests.Response (the last one if every attempt was refused), or
+        None if cancelled (a threading.Event) was set while waiting
+    """
+    for attempt in range(retries + 1):
+        if not rate_limiter.acquire(url, cancelled):
+            return None
+        try:
+            response = session.get(url, **kwargs)
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            delay = _retry_after(response)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries:
+                raise
+            logging.warning(f"Request to {url} failed, retrying: {str(e)}")
+            delay = None
+
+        if delay is None:
+            delay = backoff_factor * (2 ** attempt) * (1 + random.random() * 0.1)
+        delay = min(delay, max_wait)
+        if cancelled is not None:
+            if cancelled.wait(delay):
+                return None
+        else:
+            time.sleep(delay)
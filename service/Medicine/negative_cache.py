@@ -0,0 +1,59 @@
+import logging
+from datetime import datetime, timedelta
+from .search_index import normalize_search_text
+
+# How long a failed online lookup is remembered before sources are tried again
+DEFAULT_MISS_TTL = timedelta(hours=24)
+
+class EnrichmentMissCache:
+    """Persistent record of medicine names no online source could find
+
+    One document per normalized query, removed by a TTL index on expires_at,
+    so repeated searches for an unknown name (e.g. on every keystroke with
+    auto_enrich) do not scrape every pharmacy site again until it expires.
+    """
+
+    def __init__(self, collection, ttl=DEFAULT_MISS_TTL):
+        self.collection = collection
+        self.ttl = ttl
+
+    def contains(self, medicine_name):
+        """Whether a lookup for this name failed recently"""
+        key = normalize_search_text(medicine_name)
+        if not key:
+            return False
+        # The TTL monitor only runs once a minute, so check expiry here too
+        return self.collection.count_documents(
+            {"_id": key, "expires_at": {"$gt": datetime.utcnow()}}, limit=1
+        ) > 0
+
+    def record(self, medicine_name):
+        """Remember that no source had this name"""
+        key = normalize_search_text(medicine_name)
+        if not key:
+            return
+        now = datetime.utcnow()
+        try:
+            self.collection.update_one(
+                {"_id": key},
+                {
+                    "$set": {"query": medicine_name, "created_at": now, "expires_at": now + self.ttl},
+                    "$inc": {"misses": 1}
+                },
+                upsert=True
+            )
+        except Exception as e:
+            # Caching a miss is best effort; the lookup result stands
+            logging.error(f"Error recording enrichment miss: {str(e)}")
+
+    def purge(self, medicine_name=None):
+        """Forget one name, or every recorded miss when no name is given
+
+        Returns:
+            int: Number of entries removed
+        """
+        if medicine_name:
+            query = {"_id": normalize_search_text(medicine_name)}
+        else:
+            query = {}
+        return self.collection.delete_many(query).deleted_count
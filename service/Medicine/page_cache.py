@@ -0,0 +1,91 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+class CachedPage:
+    """The parts of a response the scraper reads, rebuilt from the cache"""
+
+    def __init__(self, url, text, status_code=200):
+        self.url = url
+        self.text = text
+        self.status_code = status_code
+
+class PageCache:
+    """On-disk cache of scraped pages, one gzip file per URL
+
+    Files are named by the SHA-256 of the URL and hold the body with its
+    ETag, Last-Modified and expiry time. Fresh entries are served without a
+    request; expired ones are revalidated with a conditional GET and kept if
+    the site answers 304 Not Modified.
+    """
+
+    def __init__(self, directory, ttl_seconds=7 * 24 * 3600):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url):
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        # Two-character fan-out keeps directories small
+        return os.path.join(self.directory, digest[:2], f"{digest}.json.gz")
+
+    def get(self, url):
+        """Cached entry for url (dict with body, final_url, etag, last_modified, expires_at) or None"""
+        try:
+            with gzip.open(self._path(url), "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable page cache entry for {url}: {str(e)}")
+            return None
+        # Guard against the (unlikely) hash collision
+        return entry if entry.get("url") == url else None
+
+    def is_fresh(self, entry):
+        return entry["expires_at"] > time.time()
+
+    def conditional_headers(self, entry):
+        """Headers that let the site answer 304 if the page has not changed"""
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def put(self, url, response):
+        """Store a 200 response"""
+        self._write({
+            "url": url,
+            "final_url": response.url,
+            "body": response.text,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "expires_at": time.time() + self.ttl_seconds
+        })
+
+    def refresh(self, entry):
+        """Extend an entry the site confirmed unchanged"""
+        entry["expires_at"] = time.time() + self.ttl_seconds
+        self._write(entry)
+
+    def page(self, entry):
+        return CachedPage(entry["final_url"], entry["body"])
+
+    def _write(self, entry):
+        path = self._path(entry["url"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so concurrent readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                f.write(json.dumps(entry).encode("utf-8"))
+            os.replace(temp_path, path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
@@ -48,38 +48,39 @@ class ProductSearchHelper:
         return result
     
     @staticmethod
-    def fuzzy_match_products(search_term, product_list, threshold=70):
+    def fuzzy_match_products(search_term, product_list, threshold=70, name_key='name', limit=5):
         """Find best matching products using fuzzy string matching
         
         Args:
             search_term (str): Term to search for
             product_list (list): List of product dictionaries
             threshold (int): Minimum match score (0-100)
+            name_key (str): Product field holding the name to match against
+            limit (int): Maximum number of matches
             
         Returns:
-            list: Matching products above threshold
+            list: Copies of the matching products above threshold, with match_score
         """
         if not search_term or not product_list:
             return []
             
-        # Extract product names from list
-        product_names = [p.get('name', '') for p in product_list]
+        # Key choices by position so matches map straight back to their product
+        product_names = {index: p.get(name_key) or '' for index, p in enumerate(product_list)}
         
         # Find best matches
         matches = process.extractBests(
             search_term, 
             product_names, 
             scorer=fuzz.token_sort_ratio,
-            score_cutoff=threshold
+            score_cutoff=threshold,
+            limit=limit
         )
         
         # Return matching products
         result = []
-        for name, score in matches:
-            for product in product_list:
-                if product.get('name') == name:
-                    product['match_score'] = score
-                    result.append(product)
-                    break
+        for name, score, index in matches:
+            product = dict(product_list[index])
+            product['match_score'] = score
+            result.append(product)
                     
         return result
@@ -0,0 +1,215 @@
+import re
+import logging
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Edge n-grams shorter than this would match most of the catalogue
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_LENGTH = 20
+
+def normalize_search_text(text):
+    """Lowercase, drop punctuation and collapse whitespace"""
+    if not text:
+        return ""
+    return " ".join(re.sub(r'[^a-z0-9]+', ' ', str(text).lower()).split())
+
+def edge_ngrams(text):
+    """Prefixes of every token, e.g. 'dolo 650' -> ['do', 'dol', 'dolo', '65', '650']"""
+    grams = set()
+    for token in normalize_search_text(text).split():
+        for length in range(MIN_PREFIX_LENGTH, min(len(token), MAX_PREFIX_LENGTH) + 1):
+            grams.add(token[:length])
+        # Tokens shorter than the minimum are still searchable as a whole
+        if len(token) < MIN_PREFIX_LENGTH:
+            grams.add(token)
+    return sorted(grams)
+
+# Pack sizes, which differ between listings of the same product: 10x15, 15's, 10 pcs
+PACK_SIZE_PATTERN = re.compile(r"\b\d+\s*x\s*\d+\w*|\b\d+\s*'?\s*s\b|\b\d+\s*pcs\b")
+# Strength in mg is written with or without the unit: 'Dolo 650', 'DOLO 650MG', 'dolo 650 mg'
+MG_STRENGTH_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*mg\b")
+DOSAGE_FORM_ALIASES = {
+    "tablet": "tab", "tablets": "tab", "tabs": "tab",
+    "capsule": "cap", "capsules": "cap", "caps": "cap",
+    "syp": "syrup", "inj": "injection"
+}
+
+def medicine_name_key(product_name):
+    """Canonical key for a medicine name, e.g. 'DOLO  650MG Tablet 15'S' -> 'dolo 650 tab'
+
+    Pack sizes, case, punctuation and whitespace are folded and dosage form
+    spellings unified, so listings of the same product share one key.
+    Strength and dosage form are kept: 'Calpol 500mg' and 'Calpol 650mg'
+    are different medicines.
+    """
+    text = str(product_name or "").lower()
+    text = PACK_SIZE_PATTERN.sub(" ", text)
+    text = MG_STRENGTH_PATTERN.sub(r"\1", text)
+    # Dots survive only inside decimals like 2.5
+    text = re.sub(r"(?<!\d)\.|\.(?!\d)", " ", text)
+    tokens = re.sub(r"[^a-z0-9.%]+", " ", text).split()
+    return " ".join(DOSAGE_FORM_ALIASES.get(token, token) for token in tokens)
+
+def search_fields(product_name, manufacturer=None):
+    """Fields stored on every Medicine document so searches can use an index
+
+    Returns:
+        dict: search_name, search_manufacturer and search_terms (edge n-grams
+        of both name and manufacturer tokens)
+    """
+    return {
+        "search_name": normalize_search_text(product_name),
+        "search_manufacturer": normalize_search_text(manufacturer),
+        "search_terms": sorted(set(edge_ngrams(product_name)) | set(edge_ngrams(manufacturer)))
+    }
+
+class MedicineSearch:
+    """Indexed, ranked medicine search over the Medicine collection
+
+    Replaces unanchored case-insensitive $regex scans with two index-backed
+    queries: an anchored prefix match on the normalized name and an $all
+    match on the edge n-grams of name and manufacturer tokens.
+    """
+
+    # The n-gram array is only for the index, never returned to callers
+    projection = {"search_terms": 0}
+
+    def __init__(self, medicine_collection, candidate_limit=200):
+        self.medicine_collection = medicine_collection
+        self.candidate_limit = candidate_limit
+
+    def search(self, term, manufacturer=None, limit=20):
+        """Find medicines matching term, best matches first
+
+        Args:
+            term: Free-text query matched against name and manufacturer tokens
+            manufacturer: Optional manufacturer prefix filter
+            limit: Maximum number of results
+
+        Returns:
+            list: Medicine documents, ranked
+        """
+        query_name = normalize_search_text(term)
+        query_manufacturer = normalize_search_text(manufacturer)
+        if not query_name and not query_manufacturer:
+            return []
+
+        base_filter = {}
+        if query_manufacturer:
+            base_filter["search_manufacturer"] = {"$regex": f"^{re.escape(query_manufacturer)}"}
+
+        candidates = {}
+        if query_name:
+            # Names starting with the whole query rank highest
+            prefix_filter = dict(base_filter, search_name={"$regex": f"^{re.escape(query_name)}"})
+            for medicine in self.medicine_collection.find(prefix_filter, self.projection).limit(self.candidate_limit):
+                candidates[medicine["_id"]] = medicine
+
+            # Every query token must prefix some name or manufacturer token
+            tokens = query_name.split()
+            terms = [token[:MAX_PREFIX_LENGTH] for token in tokens if len(token) >= MIN_PREFIX_LENGTH]
+            if terms and len(candidates) < self.candidate_limit:
+                terms_filter = dict(base_filter, search_terms={"$all": terms})
+                for medicine in self.medicine_collection.find(terms_filter, self.projection).limit(self.candidate_limit):
+                    candidates.setdefault(medicine["_id"], medicine)
+        else:
+            for medicine in self.medicine_collection.find(base_filter, self.projection).limit(self.candidate_limit):
+                candidates[medicine["_id"]] = medicine
+
+        ranked = sorted(candidates.values(), key=lambda medicine: self._rank(medicine, query_name))
+        return ranked[:limit]
+
+    @staticmethod
+    def _rank(medicine, query_name):
+        """Sort key: exact name, name prefix, name token prefixes, manufacturer match"""
+        name = medicine.get("search_name") or normalize_search_text(medicine.get("product_name"))
+        if not query_name:
+            tier = 0
+        elif name == query_name:
+            tier = 0
+        elif name.startswith(query_name):
+            tier = 1
+        elif all(any(word.startswith(token) for word in name.split()) for token in query_name.split()):
+            tier = 2
+        else:
+            tier = 3
+        return (tier, len(name), name)
+
+    def backfill(self, batch_size=500):
+        """Compute search fields for medicines stored before they existed
+
+        Returns:
+            int: Number of medicines updated
+        """
+        updated = 0
+        operations = []
+        cursor = self.medicine_collection.find(
+            {"search_terms": {"$exists": False}},
+            {"product_name": 1, "product_manufactured": 1, "name": 1, "manufacturer": 1}
+        )
+        for medicine in cursor:
+            # Entries created by /stock/bulk-add use name/manufacturer keys
+            fields = search_fields(
+                medicine.get("product_name") or medicine.get("name"),
+                medicine.get("product_manufactured") or medicine.get("manufacturer")
+            )
+            operations.append(UpdateOne({"_id": medicine["_id"]}, {"$set": fields}))
+            if len(operations) >= batch_size:
+                updated += self.medicine_collection.bulk_write(operations, ordered=False).modified_count
+                operations = []
+
+        if operations:
+            updated += self.medicine_collection.bulk_write(operations, ordered=False).modified_count
+
+        logging.info(f"Medicine search backfill updated {updated} medicines")
+        return updated
+
+def backfill_name_keys(medicine_collection, batch_size=500):
+    """Store name_key on medicines written before it existed, or under an older key format
+
+    Medicines whose key collides with an existing (name_key,
+    product_manufactured) pair are duplicates; they are left without a key
+    and counted so they can be merged by hand.
+
+    Returns:
+        dict: Counts of updated and duplicate medicines
+    """
+    stats = {"updated": 0, "duplicates": 0}
+
+    def flush(operations, ids):
+        try:
+            stats["updated"] += medicine_collection.bulk_write(operations, ordered=False).modified_count
+        except BulkWriteError as e:
+            stats["updated"] += e.details.get("nModified", 0)
+            errors = e.details.get("writeErrors", [])
+            duplicates = [ids[error["index"]] for error in errors if error.get("code") == 11000]
+            if any(error.get("code") != 11000 for error in errors):
+                raise
+            if duplicates:
+                # A stale key from the older format must not keep holding the slot
+                medicine_collection.update_many({"_id": {"$in": duplicates}}, {"$unset": {"name_key": ""}})
+                stats["duplicates"] += len(duplicates)
+
+    operations, ids = [], []
+    cursor = medicine_collection.find(
+        {"product_name": {"$type": "string"}},
+        {"product_name": 1, "name_key": 1}
+    )
+    for medicine in cursor:
+        name_key = medicine_name_key(medicine["product_name"])
+        if medicine.get("name_key") == name_key:
+            continue
+        operations.append(UpdateOne(
+            {"_id": medicine["_id"]},
+            {"$set": {"name_key": name_key}}
+        ))
+        ids.append(medicine["_id"])
+        if len(operations) >= batch_size:
+            flush(operations, ids)
+            operations, ids = [], []
+
+    if operations:
+        flush(operations, ids)
+
+    logging.info(f"Medicine name key backfill finished: {stats}")
+    return stats
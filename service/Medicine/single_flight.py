@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+
+class SingleFlight:
+    """Runs a function once per key at a time within this process
+
+    Callers arriving while the function runs for the same key wait for it and
+    share its result (or exception). A call made again by the thread already
+    running that key runs directly instead of waiting on itself.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Return fn(), shared by every caller that asks for key meanwhile"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = {"done": threading.Event(), "owner": threading.get_ident(), "result": None, "error": None}
+                self._calls[key] = call
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            if call["owner"] == threading.get_ident():
+                return fn()
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call["done"].set()
+
+class MongoLease:
+    """Cross-process lock on a key, held for at most ttl seconds
+
+    One document per held key in the lease collection; a TTL index on
+    expires_at cleans up after workers that died holding a lease.
+    """
+
+    def __init__(self, collection, ttl=timedelta(seconds=90), poll_interval=0.5):
+        self.collection = collection
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+
+    def acquire(self, key):
+        """Take the lease if free or expired
+
+        Returns:
+            str: Token to release it with, or None if another worker holds it
+        """
+        token = uuid.uuid4().hex
+        now = datetime.utcnow()
+        try:
+            # Matches only an expired lease; otherwise the upsert collides on _id
+            self.collection.update_one(
+                {"_id": key, "expires_at": {"$lt": now}},
+                {"$set": {"owner": token, "acquired_at": now, "expires_at": now + self.ttl}},
+                upsert=True
+            )
+            return token
+        except DuplicateKeyError:
+            return None
+
+    def release(self, key, token):
+        try:
+            self.collection.delete_one({"_id": key, "owner": token})
+        except Exception as e:
+            # It expires on its own
+            logging.error(f"Error releasing lease {key}: {str(e)}")
+
+    def wait(self, key, done=None):
+        """Wait until the lease is released or expires, or done() returns a result
+
+        Returns:
+            The first non-None done() result, or None once the lease is gone
+        """
+        deadline = time.monotonic() + self.ttl.total_seconds()
+        while time.monotonic() < deadline:
+            if done is not None:
+                result = done()
+                if result is not None:
+                    return result
+            if self.collection.count_documents({"_id": key, "expires_at": {"$gt": datetime.utcnow()}}, limit=1) == 0:
+                return done() if done is not None else None
+            time.sleep(self.poll_interval)
+        return None
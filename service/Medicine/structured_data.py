@@ -0,0 +1,159 @@
+import json
+import logging
+import re
+import threading
+
+# Without these the LLM is still asked to fill in the gaps
+ESSENTIAL_FIELDS = ("product_manufactured", "salt_composition", "product_price", "image_url")
+
+JSON_LD_PATTERN = re.compile(
+    r'<script[^>]*type=["\']application/ld\+json["\'][^>]*>(.*?)</script>',
+    re.IGNORECASE | re.DOTALL
+)
+NEXT_DATA_PATTERN = re.compile(
+    r'<script[^>]*id=["\']__NEXT_DATA__["\'][^>]*>(.*?)</script>',
+    re.IGNORECASE | re.DOTALL
+)
+
+CURRENCY_SYMBOLS = {"INR": "₹", "USD": "$", "EUR": "€", "GBP": "£"}
+
+# Key names pharmacy sites use in their Next.js page props, per medicine field
+NEXT_DATA_KEYS = {
+    "product_name": ("name", "productName", "product_name", "displayName", "skuName"),
+    "product_manufactured": ("manufacturer", "manufacturerName", "manufacturer_name", "marketer", "marketerName", "companyName"),
+    "salt_composition": ("composition", "saltComposition", "salt_composition", "salt", "molecules"),
+    "product_price": ("mrp", "price", "sellingPrice", "salePrice", "discountedPrice"),
+    "image_url": ("imageUrl", "image_url", "image", "images", "thumbnail", "imageUrls"),
+    "medicine_desc": ("description", "introduction", "productDescription", "uses"),
+    "side_effects": ("sideEffects", "side_effects"),
+    "sub_category": ("category", "categoryName", "therapeuticClass")
+}
+
+def _first(value):
+    return value[0] if isinstance(value, list) and value else value
+
+def _text(value):
+    """Plain string from a scalar, a list or a {name: ...} object"""
+    value = _first(value)
+    if isinstance(value, dict):
+        value = value.get("name") or value.get("url") or value.get("@id")
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    text = str(value).strip()
+    return text or None
+
+def _price(value, currency=None):
+    price = _text(value)
+    if price and currency in CURRENCY_SYMBOLS and not price.startswith(CURRENCY_SYMBOLS[currency]):
+        return f"{CURRENCY_SYMBOLS[currency]}{price}"
+    return price
+
+def _json_blocks(pattern, html_content):
+    for match in pattern.finditer(html_content):
+        try:
+            yield json.loads(match.group(1).strip())
+        except ValueError:
+            continue
+
+def _walk(node):
+    """Every dict nested anywhere in a decoded JSON document"""
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, dict):
+            yield current
+            stack.extend(current.values())
+        elif isinstance(current, list):
+            stack.extend(current)
+
+def _from_json_ld(html_content):
+    for block in _json_blocks(JSON_LD_PATTERN, html_content):
+        for node in _walk(block):
+            types = node.get("@type")
+            types = types if isinstance(types, list) else [types]
+            if not {"Product", "Drug"} & set(types):
+                continue
+
+            offers = _first(node.get("offers")) or {}
+            if not isinstance(offers, dict):
+                offers = {}
+            data = {
+                "product_name": _text(node.get("name")),
+                "product_manufactured": _text(node.get("manufacturer")) or _text(node.get("brand")),
+                "salt_composition": _text(node.get("activeIngredient")),
+                "sub_category": _text(node.get("category")),
+                "product_price": _price(offers.get("price") or offers.get("lowPrice"), offers.get("priceCurrency")),
+                "medicine_desc": _text(node.get("description")),
+                "image_url": _text(node.get("image"))
+            }
+            return {key: value for key, value in data.items() if value}
+    return {}
+
+def _from_next_data(html_content):
+    best, best_score = {}, 0
+    for block in _json_blocks(NEXT_DATA_PATTERN, html_content):
+        for node in _walk(block):
+            data = {}
+            for field, keys in NEXT_DATA_KEYS.items():
+                for key in keys:
+                    if key not in node:
+                        continue
+                    if field == "side_effects":
+                        value = node[key]
+                        value = [_text(item) for item in value] if isinstance(value, list) else _text(value)
+                        value = [item for item in value if item] if isinstance(value, list) else value
+                    else:
+                        value = _text(node[key])
+                    if value:
+                        data[field] = value
+                        break
+            # The product object is the one carrying a name and the most medicine fields
+            score = len(data)
+            if "product_name" in data and score >= 3 and score > best_score:
+                best, best_score = data, score
+    return best
+
+def extract_structured_data(html_content):
+    """Medicine fields from JSON-LD Product/Drug schema and the __NEXT_DATA__ blob
+
+    JSON-LD wins where both have a field, since its meaning is fixed by
+    schema.org; __NEXT_DATA__ keys are matched against common names.
+
+    Returns:
+        dict: Fields found, possibly empty
+    """
+    data = {}
+    try:
+        data.update(_from_next_data(html_content))
+        data.update(_from_json_ld(html_content))
+    except Exception as e:
+        logging.warning(f"Structured data extraction failed: {str(e)}")
+    return data
+
+def missing_fields(medicine_data):
+    return [field for field in ESSENTIAL_FIELDS if not medicine_data.get(field)]
+
+class ExtractionStats:
+    """Per-source counts of pages answered from structured data vs the LLM"""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, source_name, structured_hit):
+        with self._lock:
+            counts = self._counts.setdefault(source_name, {"pages": 0, "structured_hits": 0, "llm_calls": 0})
+            counts["pages"] += 1
+            counts["structured_hits" if structured_hit else "llm_calls"] += 1
+
+    def snapshot(self):
+        """Counts and hit rate (share of pages that needed no LLM call) per source"""
+        with self._lock:
+            return {
+                source: dict(counts, hit_rate=round(counts["structured_hits"] / counts["pages"], 3))
+                for source, counts in self._counts.items()
+            }
+
+# Shared by every MedicineWebScraper in the process, so the stats cover
+# product-route and bill-scanner enrichment alike
+extraction_stats = ExtractionStats()
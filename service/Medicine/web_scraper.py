@@ -1,19 +1,40 @@
 import logging
+import os
 import requests
-import random
 import time
 import re
 import json
-from bs4 import BeautifulSoup
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+from .http_client import get_session, fetch, scraper_executor
+from .page_cache import PageCache
+from .html_parsing import parse_html, parse_containers, SEARCH_RESULT_CLASSES, PRODUCT_CONTENT_CLASSES
+from .structured_data import extract_structured_data, missing_fields, extraction_stats
 from urllib.parse import quote_plus, urljoin
 from together import Together
+from Prescription.services.llm_cache import llm_cache
 
 class MedicineWebScraper:
     """Web scraper for gathering medicine information from pharmaceutical websites"""
     
-    def __init__(self, debug=False):
-        """Initialize the scraper with website configurations"""
+    def __init__(self, debug=False, concurrent=True, grace_period=2.0, cache_dir=None, cache_ttl=7 * 24 * 3600):
+        """Initialize the scraper with website configurations
+
+        Args:
+            debug: Log request details
+            concurrent: Query sources in parallel instead of one after another
+            grace_period: Seconds other sources get to add fields once a
+                result with an image is in
+            cache_dir: Directory for the scraped page cache; defaults to
+                SCRAPER_CACHE_DIR, and no cache is used when neither is set
+            cache_ttl: Seconds a cached page is used before revalidation
+        """
         self.debug = debug
+        self.concurrent = concurrent
+        self.grace_period = grace_period
+        # Threads, sessions and per-host rate limits are shared by every scraper
+        # in the process (see http_client), configured by SCRAPER_* variables
+        self.executor = scraper_executor
         self.sources = [
             {
                 "name": "Netmeds",
@@ -36,6 +57,11 @@ class MedicineWebScraper:
                 "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
             }
         ]
+        self.sessions = {source["name"]: get_session(source["user_agent"]) for source in self.sources}
+        cache_dir = cache_dir or os.getenv('SCRAPER_CACHE_DIR')
+        self.page_cache = PageCache(cache_dir, ttl_seconds=cache_ttl) if cache_dir else None
+        # How often pages were read without an LLM call, per source, across every scraper
+        self.extraction_stats = extraction_stats
         # Add Together API client for text processing
         self.together_client = Together()
         self.llm_model = "meta-llama/Llama-3.3-70B-Instruct-Turbo-Free"
@@ -62,67 +88,37 @@ class MedicineWebScraper:
         Don't include any explanations or text outside the JSON object - return ONLY the JSON.
         """
 
-    def search_and_scrape_medicine(self, medicine_name):
+    def search_and_scrape_medicine(self, medicine_name, concurrent=None):
         """
         Search for medicine across multiple sources and scrape details.
         If image_url is missing, continue searching other sources until found.
+
+        Args:
+            medicine_name: Name of the medicine to look up
+            concurrent: Query all sources in parallel; defaults to the
+                setting the scraper was created with
         """
-        sources = self.sources.copy()
+        if concurrent is None:
+            concurrent = self.concurrent
+        if concurrent:
+            return self._search_sources_concurrently(medicine_name)
+
         best_data = None
 
-        for source in sources:
-            try:
-                logging.info(f"Searching for {medicine_name} on {source['name']}")
-                search_url = source['search_url'].format(quote_plus(medicine_name))
-                headers = {
-                    "User-Agent": source["user_agent"],
-                    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-                    "Accept-Language": "en-US,en;q=0.5",
-                    "Connection": "keep-alive",
-                    "Upgrade-Insecure-Requests": "1",
-                    "Cache-Control": "max-age=0"
-                }
-                if self.debug:
-                    logging.debug(f"Requesting URL: {search_url}")
-                response = requests.get(search_url, headers=headers, timeout=15)
-                if response.status_code != 200:
-                    logging.warning(f"Request failed for {source['name']}: {response.status_code} status code")
-                    continue
-                
-                product_url = self._parse_search_results(response.text, medicine_name, source['name'], base_url=response.url)
-                if not product_url:
-                    logging.info(f"No results found on {source['name']} for {medicine_name}")
-                    continue
-                time.sleep(random.uniform(1, 3))
-                if self.debug:
-                    logging.debug(f"Found product URL: {product_url}")
-                product_response = requests.get(product_url, headers=headers, timeout=15)
-                if product_response.status_code != 200:
-                    logging.warning(f"Failed to fetch product page from {source['name']}: {product_response.status_code}")
-                    continue
-                
-                medicine_data = self._extract_medicine_details(
-                    product_response.text, 
-                    source['name'],
-                    medicine_name,
-                    product_url
-                )
-                if medicine_data:
-                    # If we already have data, but no image_url, and this one has image_url, merge it in
-                    if best_data is None:
-                        best_data = medicine_data
-                    else:
-                        # If best_data has no image_url but this one does, update image_url
-                        if (not best_data.get("image_url")) and medicine_data.get("image_url"):
-                            best_data["image_url"] = medicine_data["image_url"]
-                    # If we now have image_url, return immediately
-                    if best_data.get("image_url"):
-                        logging.info(f"Successfully scraped details for {medicine_name} from {source['name']} (with image)")
-                        return best_data
-            except requests.RequestException as e:
-                logging.warning(f"Request failed for {source['name']}: {str(e)}")
-            except Exception as e:
-                logging.error(f"Error scraping {source['name']}: {str(e)}")
+        for source in self.sources:
+            medicine_data = self._scrape_source(source, medicine_name)
+            if medicine_data:
+                # If we already have data, but no image_url, and this one has image_url, merge it in
+                if best_data is None:
+                    best_data = medicine_data
+                else:
+                    # If best_data has no image_url but this one does, update image_url
+                    if (not best_data.get("image_url")) and medicine_data.get("image_url"):
+                        best_data["image_url"] = medicine_data["image_url"]
+                # If we now have image_url, return immediately
+                if best_data.get("image_url"):
+                    logging.info(f"Successfully scraped details for {medicine_name} from {source['name']} (with image)")
+                    return best_data
         # If we reach here, return best_data (may be None or missing image_url)
         if best_data:
             logging.info(f"Returning best available data for {medicine_name} (image_url may be missing)")
@@ -130,6 +126,128 @@ class MedicineWebScraper:
             logging.warning(f"Could not find information for {medicine_name} on any source")
         return best_data
 
+    def _search_sources_concurrently(self, medicine_name):
+        """
+        Query every source at once and return as soon as one result has an
+        image_url. Sources still running get grace_period seconds to fill in
+        fields the first result lacks; the rest are cancelled.
+        """
+        cancelled = threading.Event()
+        futures = {
+            self.executor.submit(self._scrape_source, source, medicine_name, cancelled): source["name"]
+            for source in self.sources
+        }
+        results = {}
+        pending = set(futures)
+        deadline = None
+
+        try:
+            while pending:
+                timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    # Grace window is over
+                    break
+                for future in done:
+                    medicine_data = future.result()
+                    if medicine_data:
+                        results[futures[future]] = medicine_data
+                if deadline is None and any(data.get("image_url") for data in results.values()):
+                    deadline = time.monotonic() + self.grace_period
+        finally:
+            # Stop queued sources and make running ones give up at their next step
+            cancelled.set()
+            for future in pending:
+                future.cancel()
+
+        if not results:
+            logging.warning(f"Could not find information for {medicine_name} on any source")
+            return None
+
+        # Results with an image lead, then the configured source order
+        ordered = [results[source["name"]] for source in self.sources if source["name"] in results]
+        ordered.sort(key=lambda data: not data.get("image_url"))
+        best_data = dict(ordered[0])
+        for medicine_data in ordered[1:]:
+            for key, value in medicine_data.items():
+                if value and not best_data.get(key):
+                    best_data[key] = value
+
+        logging.info(f"Scraped details for {medicine_name} from {', '.join(results)}")
+        return best_data
+
+    def _scrape_source(self, source, medicine_name, cancelled=None):
+        """Search one source and scrape its product page; None on failure or cancellation"""
+        try:
+            logging.info(f"Searching for {medicine_name} on {source['name']}")
+            search_url = source['search_url'].format(quote_plus(medicine_name))
+            if self.debug:
+                logging.debug(f"Requesting URL: {search_url}")
+            response = self._fetch(source, search_url, cancelled)
+            if response is None:
+                return None
+            if response.status_code != 200:
+                logging.warning(f"Request failed for {source['name']}: {response.status_code} status code")
+                return None
+            
+            product_url = self._parse_search_results(response.text, medicine_name, source['name'], base_url=response.url)
+            if not product_url:
+                logging.info(f"No results found on {source['name']} for {medicine_name}")
+                return None
+            if self.debug:
+                logging.debug(f"Found product URL: {product_url}")
+            product_response = self._fetch(source, product_url, cancelled)
+            if product_response is None:
+                return None
+            if product_response.status_code != 200:
+                logging.warning(f"Failed to fetch product page from {source['name']}: {product_response.status_code}")
+                return None
+            if cancelled is not None and cancelled.is_set():
+                return None
+            
+            return self._extract_medicine_details(
+                product_response.text, 
+                source['name'],
+                medicine_name,
+                product_url
+            )
+        except requests.RequestException as e:
+            logging.warning(f"Request failed for {source['name']}: {str(e)}")
+        except Exception as e:
+            logging.error(f"Error scraping {source['name']}: {str(e)}")
+        return None
+
+    def _fetch(self, source, url, cancelled=None):
+        """GET a page over the source's pooled session, within the host's rate limit
+
+        Pages in the on-disk cache are served without a request while fresh
+        and revalidated with a conditional GET once expired.
+
+        Returns:
+            requests.Response or CachedPage, or None if the search was
+            cancelled while waiting
+        """
+        cached = self.page_cache.get(url) if self.page_cache else None
+        if cached and self.page_cache.is_fresh(cached):
+            return self.page_cache.page(cached)
+
+        # Only waits when this host's request budget is spent
+        headers = self.page_cache.conditional_headers(cached) if cached else None
+        response = fetch(self.sessions[source["name"]], url, cancelled, headers=headers, timeout=15)
+        if response is None:
+            return None
+
+        if self.page_cache:
+            try:
+                if response.status_code == 304 and cached:
+                    self.page_cache.refresh(cached)
+                    return self.page_cache.page(cached)
+                if response.status_code == 200:
+                    self.page_cache.put(url, response)
+            except OSError as e:
+                logging.warning(f"Could not update page cache for {url}: {str(e)}")
+        return response
+
     def _parse_search_results(self, html_content, medicine_name, source_name, base_url=None):
         """
         Parse search results to find the product URL
@@ -137,9 +255,10 @@ class MedicineWebScraper:
         Returns: 
             URL to product page or None if not found
         """
-        soup = BeautifulSoup(html_content, 'html.parser')
-
         if source_name == "1mg":
+            # Only the product cards are parsed; the rest of the page is skipped
+            soup = parse_containers(html_content, SEARCH_RESULT_CLASSES["1mg"])
+
             # Look for product cards with the class mentioned by user
             cards = soup.select("div.style__horizontal-card___1Zwmt.style__height-158___1XIvD")
             for card in cards:
@@ -159,6 +278,9 @@ class MedicineWebScraper:
                 "a"
             ]
             for selector in fallback_selectors:
+                if selector == "a":
+                    # Any link on the page needs the whole document
+                    soup = parse_html(html_content)
                 for a_tag in soup.select(selector):
                     href = a_tag.get("href", "")
                     text = a_tag.get_text(strip=True)
@@ -205,18 +327,28 @@ class MedicineWebScraper:
     
     def _extract_medicine_details(self, html_content, source_name, medicine_name, product_url=None):
         """
-        Extract medicine details from product page using Together LLM
+        Extract medicine details from product page, reading embedded JSON-LD
+        or __NEXT_DATA__ first and using Together LLM for fields still missing
         
         Returns:
             Dict with medicine details
         """
-        soup = BeautifulSoup(html_content, 'html.parser')
         medicine_data = {
             "product_name": medicine_name,
             "source": source_name,
             "url": product_url
         }
         
+        structured_data = extract_structured_data(html_content)
+        medicine_data.update(structured_data)
+        structured_hit = not missing_fields(medicine_data)
+        self.extraction_stats.record(source_name, structured_hit)
+        if structured_hit:
+            logging.info(f"Extracted {medicine_name} from structured data on {source_name}, skipping LLM")
+            return medicine_data
+        
+        # Parse only the overview, header and image containers we read below
+        soup = parse_containers(html_content, PRODUCT_CONTENT_CLASSES.get(source_name))
         try:
             main_content = None
             
@@ -230,6 +362,8 @@ class MedicineWebScraper:
                 main_content = soup.select_one("div.MedicineDetailsContent, div.MuiCardContent-root")
             
             if not main_content:
+                # Layout not recognised: fall back to the text of the whole page
+                soup = parse_html(html_content)
                 main_content = soup.select_one("body")
             
             content_text = main_content.get_text(separator="\n", strip=True) if main_content else html_content
@@ -242,11 +376,18 @@ class MedicineWebScraper:
             llm_data = self._process_with_together_llm(context)
             
             if llm_data:
-                medicine_data.update(llm_data)
+                # Structured data is exact, so the LLM only fills the gaps
+                medicine_data.update({
+                    key: value for key, value in llm_data.items()
+                    if not structured_data.get(key)
+                })
             else:
                 traditional_data = self._extract_medicine_details_traditional(soup, source_name, medicine_name)
                 if traditional_data:
-                    medicine_data.update(traditional_data)
+                    medicine_data.update({
+                        key: value for key, value in traditional_data.items()
+                        if not structured_data.get(key)
+                    })
             
             # --- PharmEasy image extraction ---
             if source_name == "PharmEasy" and not medicine_data.get("image_url"):
@@ -279,42 +420,56 @@ class MedicineWebScraper:
     def _process_with_together_llm(self, content_text):
         """Process content text with Together LLM to extract structured information"""
         try:
-            response = self.together_client.chat.completions.create(
-                model=self.llm_model,
-                messages=[
-                    {"role": "system", "content": "You are an expert at extracting structured information about medicines from web pages."},
-                    {"role": "user", "content": self.extraction_prompt + "\n\n" + content_text}
-                ],
-                temperature=0.2,
-                max_tokens=2000
-            )
+            messages = [
+                {"role": "system", "content": "You are an expert at extracting structured information about medicines from web pages."},
+                {"role": "user", "content": self.extraction_prompt + "\n\n" + content_text}
+            ]
+            params = {"temperature": 0.2, "max_tokens": 2000}
             
-            if hasattr(response, 'choices') and response.choices:
-                result = response.choices[0].message.content
-                
-                json_match = re.search(r'```json\s*([\s\S]*?)\s*```', result)
-                if json_match:
-                    json_str = json_match.group(1)
-                else:
-                    json_match = re.search(r'(\{[\s\S]*\})', result)
-                    if json_match:
-                        json_str = json_match.group(1)
-                    else:
-                        json_str = result
-                
-                try:
-                    extracted_data = json.loads(json_str)
-                    return extracted_data
-                except json.JSONDecodeError as e:
-                    logging.error(f"Failed to parse JSON from LLM response: {str(e)}")
-                    logging.debug(f"JSON string attempted to parse: {json_str}")
-                    return None
+            def call():
+                response = self.together_client.chat.completions.create(
+                    model=self.llm_model,
+                    messages=messages,
+                    **params
+                )
+                if hasattr(response, 'choices') and response.choices:
+                    return response.choices[0].message.content
+                return None
             
-            return None
+            # The same page text gives the same answer, so reuse it
+            result = llm_cache.get_or_call(
+                self.llm_model, messages, call, params=params,
+                validate=lambda text: self._parse_llm_json(text) is not None
+            )
+            if not result:
+                return None
+            
+            extracted_data = self._parse_llm_json(result)
+            if extracted_data is None:
+                logging.debug(f"LLM response attempted to parse: {result}")
+            return extracted_data
             
         except Exception as e:
             logging.error(f"Error processing with Together LLM: {str(e)}")
             return None
+    
+    def _parse_llm_json(self, result):
+        """JSON object from an LLM response, with or without a ```json fence"""
+        json_match = re.search(r'```json\s*([\s\S]*?)\s*```', result)
+        if json_match:
+            json_str = json_match.group(1)
+        else:
+            json_match = re.search(r'(\{[\s\S]*\})', result)
+            if json_match:
+                json_str = json_match.group(1)
+            else:
+                json_str = result
+        
+        try:
+            return json.loads(json_str)
+        except json.JSONDecodeError as e:
+            logging.error(f"Failed to parse JSON from LLM response: {str(e)}")
+            return None
             
     def _extract_medicine_details_traditional(self, soup, source_name, medicine_name):
         """Traditional HTML-based extraction as fallback"""
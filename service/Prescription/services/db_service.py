@@ -18,11 +18,56 @@ class DatabaseService:
             self.bills_collection = self.db.Bills
             self.customers_collection= self.db.Customers
             self.sales_collection=self.db.Sales
+            self.enrichment_miss_collection = self.db.EnrichmentMisses
+            self.enrichment_lease_collection = self.db.EnrichmentLeases
+            self.bill_jobs_collection = self.db.BillJobs
 
         except Exception as e:
             logging.error(f"Database connection error: {str(e)}")
             raise
 
+    def ensure_indexes(self):
+        """Create the indexes the query paths rely on (idempotent)
+
+        Each index is created on its own, so one that cannot be built (e.g.
+        the unique name key index over existing duplicates) does not keep
+        the others from being created.
+        """
+        indexes = [
+            # Medicine search: anchored name prefixes and edge n-grams
+            (self.medicine_collection, "search_name", {"name": "search_name"}),
+            (self.medicine_collection, "search_terms", {"name": "search_terms"}),
+            (self.medicine_collection, "search_manufacturer", {"name": "search_manufacturer"}),
+            # Range queries for /stock/expiring-soon
+            (self.stock_collection, "exp_date_ts", {"name": "exp_date_ts"}),
+            # First-expiry-first-out batch allocation for sales
+            (self.stock_collection, [("shop_owner", 1), ("medicine_id", 1), ("exp_date_ts", 1)],
+             {"name": "shop_owner_medicine_id_exp_date_ts"}),
+            # Customer listing and per-customer purchase stats
+            (self.customers_collection, [("shop_owner", 1), ("_id", 1)], {"name": "shop_owner_id"}),
+            (self.customers_collection, [("shop_owner", 1), ("total_spent", -1)], {"name": "shop_owner_total_spent"}),
+            (self.sales_collection, [("shop_owner", 1), ("customer_id", 1), ("created_at", -1)],
+             {"name": "shop_owner_customer_id_created_at"}),
+            # Failed online medicine lookups expire on their own
+            (self.enrichment_miss_collection, "expires_at", {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+            # Leases left behind by a worker that died mid-enrichment
+            (self.enrichment_lease_collection, "expires_at", {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+            # Background bill processing: workers claim the oldest claimable job
+            (self.bill_jobs_collection, [("status", 1), ("created_at", 1)], {"name": "status_created_at"}),
+            # One medicine per canonical name and manufacturer; older documents
+            # without a key are left out until backfilled
+            (self.medicine_collection, [("name_key", 1), ("product_manufactured", 1)], {
+                "name": "name_key_product_manufactured",
+                "unique": True,
+                "partialFilterExpression": {"name_key": {"$type": "string"}}
+            })
+        ]
+        for collection, keys, options in indexes:
+            try:
+                collection.create_index(keys, **options)
+            except Exception as e:
+                logging.error(f"Index creation error for {collection.name}.{options['name']}: {str(e)}")
+
     def save_prescription(self, prescription_data):
         """Save prescription to database"""
         try:
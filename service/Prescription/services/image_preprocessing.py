@@ -0,0 +1,136 @@
+import base64
+import io
+import logging
+import os
+import time
+from PIL import Image, ImageChops, ImageOps
+from .mime_types import mime_type_from_bytes
+
+# Longest side and JPEG quality per kind of document. Bills carry small
+# printed tables, prescriptions handwriting, product photos a few large
+# lines of text on a strip or box.
+PROFILES = {
+    "bill": {"max_side": int(os.getenv('BILL_IMAGE_MAX_SIDE', 2048)), "quality": int(os.getenv('BILL_IMAGE_QUALITY', 85))},
+    "prescription": {"max_side": int(os.getenv('PRESCRIPTION_IMAGE_MAX_SIDE', 1600)), "quality": int(os.getenv('PRESCRIPTION_IMAGE_QUALITY', 85))},
+    "product": {"max_side": int(os.getenv('PRODUCT_IMAGE_MAX_SIDE', 1280)), "quality": int(os.getenv('PRODUCT_IMAGE_QUALITY', 80))}
+}
+
+# How far a pixel may differ from the corner colour and still count as border
+BORDER_THRESHOLD = 24
+# Margin kept around the content when a border is cropped, as a fraction of the side
+BORDER_MARGIN = 0.01
+
+class PreparedImage:
+    """Image bytes ready for upload and for the vision model"""
+
+    def __init__(self, image_bytes, mime_type, width, height, original_size, elapsed_ms):
+        self.image_bytes = image_bytes
+        self.mime_type = mime_type
+        self.width = width
+        self.height = height
+        self.original_size = original_size
+        self.elapsed_ms = elapsed_ms
+
+    @property
+    def size(self):
+        return len(self.image_bytes)
+
+    def base64(self):
+        return base64.b64encode(self.image_bytes).decode('utf-8')
+
+    def data_url(self):
+        return f"data:{self.mime_type};base64,{self.base64()}"
+
+    def file(self):
+        """File-like object for cloudinary.uploader.upload"""
+        return io.BytesIO(self.image_bytes)
+
+    def stats(self):
+        return {
+            "original_bytes": self.original_size,
+            "bytes": self.size,
+            "width": self.width,
+            "height": self.height,
+            "preprocess_ms": round(self.elapsed_ms, 1)
+        }
+
+def crop_border(image, threshold=BORDER_THRESHOLD, margin=BORDER_MARGIN):
+    """Crop a uniform border (scanner bed, blank margin) matching the top-left corner colour"""
+    gray = image.convert("L")
+    background = Image.new("L", gray.size, gray.getpixel((0, 0)))
+    mask = ImageChops.difference(gray, background).point(lambda value: 255 if value > threshold else 0)
+    box = mask.getbbox()
+    if not box:
+        return image
+    pad_x, pad_y = int(image.width * margin), int(image.height * margin)
+    box = (max(box[0] - pad_x, 0), max(box[1] - pad_y, 0), min(box[2] + pad_x, image.width), min(box[3] + pad_y, image.height))
+    if box == (0, 0, image.width, image.height):
+        return image
+    return image.crop(box)
+
+def prepare_image(data, document_type="bill", max_side=None, quality=None):
+    """Auto-orient, crop borders, cap the longest side and recompress an image
+
+    Args:
+        data: Image bytes, or a file-like object to read them from
+        document_type: Key of PROFILES choosing max_side and quality
+        max_side: Override the profile's longest side in pixels
+        quality: Override the profile's JPEG quality
+
+    Returns:
+        PreparedImage: A JPEG, or the original bytes when they are already
+            smaller and need no rotation or cropping, or are not an image
+            Pillow can read
+    """
+    start = time.perf_counter()
+    if hasattr(data, 'read'):
+        data = data.read()
+    profile = PROFILES.get(document_type, PROFILES["bill"])
+    max_side = max_side or profile["max_side"]
+    quality = quality or profile["quality"]
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        original_format = image.format
+        original_mime = Image.MIME.get(original_format, "image/jpeg")
+        original_dimensions = image.size
+        # JPEGs decode straight at a reduced scale when they are far larger than needed
+        scale = max_side / max(image.size)
+        if scale < 1 and original_format == "JPEG":
+            image.draft("RGB", (int(image.width * scale), int(image.height * scale)))
+
+        # 0x0112 is the EXIF orientation tag phone cameras set instead of rotating pixels
+        rotated = image.getexif().get(0x0112, 1) != 1
+        image = ImageOps.exif_transpose(image)
+
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            flattened = Image.new("RGB", image.size, "white")
+            flattened.paste(image, mask=image.getchannel("A"))
+            image = flattened
+        elif image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        image = crop_border(image)
+        if max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+        changed = rotated or image.size != original_dimensions
+
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=quality, optimize=True)
+        image_bytes = buffer.getvalue()
+    except Exception as e:
+        logging.warning(f"Image preprocessing skipped: {str(e)}")
+        mime_type = mime_type_from_bytes(data) or "application/octet-stream"
+        return PreparedImage(data, mime_type, 0, 0, len(data), (time.perf_counter() - start) * 1000)
+
+    if not changed and len(data) <= len(image_bytes):
+        # Recompressing would only make it bigger
+        return PreparedImage(data, original_mime, image.width, image.height, len(data), (time.perf_counter() - start) * 1000)
+
+    prepared = PreparedImage(image_bytes, "image/jpeg", image.width, image.height, len(data), (time.perf_counter() - start) * 1000)
+    logging.info(
+        f"Prepared {document_type} image: {len(data) / 1024:.0f} KB -> {prepared.size / 1024:.0f} KB, "
+        f"{image.width}x{image.height}, {prepared.elapsed_ms:.0f} ms"
+    )
+    return prepared
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class LLMResponseCache:
+    """Persistent cache of Together AI completions shared by every call site
+
+    Entries are keyed by a SHA-256 digest of the model, the messages (prompt
+    and input together) and the generation parameters, and stored in a local
+    SQLite file so they survive restarts and are shared between workers.
+    Entries expire after ttl_seconds; beyond max_entries the least recently
+    used are evicted. Hit/miss counters are kept per process.
+
+    Calls that deliberately sample the same input several times pass a
+    distinct sample number for each call, so a retried document replays all
+    of its samples, or use_cache=False to always call the model.
+    """
+
+    def __init__(self, path, max_entries=5000, ttl_seconds=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "evictions": 0, "errors": 0}
+        try:
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, model TEXT, response TEXT, created_at REAL, last_used REAL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        except sqlite3.Error as e:
+            # Lookups will miss and log until the file is usable
+            logging.error(f"LLM cache setup error: {str(e)}")
+
+    @classmethod
+    def from_env(cls):
+        """Cache configured by LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES and LLM_CACHE_TTL_SECONDS"""
+        return cls(
+            os.getenv("LLM_CACHE_PATH") or os.path.join(tempfile.gettempdir(), "msm_llm_cache.sqlite3"),
+            max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", 5000)),
+            ttl_seconds=int(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+        )
+
+    @contextmanager
+    def _connect(self):
+        """Connection committed on success and always closed"""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _count(self, stat, amount=1):
+        with self._lock:
+            self._stats[stat] += amount
+
+    @staticmethod
+    def make_key(model, messages, params=None, sample=0):
+        payload = json.dumps(
+            {"model": model, "messages": messages, "params": params or {}, "sample": sample},
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_or_call(self, model, messages, call, params=None, sample=0, use_cache=True, validate=None):
+        """Return the cached completion text, or run call() and cache what it returns
+
+        Args:
+            model: Model name sent to Together AI
+            messages: Chat messages sent to the model
+            call: Function making the API call and returning the response text
+            params: Generation parameters that change the output (temperature, max_tokens)
+            sample: Index of the sample when the same input is sent several times
+            use_cache: False to always call the model and leave the cache alone
+            validate: Optional check a response must pass to be cached, so
+                an unusable answer is retried next time instead of replayed
+
+        Returns:
+            str: Response text; empty or failed responses are never cached
+        """
+        if not use_cache:
+            self._count("bypassed")
+            return call()
+
+        key = self.make_key(model, messages, params, sample)
+        cached = self.get(key)
+        if cached is not None:
+            self._count("hits")
+            return cached
+
+        self._count("misses")
+        response = call()
+        if response and (validate is None or validate(response)):
+            self.set(key, model, response)
+        return response
+
+    def get(self, key):
+        try:
+            now = time.time()
+            with self._connect() as conn:
+                row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                if row[1] + self.ttl_seconds < now:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    return None
+                conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+                return row[0]
+        except sqlite3.Error as e:
+            # A broken cache must never fail the request
+            self._count("errors")
+            logging.error(f"LLM cache read error: {str(e)}")
+            return None
+
+    def set(self, key, model, response):
+        try:
+            now = time.time()
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (key, model, response, now, now)
+                )
+                # Expired entries go first, then the least recently used beyond max_entries
+                evicted = conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+                evicted += conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                ).rowcount
+            self._count("stores")
+            if evicted:
+                self._count("evictions", evicted)
+        except sqlite3.Error as e:
+            self._count("errors")
+            logging.error(f"LLM cache write error: {str(e)}")
+
+    def stats(self):
+        """Hit/miss counters for this process and the number of stored entries"""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else None
+        try:
+            with self._connect() as conn:
+                stats["entries"] = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        except sqlite3.Error:
+            stats["entries"] = None
+        return stats
+
+# Shared by every Together AI call site in the process
+llm_cache = LLMResponseCache.from_env()
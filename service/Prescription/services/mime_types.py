@@ -0,0 +1,13 @@
+def mime_type_from_bytes(data):
+    """MIME type from the file signature, or None if it is not a known image"""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'image/jpeg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[:5] == b'%PDF-':
+        return 'application/pdf'
+    return None
@@ -2,6 +2,7 @@ from .cloudinary_service import upload_to_cloudinary
 from .together_ai_service import TogetherAIService
 from .text_process import TextProcess  # Fixed class name
 from .db_service import DatabaseService
+from .image_preprocessing import prepare_image
 from Medicine.enrichment_service import MedicineEnrichmentService
 import logging
 import re
@@ -25,8 +26,11 @@ class PrescriptionProcessor:
     def process_prescription_image(self, image_file, session=None):
         """Upload image and process prescription in one go"""
         try:
+            # Phone photos are oriented, cropped and downscaled before anything else sees them
+            image = prepare_image(image_file, "prescription")
+
             # First upload to Cloudinary
-            upload_result = upload_to_cloudinary(image_file)
+            upload_result = upload_to_cloudinary(image.file())
             if not upload_result:
                 raise Exception("Failed to upload image")
                 
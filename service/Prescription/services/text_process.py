@@ -6,6 +6,7 @@ import json
 import logging
 from dotenv import load_dotenv
 from together import Together
+from Prescription.services.llm_cache import llm_cache
 import asyncio
 from Prescription.models.prescription import Prescription
 
@@ -140,23 +141,41 @@ class TextProcess:
             logging.error(f"JSON string cleaning error: {str(e)}")
             return json_string
 
+    def _is_valid_json_response(self, result):
+        try:
+            json.loads(self._clean_json_string(result))
+            return True
+        except json.JSONDecodeError:
+            return False
+
     def analyze_text(self, raw_text, db_service=None, image_data=None, session=None):
         """Analyze prescription text and optionally save to database"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": f"{self.prompt}\n\n{raw_text}"
-                    }
-                ],
-                temperature=0.3,
-                max_tokens=2000
+            messages = [
+                {
+                    "role": "user",
+                    "content": f"{self.prompt}\n\n{raw_text}"
+                }
+            ]
+            params = {"temperature": 0.3, "max_tokens": 2000}
+
+            def call():
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    **params
+                )
+                if hasattr(response, 'choices') and response.choices:
+                    return response.choices[0].message.content
+                return None
+
+            # Re-submitting the same prescription text reuses the earlier answer
+            result = llm_cache.get_or_call(
+                self.model, messages, call, params=params,
+                validate=self._is_valid_json_response
             )
 
-            if hasattr(response, 'choices') and response.choices:
-                result = response.choices[0].message.content
+            if result:
                 try:
                     cleaned_json = self._clean_json_string(result)
                     parsed_json = json.loads(cleaned_json)
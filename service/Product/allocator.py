@@ -0,0 +1,113 @@
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne
+import logging
+
+def stock_quantity(value):
+    """Whole-unit quantity from a count sent as a number or text, or None"""
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+def plan_fefo_allocation(stock_collection, shop_owner, medicine_id, quantity, reserved=None, session=None):
+    """Split a quantity of one medicine across its stock batches, first-expiry-first-out
+
+    Reads the shop's unexpired batches of the medicine in a single scan of the
+    (shop_owner, medicine_id, exp_date_ts) index. Expired batches and batches
+    without a parseable expiry are never picked; those can still be sold by
+    choosing the stock_id explicitly.
+
+    Args:
+        stock_collection: The Stock collection
+        shop_owner: Shop whose batches may be used
+        medicine_id: ObjectId of the medicine
+        quantity: Total quantity to allocate
+        reserved: Optional {stock_id: quantity} already claimed by other lines of the same sale
+        session: Optional client session, so the read is part of the sale transaction
+
+    Returns:
+        tuple: ([(stock_id, quantity), ...] in expiry order, quantity that could not be allocated)
+    """
+    reserved = reserved or {}
+    allocations = []
+    remaining = quantity
+
+    batches = stock_collection.find(
+        {
+            'shop_owner': shop_owner,
+            'medicine_id': medicine_id,
+            'exp_date_ts': {'$gt': datetime.utcnow()}
+        },
+        {'quantity': 1},
+        session=session
+    ).sort('exp_date_ts', 1)
+
+    for batch in batches:
+        available = batch.get('quantity', 0) - reserved.get(batch['_id'], 0)
+        if available <= 0:
+            continue
+
+        take = min(available, remaining)
+        allocations.append((batch['_id'], take))
+        remaining -= take
+        if remaining == 0:
+            break
+
+    batches.close()
+    return allocations, remaining
+
+def backfill_allocation_fields(stock_collection, shop_owner=None, batch_size=500):
+    """Make stock written before FEFO allocation visible to it
+
+    plan_fefo_allocation matches on shop_owner and an ObjectId medicine_id
+    and draws from 'quantity'. Entries from /stock/bulk-add stored the
+    medicine id as a string and the count under 'stock', and older entries
+    have no shop_owner at all.
+
+    Args:
+        stock_collection: The Stock collection
+        shop_owner: Shop to assign to entries without one; left unset when None
+        batch_size: Number of updates sent per bulk_write
+
+    Returns:
+        dict: Counts of scanned and updated documents, and entries still
+            without a shop_owner
+    """
+    stats = {'scanned': 0, 'updated': 0, 'unowned': 0}
+    operations = []
+
+    cursor = stock_collection.find(
+        {'$or': [
+            {'medicine_id': {'$type': 'string'}},
+            {'quantity': {'$exists': False}, 'stock': {'$exists': True}},
+            {'shop_owner': {'$in': [None, '']}}
+        ]},
+        {'medicine_id': 1, 'quantity': 1, 'stock': 1, 'shop_owner': 1}
+    )
+    for stock in cursor:
+        stats['scanned'] += 1
+        fields = {}
+        medicine_id = stock.get('medicine_id')
+        if isinstance(medicine_id, str) and ObjectId.is_valid(medicine_id):
+            fields['medicine_id'] = ObjectId(medicine_id)
+        if 'quantity' not in stock and stock_quantity(stock.get('stock')) is not None:
+            fields['quantity'] = stock_quantity(stock.get('stock'))
+        if not stock.get('shop_owner'):
+            if shop_owner:
+                fields['shop_owner'] = shop_owner
+            else:
+                stats['unowned'] += 1
+        if not fields:
+            continue
+
+        operations.append(UpdateOne({'_id': stock['_id']}, {'$set': fields}))
+        if len(operations) >= batch_size:
+            stats['updated'] += stock_collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+
+    if operations:
+        stats['updated'] += stock_collection.bulk_write(operations, ordered=False).modified_count
+
+    logging.info(f"Allocation fields backfill finished: {stats}")
+    return stats
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+import logging
+import re
+
+def parse_expiry_date(exp_date_str):
+    """Parse expiry date from various formats"""
+    if not exp_date_str or exp_date_str == "Not Available":
+        return None
+
+    try:
+        # Try different date formats
+
+        # Format: DD/MM/YYYY or MM/DD/YYYY
+        if re.match(r'^\d{1,2}/\d{1,2}/\d{4}$', exp_date_str):
+            parts = exp_date_str.split('/')
+            # Try both DD/MM/YYYY and MM/DD/YYYY
+            try:
+                return datetime(int(parts[2]), int(parts[1]), int(parts[0]))
+            except ValueError:
+                return datetime(int(parts[2]), int(parts[0]), int(parts[1]))
+
+        # Format: MM/YYYY
+        if re.match(r'^\d{1,2}/\d{4}$', exp_date_str):
+            month, year = exp_date_str.split('/')
+            return datetime(int(year), int(month), 1) + timedelta(days=30)
+
+        # Format: MM/YY (as extracted by the bill scanner)
+        if re.match(r'^\d{1,2}/\d{2}$', exp_date_str):
+            month, year = exp_date_str.split('/')
+            return datetime(2000 + int(year), int(month), 1) + timedelta(days=30)
+
+        # Format: YYYY-MM-DD
+        if re.match(r'^\d{4}-\d{1,2}-\d{1,2}$', exp_date_str):
+            return datetime.fromisoformat(exp_date_str)
+
+        # Format: YYYY-MM-DD with time
+        if 'T' in exp_date_str:
+            return datetime.fromisoformat(exp_date_str.replace('Z', '+00:00'))
+
+        # Try general parsing for other formats
+        from dateutil import parser
+        return parser.parse(exp_date_str)
+    except Exception as e:
+        logging.debug(f"Could not parse date '{exp_date_str}': {str(e)}")
+        return None
+
+def expiry_timestamp(exp_date):
+    """Return the canonical exp_date_ts value stored alongside a stock's exp_date
+
+    Args:
+        exp_date: Expiry as entered (free-form string or datetime)
+
+    Returns:
+        datetime: Naive UTC datetime, or None if the date cannot be parsed
+    """
+    if isinstance(exp_date, datetime):
+        expiry_date = exp_date
+    elif isinstance(exp_date, str):
+        expiry_date = parse_expiry_date(exp_date.strip())
+    else:
+        return None
+
+    # Keep everything naive so range queries compare like with like
+    if expiry_date and expiry_date.tzinfo is not None:
+        expiry_date = expiry_date.replace(tzinfo=None) - expiry_date.utcoffset()
+    return expiry_date
+
+def backfill_expiry_timestamps(stock_collection, batch_size=500):
+    """Populate exp_date_ts on stock documents written before it existed
+
+    Args:
+        stock_collection: The Stock collection
+        batch_size: Number of updates sent per bulk_write
+
+    Returns:
+        dict: Counts of scanned, updated and unparseable documents
+    """
+    stats = {'scanned': 0, 'updated': 0, 'unparseable': 0}
+    operations = []
+
+    # Entries from /stock/bulk-add keep their expiry under 'expiry'
+    cursor = stock_collection.find(
+        {'exp_date_ts': {'$exists': False}},
+        {'exp_date': 1, 'expiry': 1}
+    )
+    for stock in cursor:
+        stats['scanned'] += 1
+        exp_date_ts = expiry_timestamp(stock.get('exp_date', stock.get('expiry')))
+        if exp_date_ts is None:
+            stats['unparseable'] += 1
+
+        # Store None as well so the document is not rescanned next time
+        operations.append(UpdateOne({'_id': stock['_id']}, {'$set': {'exp_date_ts': exp_date_ts}}))
+        if len(operations) >= batch_size:
+            stats['updated'] += stock_collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+
+    if operations:
+        stats['updated'] += stock_collection.bulk_write(operations, ordered=False).modified_count
+
+    logging.info(f"Expiry backfill finished: {stats}")
+    return stats
@@ -1,8 +1,8 @@
 from together import Together
+from Prescription.services.llm_cache import llm_cache
 import os
 import re
 import logging
-import requests
 import base64
 import time
 import random
@@ -20,32 +20,6 @@ class ImageProcessor:
         # Max retries for API requests
         self.max_retries = int(os.getenv('API_MAX_RETRIES', 3))
 
-    def get_mime_type_from_url(self, url):
-        """Determine MIME type from URL or response headers"""
-        try:
-            if url.startswith('data:'):
-                # Extract MIME type from data URL
-                mime_type = url.split(';')[0].split(':')[1]
-                return mime_type
-            
-            response = requests.head(url)
-            content_type = response.headers.get('content-type', '')
-            if content_type.startswith('image/'):
-                return content_type
-        except:
-            pass
-        
-        # Fallback to extension-based detection
-        extension = os.path.splitext(url)[1].lower()
-        mime_types = {
-            '.png': 'image/png',
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg',
-            '.gif': 'image/gif',
-            '.webp': 'image/webp'
-        }
-        return mime_types.get(extension, 'image/jpeg')
-
     def extract_useful_info(self, text):
         """Extract information from formatted text"""
         logging.debug(f"Extracting useful info from text: {text}")
@@ -112,7 +86,26 @@ class ImageProcessor:
         ordered_info = {key: info[key] for key in ['BNo', 'MfgD', 'ExpD', 'MRP']}
         return ordered_info
 
-    def _make_api_request(self, messages):
+    def _is_useful_response(self, response_text):
+        info = self.extract_useful_info(response_text)
+        return any(info[key] for key in ('BNo', 'ExpD', 'MRP'))
+
+    def _make_api_request(self, messages, sample=0):
+        """Make API request through the shared response cache
+
+        Responses without a batch number, expiry date or MRP are not cached,
+        so the next scan of the same image asks the model again.
+
+        Args:
+            messages: Chat messages sent to the model
+            sample: Index of this request among repeated requests for the same image
+        """
+        return llm_cache.get_or_call(
+            self.model, messages, lambda: self._request_with_retries(messages),
+            sample=sample, validate=self._is_useful_response
+        )
+
+    def _request_with_retries(self, messages):
         """Make API request with exponential backoff retry logic"""
         retry_count = 0
         base_delay = 1  # Start with 1 second delay
@@ -181,7 +174,7 @@ class ImageProcessor:
                         }
                     ]
                     
-                    response_text = self._make_api_request(messages)
+                    response_text = self._make_api_request(messages, sample=attempt)
 
                     logging.debug(f"API response text: {response_text}")
                     
@@ -218,7 +211,6 @@ class ImageProcessor:
             if image_url.startswith('data:'):
                 return self.analyze_image_base64(image_url, num_requests)
                 
-            mime_type = self.get_mime_type_from_url(image_url)
             aggregated_info = {'BNo': set(), 'MfgD': set(), 'ExpD': set(), 'MRP': set()}
             successful_requests = 0
 
@@ -236,7 +228,7 @@ class ImageProcessor:
                         }
                     ]
                     
-                    response_text = self._make_api_request(messages)
+                    response_text = self._make_api_request(messages, sample=attempt)
 
                     logging.debug(f"API response text: {response_text}")
                     
@@ -1,4 +1,6 @@
 from datetime import datetime
+from Product.expiry import expiry_timestamp
+from Medicine.search_index import search_fields, medicine_name_key
 
 class Medicine:
     def __init__(self, product_name, product_manufactured, salt_composition, sub_category=None, 
@@ -30,7 +32,9 @@ class Medicine:
             "image_url": self.image_url,
             "additional_notes": self.additional_notes,
             "created_at": self.created_at,
-            "updated_at": self.updated_at
+            "updated_at": self.updated_at,
+            "name_key": medicine_name_key(self.product_name),
+            **search_fields(self.product_name, self.product_manufactured)
         }
 
 class Stock:
@@ -39,6 +43,7 @@ class Stock:
         self.batch_no = batch_no
         self.mfg_date = mfg_date
         self.exp_date = exp_date
+        self.exp_date_ts = expiry_timestamp(exp_date)
         self.mrp = mrp
         self.quantity = quantity
         self.image_url = image_url
@@ -52,6 +57,7 @@ class Stock:
             "batch_no": self.batch_no,
             "mfg_date": self.mfg_date,
             "exp_date": self.exp_date,
+            "exp_date_ts": self.exp_date_ts,
             "mrp": self.mrp,
             "quantity": self.quantity,
             "image_url": self.image_url,
@@ -0,0 +1,52 @@
+def stock_listing_pipeline(match=None):
+    """Build the aggregation that joins each stock batch with its medicine.
+
+    Produces one document per stock entry in the shape served by GET /stock:
+    {id, name, manufacturer, category, batch, price, expiry, stock}.
+    The whole listing is resolved in a single round trip instead of one
+    medicine lookup per stock row.
+
+    Args:
+        match: Optional extra filter applied to the Stock collection first
+
+    Returns:
+        list: Aggregation pipeline stages
+    """
+    stock_filter = {'medicine_id': {'$exists': True, '$ne': None}}
+    if match:
+        stock_filter.update(match)
+
+    return [
+        {'$match': stock_filter},
+        # Some older entries store medicine_id as a string, so normalise it
+        # before the join to keep using the _id index on Medicine
+        {'$addFields': {
+            '_medicine_oid': {
+                '$convert': {'input': '$medicine_id', 'to': 'objectId', 'onError': '$medicine_id'}
+            }
+        }},
+        {'$lookup': {
+            'from': 'Medicine',
+            'localField': '_medicine_oid',
+            'foreignField': '_id',
+            'as': 'medicine'
+        }},
+        {'$unwind': {'path': '$medicine', 'preserveNullAndEmptyArrays': True}},
+        {'$project': {
+            '_id': 0,
+            'id': {'$toString': '$_id'},
+            'name': {
+                '$cond': [
+                    {'$ifNull': ['$medicine', False]},
+                    {'$ifNull': ['$medicine.product_name', 'Unknown Product']},
+                    {'$concat': ['Unknown (ID: ', {'$toString': '$medicine_id'}, ')']}
+                ]
+            },
+            'manufacturer': {'$ifNull': ['$medicine.product_manufactured', 'Unknown']},
+            'category': {'$ifNull': ['$medicine.sub_category', 'Uncategorized']},
+            'batch': {'$ifNull': ['$batch_no', 'N/A']},
+            'price': {'$convert': {'input': '$mrp', 'to': 'double', 'onError': 0.0, 'onNull': 0.0}},
+            'expiry': {'$ifNull': ['$exp_date', '']},
+            'stock': {'$convert': {'input': '$quantity', 'to': 'int', 'onError': 0, 'onNull': 0}}
+        }}
+    ]
@@ -1,9 +1,12 @@
 # Libraries for core functionality
 from dotenv import load_dotenv
 from routes import init_routes
+from commands import init_commands
 from Prescription.services.db_service import DatabaseService
 from flask_cors import CORS
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, session
+from config import Config
+from Prescription.services.llm_cache import llm_cache
 import cloudinary
 import cloudinary.uploader
 import logging
@@ -65,10 +68,14 @@ app.config['TOGETHER_API_KEY'] = together_api_key
 
 # Initialize database
 app.db = DatabaseService()
+app.db.ensure_indexes()
 
 # Initialize routes - all routes are now handled through blueprints
 init_routes(app)
 
+# Register maintenance CLI commands (flask <command>)
+init_commands(app)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -78,6 +85,13 @@ def bulk_entry():
     """Render the bulk entry page"""
     return render_template('bulk_entry.html')
 
+@app.route('/llm-cache/stats')
+def llm_cache_stats():
+    """Hit/miss counters of the shared LLM response cache (admin only)"""
+    if session.get('user') not in Config.ADMIN_EMAILS:
+        return jsonify({'error': 'Admin access required'}), 403
+    return jsonify(llm_cache.stats()), 200
+
 def keep_alive():
     """Sends a request to the server to keep it awake and prevent spindown. Only runs on Render."""
     # Only run on Render
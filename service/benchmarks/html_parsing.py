@@ -0,0 +1,141 @@
+"""Benchmark for scraper HTML parsing.
+
+Compares the previous approach (a full html.parser tree for every page) with
+Medicine.html_parsing (lxml when installed, parsing only the containers the
+scraper reads) on search and product pages. Reports median parse-and-select
+time and peak memory (tracemalloc) per page, and checks both approaches find
+the same product link / overview text.
+
+Pages come from --pages, a directory of saved pages named
+<source>-search-*.html or <source>-product-*.html (e.g. 1mg-product-dolo.html).
+Without it, synthetic pages shaped like 1mg's are generated, padded with
+navigation, scripts and unrelated markup to a realistic size.
+
+Usage (from the service directory):
+    python -m benchmarks.html_parsing
+    python -m benchmarks.html_parsing --pages ~/saved-pages --repeat 20
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+import tracemalloc
+from bs4 import BeautifulSoup
+from Medicine.html_parsing import PARSER, parse_containers, SEARCH_RESULT_CLASSES, PRODUCT_CONTENT_CLASSES
+
+SEARCH_SELECTOR = "div.style__horizontal-card___1Zwmt.style__height-158___1XIvD a"
+PRODUCT_SELECTORS = {
+    "1mg": "div.DrugOverview__content___3nCO5, div.ProductDescription__content___1rfvD",
+    "Netmeds": "div.inner-content, div.product-detail",
+    "PharmEasy": "div.MedicineOverviewSection_medicineContainer__gGsPN, div.style__container___2ZDHh",
+    "Apollo247": "div.MedicineDetailsContent, div.MuiCardContent-root"
+}
+
+
+def filler(rng, blocks):
+    """Markup the scraper never reads: menus, footers, inline scripts"""
+    parts = []
+    for i in range(blocks):
+        items = "".join(f'<li class="nav__item"><a href="/c/{i}-{j}">Category {j}</a></li>' for j in range(12))
+        parts.append(
+            f'<div class="Layout__block___{i}"><ul class="nav">{items}</ul>'
+            f'<p>{" ".join(rng.choice(["lorem", "ipsum", "dolor", "sit", "amet"]) for _ in range(80))}</p>'
+            f'<script>window.__b{i}={{"k":"{"x" * 200}"}};</script></div>'
+        )
+    return "".join(parts)
+
+
+def synthetic_pages(rng, count=5, filler_blocks=150):
+    pages = []
+    for n in range(count):
+        cards = "".join(
+            f'<div class="style__horizontal-card___1Zwmt style__height-158___1XIvD">'
+            f'<a href="/drugs/medicine-{n}-{i}"><span>Medicine {n} {i} 500mg Tablet</span></a></div>'
+            for i in range(20)
+        )
+        pages.append(("1mg", "search", f"<html><body>{filler(rng, filler_blocks)}{cards}</body></html>"))
+        overview = "".join(f"<p>Overview paragraph {i} for medicine {n}.</p>" for i in range(30))
+        pages.append((
+            "1mg", "product",
+            f'<html><body>{filler(rng, filler_blocks)}'
+            f'<div class="DrugHeader__title-container___T5ZQl"><h1>Medicine {n}</h1></div>'
+            f'<div class="DrugOverview__content___3nCO5">{overview}</div></body></html>'
+        ))
+    return pages
+
+
+def saved_pages(directory):
+    pages = []
+    for filename in sorted(os.listdir(directory)):
+        parts = filename.split("-")
+        if not filename.endswith(".html") or len(parts) < 3 or parts[1] not in ("search", "product"):
+            continue
+        with open(os.path.join(directory, filename), encoding="utf-8", errors="replace") as f:
+            pages.append((parts[0], parts[1], f.read()))
+    return pages
+
+
+def baseline(source, kind, html):
+    soup = BeautifulSoup(html, "html.parser")
+    return select(soup, source, kind)
+
+
+def optimized(source, kind, html):
+    classes = SEARCH_RESULT_CLASSES.get(source) if kind == "search" else PRODUCT_CONTENT_CLASSES.get(source)
+    return select(parse_containers(html, classes), source, kind)
+
+
+def select(soup, source, kind):
+    if kind == "search":
+        link = soup.select_one(SEARCH_SELECTOR)
+        return link["href"] if link else None
+    content = soup.select_one(PRODUCT_SELECTORS.get(source, "body"))
+    return content.get_text(separator="\n", strip=True) if content else None
+
+
+def measure(parse, pages, repeat):
+    """Return (median ms per page, peak MB for one page, results)"""
+    timings = []
+    for _ in range(repeat):
+        for source, kind, html in pages:
+            start = time.perf_counter()
+            parse(source, kind, html)
+            timings.append((time.perf_counter() - start) * 1000)
+
+    peak = 0
+    results = []
+    for source, kind, html in pages:
+        tracemalloc.start()
+        results.append(parse(source, kind, html))
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return statistics.median(timings), peak / (1024 * 1024), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", help="Directory of saved <source>-<search|product>-*.html pages")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    pages = saved_pages(args.pages) if args.pages else synthetic_pages(random.Random(7))
+    if not pages:
+        parser.error(f"No <source>-<search|product>-*.html pages in {args.pages}")
+
+    average_kb = sum(len(html) for _, _, html in pages) / len(pages) / 1024
+    print(f"{len(pages)} pages, {average_kb:.0f} KB on average, optimized parser: {PARSER}")
+    print(f"{'approach':<28} {'median ms':>10} {'peak MB':>8}")
+
+    base_ms, base_mb, base_results = measure(baseline, pages, args.repeat)
+    print(f"{'full tree, html.parser':<28} {base_ms:>10.2f} {base_mb:>8.2f}")
+    fast_ms, fast_mb, fast_results = measure(optimized, pages, args.repeat)
+    print(f"{'containers only, ' + PARSER:<28} {fast_ms:>10.2f} {fast_mb:>8.2f}")
+
+    mismatches = sum(1 for a, b in zip(base_results, fast_results) if a != b)
+    print(f"speedup {base_ms / fast_ms:.1f}x, memory {base_mb / fast_mb:.1f}x less, "
+          f"{mismatches} of {len(pages)} pages extracted differently")
+
+
+if __name__ == "__main__":
+    main()
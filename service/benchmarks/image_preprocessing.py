@@ -0,0 +1,146 @@
+"""Benchmark for image preprocessing before upload and vision inference.
+
+Runs Prescription.services.image_preprocessing.prepare_image over phone-photo
+style images at several longest-side / JPEG-quality settings and reports,
+per setting, the upload size, the base64 payload sent to the model,
+preprocessing time and what is lost:
+
+- PSNR of the result against the oriented, cropped original (scaled back
+  up to its size), a measure of overall fidelity
+- height in pixels of the smallest printed text (8 pt product rows), which
+  vision models stop reading reliably below roughly 10 px
+- with --model and TOGETHER_API_KEY set, the share of batch numbers the
+  bill extraction prompt actually recovers, i.e. real accuracy
+
+Images come from --images (a directory of photos; accuracy columns that
+need ground truth are skipped) or are synthesized: a rendered bill page
+placed on a grey table with a margin, stored sideways with an EXIF
+orientation tag and saved as a large JPEG, like a phone camera does.
+
+Usage (from the service directory):
+    python -m benchmarks.image_preprocessing
+    python -m benchmarks.image_preprocessing --images ~/bill-photos --sides 1024 1600 2048
+    python -m benchmarks.image_preprocessing --model --sides 1280 2048
+"""
+import argparse
+import base64
+import io
+import logging
+import math
+import os
+import random
+import re
+import time
+import fitz  # PyMuPDF
+from PIL import Image, ImageChops, ImageFilter, ImageOps, ImageStat
+from Prescription.services.image_preprocessing import prepare_image, crop_border
+from benchmarks.pdf_render import synthetic_bill
+
+# synthetic_bill prints product rows in 8 pt type
+SMALLEST_TEXT_PT = 8
+PHOTO_DPI = 300
+
+
+def synthetic_photo(rng):
+    """A bill page photographed on a table: margin, sideways pixels with an EXIF tag, sensor noise"""
+    with fitz.open(stream=synthetic_bill(pages=1), filetype="pdf") as document:
+        pix = document[0].get_pixmap(dpi=PHOTO_DPI)
+        page = Image.open(io.BytesIO(pix.tobytes("png"))).convert("RGB")
+
+    table = Image.new("RGB", (int(page.width * 1.25), int(page.height * 1.15)), (92, 84, 78))
+    table.paste(page, ((table.width - page.width) // 2, (table.height - page.height) // 2))
+    noise = Image.effect_noise(table.size, 12).convert("RGB")
+    photo = Image.blend(table, noise, 0.06).filter(ImageFilter.GaussianBlur(0.6))
+
+    # Cameras keep the sensor's orientation and record the rotation in EXIF
+    sideways = photo.transpose(Image.Transpose.ROTATE_90)
+    exif = sideways.getexif()
+    exif[0x0112] = 6
+    buffer = io.BytesIO()
+    sideways.save(buffer, "JPEG", quality=95, exif=exif)
+    batches = [f"BT{r:05d}" for r in range(30)]
+    return buffer.getvalue(), page.width / (595 / 72), batches
+
+
+def saved_photos(directory):
+    photos = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+            with open(os.path.join(directory, filename), "rb") as f:
+                photos.append((f.read(), None, None))
+    return photos
+
+
+def reference(data):
+    """The original at full resolution, oriented and cropped like prepare_image does"""
+    return crop_border(ImageOps.exif_transpose(Image.open(io.BytesIO(data))).convert("RGB"))
+
+
+def psnr(original, prepared_bytes):
+    prepared = Image.open(io.BytesIO(prepared_bytes)).convert("RGB").resize(original.size, Image.LANCZOS)
+    rms = ImageStat.Stat(ImageChops.difference(original.convert("L"), prepared.convert("L"))).rms[0]
+    return 99.0 if rms == 0 else 20 * math.log10(255 / rms)
+
+
+def batch_recall(processor, prepared, batches):
+    data_url = f"data:{prepared.mime_type};base64,{base64.b64encode(prepared.image_bytes).decode('utf-8')}"
+    text = processor._make_extraction_api_call(data_url) or ""
+    found = set(re.findall(r"BT\s*0*\d+", text.replace(" ", "")))
+    normalized = {re.sub(r"BT0*", "BT", batch) for batch in found}
+    return sum(1 for batch in batches if re.sub(r"BT0*", "BT", batch) in normalized) / len(batches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="Directory of photos to preprocess")
+    parser.add_argument("--sides", nargs="+", type=int, default=[1024, 1280, 1600, 2048, 2560])
+    parser.add_argument("--quality", nargs="+", type=int, default=[70, 85])
+    parser.add_argument("--model", action="store_true", help="Also measure extraction recall with Together AI")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    photos = saved_photos(args.images) if args.images else [synthetic_photo(random.Random(7))]
+    if not photos:
+        parser.error(f"No photos in {args.images}")
+
+    processor = None
+    if args.model:
+        if not os.getenv("TOGETHER_API_KEY"):
+            parser.error("--model needs TOGETHER_API_KEY")
+        from BillScanner.bill_processor import BillProcessor
+        processor = BillProcessor()
+
+    references = [reference(data) for data, _, _ in photos]
+    original_kb = sum(len(data) for data, _, _ in photos) / len(photos) / 1024
+    print(f"{len(photos)} photo(s), {original_kb:.0f} KB and {references[0].width}x{references[0].height} "
+          f"after orientation and cropping (first photo)")
+    header = f"{'max side':>8} {'quality':>7} {'upload KB':>9} {'payload KB':>10} {'ms':>6} {'PSNR dB':>7} {'text px':>7}"
+    print(header + (f" {'recall':>6}" if processor else ""))
+
+    for side in args.sides:
+        for quality in args.quality:
+            sizes, payloads, timings, fidelity, text_px, recall = [], [], [], [], [], []
+            for (data, page_dpi, batches), original in zip(photos, references):
+                start = time.perf_counter()
+                prepared = prepare_image(data, "bill", max_side=side, quality=quality)
+                timings.append((time.perf_counter() - start) * 1000)
+                sizes.append(prepared.size)
+                payloads.append(len(prepared.base64()))
+                fidelity.append(psnr(original, prepared.image_bytes))
+                if page_dpi:
+                    scale = prepared.height / original.height
+                    text_px.append(SMALLEST_TEXT_PT / 72 * page_dpi * scale)
+                if processor and batches:
+                    recall.append(batch_recall(processor, prepared, batches))
+
+            row = (f"{side:>8} {quality:>7} {sum(sizes) / len(sizes) / 1024:>9.0f} "
+                   f"{sum(payloads) / len(payloads) / 1024:>10.0f} {sum(timings) / len(timings):>6.0f} "
+                   f"{sum(fidelity) / len(fidelity):>7.1f} "
+                   f"{(sum(text_px) / len(text_px)) if text_px else float('nan'):>7.1f}")
+            if processor:
+                row += f" {(sum(recall) / len(recall)) if recall else float('nan'):>6.2f}"
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark for the in-memory medicine catalogue.
+
+Builds MedicineCatalogue from a synthetic catalogue of growing size and
+reports build time, memory footprint (tracemalloc) and autocomplete latency
+for prefix and misspelt queries, plus how often the intended medicine is in
+the suggestions. Needs no database.
+
+Usage (from the service directory):
+    python -m benchmarks.medicine_catalogue
+    python -m benchmarks.medicine_catalogue --sizes 10000 100000 --queries 500
+"""
+import argparse
+import random
+import statistics
+import string
+import time
+import tracemalloc
+from bson import ObjectId
+from Medicine.catalogue import MedicineCatalogue
+
+SYLLABLES = ["pa", "ra", "ce", "ta", "mol", "do", "lo", "az", "ith", "ro", "my", "cin", "met", "for",
+             "min", "pan", "to", "pra", "zol", "amo", "xi", "cil", "lin", "cef", "ix", "ime", "vo", "gli"]
+FORMS = ["Tablet", "Capsule", "Syrup", "Injection", "Cream", "Drops"]
+STRENGTHS = ["5mg", "10mg", "250mg", "500mg", "650mg", "1g", "100ml"]
+
+
+def synthetic_medicines(count, seed=7):
+    rng = random.Random(seed)
+    for _ in range(count):
+        brand = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+        yield {
+            "_id": ObjectId(),
+            "product_name": f"{brand} {rng.choice(STRENGTHS)} {rng.choice(FORMS)}",
+            "product_manufactured": f"Pharma {rng.randint(1, 300)}",
+            "salt_composition": "Synthetic",
+        }
+
+
+def misspell(word, rng):
+    """Apply one random edit: substitution, deletion, insertion or transposition"""
+    i = rng.randrange(len(word))
+    edit = rng.choice("sdit")
+    if edit == "s":
+        return word[:i] + rng.choice(string.ascii_lowercase) + word[i + 1:]
+    if edit == "d" and len(word) > 3:
+        return word[:i] + word[i + 1:]
+    if edit == "t" and i < len(word) - 1:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word[:i] + rng.choice(string.ascii_lowercase) + word[i:]
+
+
+def run_queries(catalogue, queries):
+    """Return (latencies in ms, hit rate)"""
+    latencies = []
+    hits = 0
+    for query, expected_id in queries:
+        start = time.perf_counter()
+        suggestions = catalogue.autocomplete(query, limit=10)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += any(s["_id"] == expected_id for s in suggestions)
+    return latencies, hits / len(queries)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 100000])
+    parser.add_argument("--queries", type=int, default=300)
+    args = parser.parse_args()
+
+    print(f"{'medicines':>10} {'build s':>8} {'memory MB':>10} {'query':<8} {'p50 ms':>8} {'p95 ms':>8} {'hit rate':>9}")
+    for size in args.sizes:
+        medicines = list(synthetic_medicines(size))
+
+        # The catalogue is never refreshed from Mongo during the benchmark
+        catalogue = MedicineCatalogue(medicine_collection=None, refresh_interval=float("inf"))
+        tracemalloc.start()
+        start = time.perf_counter()
+        catalogue.load_documents(medicines)
+        catalogue._last_refresh = time.monotonic()
+        build_seconds = time.perf_counter() - start
+        memory_mb = tracemalloc.get_traced_memory()[0] / (1024 * 1024)
+        tracemalloc.stop()
+
+        rng = random.Random(size)
+        sample = rng.sample(medicines, min(args.queries, size))
+        prefix_queries = [(m["product_name"].split()[0][:rng.randint(3, 6)], str(m["_id"])) for m in sample]
+        typo_queries = [(misspell(m["product_name"].split()[0].lower(), rng), str(m["_id"])) for m in sample]
+
+        for label, queries in (("prefix", prefix_queries), ("typo", typo_queries)):
+            latencies, hit_rate = run_queries(catalogue, queries)
+            print(f"{size:>10} {build_seconds:>8.2f} {memory_mb:>10.1f} {label:<8} "
+                  f"{statistics.median(latencies):>8.2f} {percentile(latencies, 95):>8.2f} {hit_rate:>9.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Benchmark for bill PDF rasterization.
+
+Compares the previous approach (upload saved to the temp directory, every
+page rendered at 300 DPI and written as a JPEG into a new temp directory)
+with BillScanner.pdf_render (pages rendered straight to in-memory JPEG
+bytes at a configurable DPI and quality). Reports median render time and
+output size per page, and the files each approach leaves on disk.
+
+With --concurrent N, N PDFs are also rendered at once, from N threads in
+this process (all pages contend for the GIL) and through the shared
+BillScanner.pdf_render.RenderPool, and pages per second are compared.
+
+PDFs come from --pdf (one or more bill PDFs). Without it, a synthetic
+multi-page bill with a product table is generated with PyMuPDF.
+
+Usage (from the service directory):
+    python -m benchmarks.pdf_render
+    python -m benchmarks.pdf_render --pdf bill.pdf --dpi 150 200 300 --quality 70 85
+    python -m benchmarks.pdf_render --concurrent 8
+"""
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import fitz  # PyMuPDF
+from BillScanner.pdf_render import render_pdf_pages, RenderPool, RENDER_WORKERS
+
+
+def synthetic_bill(pages=4, rows=30):
+    document = fitz.open()
+    for p in range(pages):
+        page = document.new_page(width=595, height=842)  # A4 in points
+        page.insert_text((40, 50), f"MEDICAL DISTRIBUTORS PVT LTD    Bill No. B-{1000 + p}    Date 01/01/2025", fontsize=10)
+        page.insert_text((40, 80), "Product                  HSN   Qty  Batch     Exp    MRP     Rate    Amount", fontsize=8)
+        for r in range(rows):
+            y = 100 + r * 22
+            page.insert_text(
+                (40, y),
+                f"Medicine {p}-{r} 500mg Tab   3004  {r % 9 + 1:>3}  BT{r:05d}  08/26  {99.5 + r:>6.2f}  "
+                f"{80.25 + r:>6.2f}  {(80.25 + r) * (r % 9 + 1):>8.2f}",
+                fontsize=8
+            )
+            page.draw_line((40, y + 6), (555, y + 6), width=0.3)
+        page.insert_text((40, 800), f"Total Amount: {12345.67 + p:.2f}", fontsize=10)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def previous(pdf_bytes):
+    """The old convert_pdf_to_images path, including its disk writes"""
+    temp_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4()}.pdf")
+    with open(temp_path, "wb") as f:
+        f.write(pdf_bytes)
+    temp_dir = tempfile.mkdtemp()
+    timings, sizes = [], []
+    document = fitz.open(temp_path)
+    for i, page in enumerate(document):
+        start = time.perf_counter()
+        pix = page.get_pixmap(matrix=fitz.Matrix(300 / 72, 300 / 72))
+        image_path = os.path.join(temp_dir, f"page_{i}.jpg")
+        pix.save(image_path)
+        # Each page was then read back from disk for the upload
+        with open(image_path, "rb") as f:
+            sizes.append(len(f.read()))
+        timings.append((time.perf_counter() - start) * 1000)
+    document.close()
+    os.remove(temp_path)
+    # The temp directory was never removed; count what it leaves behind, then clean up here
+    leaked = len(os.listdir(temp_dir)) + 1
+    for name in os.listdir(temp_dir):
+        os.remove(os.path.join(temp_dir, name))
+    os.rmdir(temp_dir)
+    return timings, sizes, leaked
+
+
+def in_memory(pdf_bytes, dpi, quality):
+    pages = render_pdf_pages(pdf_bytes, dpi, quality)
+    return [page.render_ms for page in pages], [page.size for page in pages], 0
+
+
+def throughput(render, documents, concurrent):
+    """Pages per second with concurrent PDFs arriving at once"""
+    batch = [documents[i % len(documents)] for i in range(concurrent)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrent) as executor:
+        pages = sum(len(result) for result in executor.map(render, batch))
+    return pages / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", nargs="+", help="Bill PDFs to render")
+    parser.add_argument("--dpi", nargs="+", type=int, default=[150, 200, 300])
+    parser.add_argument("--quality", nargs="+", type=int, default=[75, 85])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--concurrent", type=int, default=0, help="Also measure throughput with this many PDFs at once")
+    args = parser.parse_args()
+
+    documents = []
+    for path in args.pdf or []:
+        with open(path, "rb") as f:
+            documents.append(f.read())
+    if not documents:
+        documents = [synthetic_bill()]
+
+    page_count = sum(fitz.open(stream=data, filetype="pdf").page_count for data in documents)
+    print(f"{len(documents)} PDF(s), {page_count} pages")
+    print(f"{'approach':<32} {'median ms/page':>14} {'KB/page':>8} {'files left':>10}")
+
+    def report(label, run):
+        timings, sizes, leaked = [], [], 0
+        for _ in range(args.repeat):
+            for data in documents:
+                t, s, left = run(data)
+                timings += t
+                sizes += s
+                leaked += left
+        print(f"{label:<32} {statistics.median(timings):>14.1f} "
+              f"{statistics.mean(sizes) / 1024:>8.0f} {leaked // args.repeat:>10}")
+
+    report("disk, 300 DPI, default JPEG", previous)
+    for dpi in args.dpi:
+        for quality in args.quality:
+            report(f"memory, {dpi} DPI, quality {quality}", lambda data: in_memory(data, dpi, quality))
+
+    if args.concurrent:
+        logging.disable(logging.INFO)
+        pool = RenderPool()
+        pool.render(documents[0])  # start the workers outside the measurement
+        print(f"\n{args.concurrent} PDFs at once, {os.cpu_count()} cores, {RENDER_WORKERS} render workers")
+        print(f"threads in process: {throughput(render_pdf_pages, documents, args.concurrent):>8.1f} pages/s")
+        print(f"render pool:        {throughput(pool.render, documents, args.concurrent):>8.1f} pages/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Benchmark for the GET /stock listing.
+
+Compares the old per-row medicine lookup against the single aggregation
+pipeline for a growing number of stock rows, reporting Mongo round trips
+and wall-clock latency for each approach.
+
+Seeds a scratch database (MSM_bench by default, never the app database).
+
+Usage (from the service directory):
+    python -m benchmarks.stock_listing
+    python -m benchmarks.stock_listing --sizes 100 1000 5000
+"""
+import argparse
+import os
+import random
+import time
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import MongoClient, monitoring
+from config import Config
+from Product.queries import stock_listing_pipeline
+
+load_dotenv()
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Count commands sent to the server, i.e. network round trips"""
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def seed(db, num_stocks):
+    """Fill the scratch collections with num_stocks batches over ~num_stocks/4 medicines"""
+    db.Medicine.drop()
+    db.Stock.drop()
+
+    num_medicines = max(1, num_stocks // 4)
+    medicines = [{
+        '_id': ObjectId(),
+        'product_name': f"Medicine {i}",
+        'product_manufactured': f"Manufacturer {i % 50}",
+        'sub_category': f"Category {i % 12}"
+    } for i in range(num_medicines)]
+    db.Medicine.insert_many(medicines)
+
+    stocks = [{
+        'medicine_id': random.choice(medicines)['_id'],
+        'batch_no': f"B{i:06d}",
+        'exp_date': f"{random.randint(1, 12):02d}/{random.randint(2025, 2029)}",
+        'mrp': round(random.uniform(5, 500), 2),
+        'quantity': random.randint(0, 200)
+    } for i in range(num_stocks)]
+    db.Stock.insert_many(stocks)
+
+
+def list_per_row(db):
+    """The previous implementation: one find_one per stock row"""
+    result = []
+    for stock in db.Stock.find():
+        medicine = db.Medicine.find_one({'_id': stock['medicine_id']})
+        if medicine:
+            result.append({
+                'id': str(stock['_id']),
+                'name': medicine.get('product_name', 'Unknown Product'),
+                'manufacturer': medicine.get('product_manufactured', 'Unknown'),
+                'category': medicine.get('sub_category', 'Uncategorized'),
+                'batch': stock.get('batch_no', 'N/A'),
+                'price': float(stock.get('mrp', 0)),
+                'expiry': stock.get('exp_date', ''),
+                'stock': int(stock.get('quantity', 0))
+            })
+    return result
+
+
+def list_aggregated(db):
+    return list(db.Stock.aggregate(stock_listing_pipeline()))
+
+
+def measure(func, db, counter, repeat):
+    """Return (rows, round trips per call, best latency in ms)"""
+    best = None
+    round_trips = 0
+    rows = 0
+    for _ in range(repeat):
+        counter.count = 0
+        start = time.perf_counter()
+        rows = len(func(db))
+        elapsed = (time.perf_counter() - start) * 1000
+        round_trips = counter.count
+        best = elapsed if best is None else min(best, elapsed)
+    return rows, round_trips, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 500, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--database', default=os.getenv('BENCH_DATABASE', 'MSM_bench'))
+    args = parser.parse_args()
+
+    if args.database == Config.DATABASE_NAME:
+        parser.error("Refusing to seed the application database")
+
+    counter = CommandCounter()
+    client = MongoClient(os.getenv('BENCH_MONGODB_URI', Config.MONGODB_URI), event_listeners=[counter])
+    db = client[args.database]
+
+    print(f"{'rows':>8} {'approach':<12} {'round trips':>12} {'latency ms':>12}")
+    try:
+        for size in args.sizes:
+            seed(db, size)
+            for label, func in (('per-row', list_per_row), ('aggregate', list_aggregated)):
+                rows, round_trips, latency = measure(func, db, counter, args.repeat)
+                print(f"{rows:>8} {label:<12} {round_trips:>12} {latency:>12.1f}")
+    finally:
+        client.drop_database(args.database)
+
+
+if __name__ == '__main__':
+    main()
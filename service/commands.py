@@ -0,0 +1,65 @@
+import click
+from Product.expiry import backfill_expiry_timestamps
+from Product.allocator import backfill_allocation_fields
+from Customer.stats import rebuild_customer_stats
+from Medicine.search_index import MedicineSearch, backfill_name_keys
+
+def init_commands(app):
+    """Register one-off maintenance commands, run with `flask <command>`"""
+
+    @app.cli.command('backfill-expiry')
+    @click.option('--batch-size', default=500, show_default=True, help='Updates per bulk write')
+    def backfill_expiry(batch_size):
+        """Store exp_date_ts on stock entries that predate it"""
+        app.db.ensure_indexes()
+        stats = backfill_expiry_timestamps(app.db.stock_collection, batch_size=batch_size)
+        click.echo(
+            f"Scanned {stats['scanned']} stock entries, updated {stats['updated']}, "
+            f"{stats['unparseable']} with unparseable expiry dates"
+        )
+
+    @app.cli.command('backfill-stock-owners')
+    @click.option('--shop-owner', default=None, help='Shop to assign to stock entries without one')
+    @click.option('--batch-size', default=500, show_default=True, help='Updates per bulk write')
+    def backfill_stock_owners(shop_owner, batch_size):
+        """Store shop_owner, ObjectId medicine ids and quantities so older stock is allocated first-expiry-first-out"""
+        app.db.ensure_indexes()
+        stats = backfill_allocation_fields(app.db.stock_collection, shop_owner=shop_owner, batch_size=batch_size)
+        click.echo(f"Scanned {stats['scanned']} stock entries, updated {stats['updated']}")
+        if stats['unowned']:
+            click.echo(f"{stats['unowned']} entries have no shop owner; rerun with --shop-owner to assign one")
+
+    @app.cli.command('rebuild-customer-stats')
+    def rebuild_customer_stats_command():
+        """Recompute customer lifetime-value counters from the Sales collection
+
+        Run while no sales are being recorded; a sale taken mid-rebuild can
+        be lost from or counted twice in its customer's counters.
+        """
+        click.echo("Warning: sales recorded while this runs may be miscounted; run it while the shop is closed.", err=True)
+        app.db.ensure_indexes()
+        stats = rebuild_customer_stats(app.db.customers_collection, app.db.sales_collection)
+        click.echo(f"Updated {stats['updated']} customers from sales, reset {stats['reset']} without sales")
+
+    @app.cli.command('build-medicine-search')
+    @click.option('--batch-size', default=500, show_default=True, help='Updates per bulk write')
+    def build_medicine_search(batch_size):
+        """Store search keys and n-grams on medicines that predate them"""
+        app.db.ensure_indexes()
+        updated = MedicineSearch(app.db.medicine_collection).backfill(batch_size=batch_size)
+        click.echo(f"Updated search fields on {updated} medicines")
+
+    @app.cli.command('build-medicine-keys')
+    @click.option('--batch-size', default=500, show_default=True, help='Updates per bulk write')
+    def build_medicine_keys(batch_size):
+        """Store canonical name keys on medicines that predate them or the current key format"""
+        # The unique index only covers keyed medicines, so it can be built first
+        # and then rejects duplicates as they are keyed
+        app.db.ensure_indexes()
+        stats = backfill_name_keys(app.db.medicine_collection, batch_size=batch_size)
+        click.echo(
+            f"Stored name keys on {stats['updated']} medicines, "
+            f"{stats['duplicates']} duplicates left unkeyed"
+        )
+
+__all__ = ['init_commands']
@@ -6,3 +6,5 @@ load_dotenv()
 class Config:
     MONGODB_URI = os.getenv('MONGODB_URI')
     DATABASE_NAME = 'MSM'
+    # Comma-separated emails allowed to use maintenance endpoints
+    ADMIN_EMAILS = [email.strip() for email in os.getenv('ADMIN_EMAILS', '').split(',') if email.strip()]
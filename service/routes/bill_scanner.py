@@ -1,7 +1,11 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, session
 from BillScanner.bill_processor import BillProcessor
 from BillScanner.models import BillModel
+from BillScanner.jobs import BillJobQueue
 from Medicine.enrichment_service import MedicineEnrichmentService
+from Product.expiry import expiry_timestamp
+from Medicine.search_index import search_fields, medicine_name_key
+from pymongo import ReturnDocument
 from bson.objectid import ObjectId
 from datetime import datetime
 import logging
@@ -14,13 +18,18 @@ bill_scanner_bp = Blueprint('bill_scanner', __name__)
 bill_processor = None
 bill_model = None
 enrichment_service = None
+bill_jobs = None
 
 def init_bill_scanner(app):
     """Initialize bill scanner dependencies"""
-    global bill_processor, bill_model, enrichment_service
+    global bill_processor, bill_model, enrichment_service, bill_jobs
     bill_processor = BillProcessor()
     bill_model = BillModel(app.db)
     
+    # Uploads are processed in the background; unfinished jobs are picked up again
+    bill_jobs = BillJobQueue(app.db.bill_jobs_collection, bill_processor, bill_model)
+    bill_jobs.start()
+    
     # Initialize with debug mode from app configuration
     debug_mode = app.config.get('DEBUG', False)
     enrichment_service = MedicineEnrichmentService(app.db, debug=debug_mode)
@@ -33,7 +42,7 @@ def init_bill_scanner(app):
 
 @bill_scanner_bp.route('/upload', methods=['POST'])
 def upload_bill():
-    """Upload and process a bill image or PDF"""
+    """Queue a bill image or PDF for processing and return the job id"""
     try:
         if 'bill' not in request.files:
             return jsonify({"error": "No file part"}), 400
@@ -42,29 +51,38 @@ def upload_bill():
         if bill_file.filename == '':
             return jsonify({"error": "No selected file"}), 400
         
-        # Process the bill file
-        processed_results = bill_processor.process_bill_file(bill_file, bill_file.filename)
-        
-        # Save results to database
-        saved_results = []
-        for result in processed_results:
-            bill_id = bill_model.create_bill(result)
-            
-            result_with_id = result.copy()
-            result_with_id["bill_id"] = bill_id
-            saved_results.append(result_with_id)
+        # Processing takes minutes for multi-page PDFs, so it runs as a job
+        job_id = bill_jobs.submit(bill_file.read(), bill_file.filename, session.get('user'))
         
         return jsonify({
             "success": True,
-            "results": saved_results
-        })
+            "job_id": job_id,
+            "status": "queued"
+        }), 202
     
     except ValueError as e:
         # Handle specific validation errors
         return jsonify({"error": str(e)}), 400
     except Exception as e:
         # Handle other errors
-        return jsonify({"error": f"Failed to process bill: {str(e)}"}), 500
+        return jsonify({"error": f"Failed to queue bill: {str(e)}"}), 500
+
+@bill_scanner_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_bill_job(job_id):
+    """Status of a bill processing job with the results of pages finished so far"""
+    try:
+        if not ObjectId.is_valid(job_id):
+            return jsonify({"error": "Job not found"}), 404
+        
+        job = bill_jobs.get(job_id)
+        # Jobs are only visible to the user who uploaded the bill
+        if not job or (job.get("shop_owner") and job["shop_owner"] != session.get('user')):
+            return jsonify({"error": "Job not found"}), 404
+        
+        return jsonify(job)
+    
+    except Exception as e:
+        return jsonify({"error": f"Failed to retrieve job: {str(e)}"}), 500
 
 @bill_scanner_bp.route('/bills', methods=['GET'])
 def get_bills():
@@ -139,6 +157,21 @@ def save_products():
                 logger.error(f"Invalid bill_id format or bills collection error: {e}")
                 warnings.append(f"Could not update bill details: {str(e)}")
         
+        # Look up every named product at once: repeated names are resolved
+        # once and only catalogue misses are scraped, a few at a time
+        enrichment_results = {}
+        if auto_enrich:
+            named_products = [
+                (index, product.get('product_name'))
+                for index, product in enumerate(products)
+                if product.get('product_name')
+            ]
+            results = enrichment_service.enrich_medicines(
+                [product_name for _, product_name in named_products],
+                user_verification=False
+            )
+            enrichment_results = {index: result for (index, _), result in zip(named_products, results)}
+        
         # Process each product - enrich data if needed
         for index, product in enumerate(products):
             try:
@@ -153,23 +186,8 @@ def save_products():
                 medicine_data = None
                 
                 if auto_enrich:
-                    # Try to find medicine in database or enrich from online sources
-                    result = enrichment_service.find_or_enrich_medicine(
-                        product_name,
-                        user_verification=False
-                    )
-                    
-                    # If exact match fails, try with a simplified product name
-                    if result["status"] == "not_found" and data.get('use_fallback_search', False):
-                        simplified_name = product_name.split(' ')
-                        simplified_name = ' '.join(simplified_name[:min(3, len(simplified_name))])
-                        
-                        # Try again with simplified name
-                        logger.info(f"Trying fallback search with simplified name: {simplified_name}")
-                        result = enrichment_service.find_or_enrich_medicine(
-                            simplified_name,
-                            user_verification=False
-                        )
+                    # Found in the catalogue or enriched from online sources above
+                    result = enrichment_results[index]
 
                     if result["status"] in ["found", "enriched"]:
                         # We found or created the medicine
@@ -184,12 +202,22 @@ def save_products():
                     basic_medicine = {
                         "product_name": product_name,
                         "product_manufactured": product.get('manufacturer', "Unknown"),
-                        "salt_composition": "Not specified"
+                        "salt_composition": "Not specified",
+                        "created_at": datetime.utcnow(),
+                        "updated_at": datetime.utcnow()
                     }
+                    basic_medicine.update(search_fields(product_name, basic_medicine["product_manufactured"]))
                     
-                    # Use medicine_collection instead of Medicine
-                    new_med_result = bill_model.db.medicine_collection.insert_one(basic_medicine)
-                    medicine_id = str(new_med_result.inserted_id)
+                    # Reuse an entry already created for the same name key and manufacturer
+                    name_key = medicine_name_key(product_name)
+                    new_medicine = bill_model.db.medicine_collection.find_one_and_update(
+                        {"name_key": name_key, "product_manufactured": basic_medicine["product_manufactured"]},
+                        {"$setOnInsert": basic_medicine},
+                        projection={"_id": 1},
+                        upsert=True,
+                        return_document=ReturnDocument.AFTER
+                    )
+                    medicine_id = str(new_medicine["_id"])
                     
                     warnings.append(f"Created basic medicine entry for {product_name}")
 
@@ -218,8 +246,10 @@ def save_products():
                     "batch_no": product.get('batch_number', ''),
                     "mfg_date": product.get('mfg_date', ''),
                     "exp_date": product.get('exp_date', ''),
+                    "exp_date_ts": expiry_timestamp(product.get('exp_date')),
                     "mrp": mrp,
                     "quantity": quantity,
+                    "shop_owner": session.get('user'),
                     "created_at": datetime.utcnow(),
                     "updated_at": datetime.utcnow()
                 }
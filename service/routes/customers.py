@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify, session, redirect, url_for, curre
 from datetime import datetime
 from bson import ObjectId
 from Prescription.services.db_service import DatabaseService
+from Customer.activity_cache import activity_cache
 
 from dotenv import load_dotenv
 import logging
@@ -42,7 +43,11 @@ def customers_creation():
         'customer_number':customer_number,
         'customer_email':customer_email,
         'customer_address':customer_address,
-        'shop_owner':shop_owner
+        'shop_owner':shop_owner,
+        # Lifetime-value counters, maintained by /sales
+        'total_spent':0,
+        'order_count':0,
+        'last_purchase_at':None
         }
     try:
         customer_collection.insert_one(new_customer)
@@ -51,6 +56,36 @@ def customers_creation():
         logging.error(f"Database customer save error: {str(e)}")
         raise
 
+def _customer_listing_pipeline(query, shop_owner, limit=None):
+    """Aggregation returning customers with last purchase, order count and total spent"""
+    pipeline = [
+        {'$match': query},
+        {'$sort': {'_id': 1}}
+    ]
+    # Limit before the join so only the requested page is looked up
+    if limit:
+        pipeline.append({'$limit': limit})
+    
+    pipeline.append({'$lookup': {
+        'from': 'Sales',
+        'let': {'customer_id': {'$toString': '$_id'}},
+        'pipeline': [
+            # Equality matches on (shop_owner, customer_id) use the Sales index
+            {'$match': {'$expr': {'$and': [
+                {'$eq': ['$shop_owner', shop_owner]},
+                {'$eq': ['$customer_id', '$$customer_id']}
+            ]}}},
+            {'$group': {
+                '_id': None,
+                'last_purchase': {'$max': '$created_at'},
+                'orders': {'$sum': 1},
+                'total_spent': {'$sum': '$total_amount'}
+            }}
+        ],
+        'as': 'purchase_stats'
+    }})
+    return pipeline
+
 @customers_bp.route('/customers', methods=['GET'])
 def customers_get():
     if 'user' not in session:
@@ -73,16 +108,27 @@ def customers_get():
             # Search on phone number
             query['customer_number'] = {'$regex': phone_query, '$options': 'i'}
         
-        # If neither name nor phone provided, limit results
-        if not name_query and not phone_query:
-            customers = list(customer_collection.find(query))
-        else:
-            customers = list(customer_collection.find(query))
+        # Optional cursor pagination: ?limit=N&cursor=<last customer id>
+        limit = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor')
+        if limit is None and request.args.get('limit'):
+            return jsonify({'error': "limit must be a whole number"}), 400
+        paginated = 'limit' in request.args or cursor is not None
+        if paginated:
+            limit = min(max(50 if limit is None else limit, 1), 500)
+            if cursor:
+                if not ObjectId.is_valid(cursor):
+                    return jsonify({'error': "Invalid cursor"}), 400
+                query['_id'] = {'$gt': ObjectId(cursor)}
+        
+        # One aggregation joins every customer with their purchase stats
+        customers = list(customer_collection.aggregate(
+            _customer_listing_pipeline(query, shop_owner, limit if paginated else None)
+        ))
         
         # Convert ObjectId to string for JSON serialization and enhance with purchase data
         for customer in customers:
-            if '_id' in customer:
-                customer['_id'] = str(customer['_id'])
+            customer['_id'] = str(customer['_id'])
             
             # Map database fields to expected frontend field names
             customer['id'] = customer.get('_id')
@@ -91,25 +137,15 @@ def customers_get():
             customer['email'] = customer.get('customer_email')
             customer['address'] = customer.get('customer_address')
             
-            # Get customer's sales history
-            customer_id = customer['_id']
-            sales = list(sales_collection.find(
-                {'customer_id': customer_id, 'shop_owner': shop_owner}
-            ).sort('date', -1))  # Sort by date descending to get most recent first
-            
-            # Calculate last purchase date
-            if sales:
-                # Get the most recent sale date
-                last_sale = sales[0]
-                customer['lastPurchase'] = last_sale.get('created_at')
-                
-                # Calculate total spent
-                total_spent = sum(sale.get('total_amount', 0) for sale in sales)
-                customer['totalSpent'] = str(round(total_spent, 2))
-            else:
-                # No sales history
-                customer['lastPurchase'] = None
-                customer['totalSpent'] = "0.00"
+            stats = customer.pop('purchase_stats', None)
+            stats = stats[0] if stats else {}
+            customer['lastPurchase'] = stats.get('last_purchase')
+            customer['orders'] = stats.get('orders', 0)
+            customer['totalSpent'] = str(round(stats['total_spent'], 2)) if stats else "0.00"
+        
+        if paginated:
+            next_cursor = customers[-1]['_id'] if len(customers) == limit else None
+            return jsonify({'customers': customers, 'next_cursor': next_cursor})
         
         return jsonify(customers)
     
@@ -210,28 +246,12 @@ def get_top_customers():
         limit = int(request.args.get('limit', 5))  # Default to top 5 customers
         shop_owner = session['user']
         
-        # Get all customers with their sales data
-        customers = list(customer_collection.find({'shop_owner': shop_owner}))
-        
-        # Calculate total spent for each customer by analyzing sales data
-        for customer in customers:
-            customer_id = str(customer['_id'])
-            
-            # Find all sales for this customer
-            sales = list(sales_collection.find(
-                {'customer_id': customer_id, 'shop_owner': shop_owner}
-            ))
-            
-            # Calculate total spent
-            total_spent = sum(sale.get('total_amount', 0) for sale in sales)
-            customer['totalSpent'] = total_spent
-            customer['orders'] = len(sales)
-        
-        # Sort customers by total spent in descending order
-        customers.sort(key=lambda x: x.get('totalSpent', 0), reverse=True)
-        
-        # Take only the top N customers
-        top_customers = customers[:limit]
+        # Counters are maintained on the customer document by /sales,
+        # so the top-N is an indexed sort with a limit
+        top_customers = list(customer_collection.find(
+            {'shop_owner': shop_owner},
+            {'customer_name': 1, 'customer_email': 1, 'total_spent': 1, 'order_count': 1}
+        ).sort('total_spent', -1).limit(limit))
         
         # Format data for frontend
         formatted_customers = []
@@ -240,9 +260,9 @@ def get_top_customers():
                 'id': str(customer['_id']),
                 'name': customer.get('customer_name', 'Unknown'),
                 'email': customer.get('customer_email', ''),
-                'spent': str(round(customer.get('totalSpent', 0), 2)),
-                'orders': customer.get('orders', 0),
-                'value': str(round(customer.get('totalSpent', 0), 2)),  # Duplicate for compatibility
+                'spent': str(round(customer.get('total_spent') or 0, 2)),
+                'orders': customer.get('order_count') or 0,
+                'value': str(round(customer.get('total_spent') or 0, 2)),  # Duplicate for compatibility
                 'image': None,  # No images stored yet
                 'initials': ''.join([name[0].upper() for name in customer.get('customer_name', 'U').split(' ') if name])[:2]
             })
@@ -253,6 +273,41 @@ def get_top_customers():
         logging.error(f"Error fetching top customers: {str(e)}")
         return jsonify({'error': f"Unable to fetch top customers: {str(e)}"}), 500
 
+def _load_recent_activity(shop_owner, limit):
+    """Fetch the latest sales and resolve all customer names in one $in query"""
+    recent_sales = list(sales_collection.find(
+        {'shop_owner': shop_owner},
+        {'customer_id': 1, 'total_amount': 1, 'created_at': 1}
+    ).sort('created_at', -1).limit(limit))
+    
+    customer_ids = {
+        ObjectId(sale['customer_id'])
+        for sale in recent_sales
+        if sale.get('customer_id') and ObjectId.is_valid(str(sale['customer_id']))
+    }
+    customer_names = {}
+    if customer_ids:
+        customer_names = {
+            str(customer['_id']): customer.get('customer_name', 'Unknown Customer')
+            for customer in customer_collection.find(
+                {'_id': {'$in': list(customer_ids)}},
+                {'customer_name': 1}
+            )
+        }
+    
+    activities = []
+    for sale in recent_sales:
+        customer_id = sale.get('customer_id')
+        activities.append({
+            'id': str(sale['_id']),
+            'name': customer_names.get(str(customer_id), 'Walk-in Customer') if customer_id else 'Walk-in Customer',
+            'action': 'Placed Order',
+            'value': float(sale.get('total_amount', 0)),
+            'created_at': sale.get('created_at'),
+            'image': None,  # No images stored yet
+        })
+    return activities
+
 @customers_bp.route('/customers/recent-activity', methods=['GET'])
 def get_recent_activity():
     if 'user' not in session:
@@ -262,34 +317,19 @@ def get_recent_activity():
         limit = int(request.args.get('limit', 5))  # Default to 5 recent activities
         shop_owner = session['user']
         
-        # Get recent sales ordered by date (newest first)
-        recent_sales = list(sales_collection.find(
-            {'shop_owner': shop_owner}
-        ).sort('created_at', -1).limit(limit))
+        activities = activity_cache.get(shop_owner, limit)
+        if activities is None:
+            activities = _load_recent_activity(shop_owner, limit)
+            activity_cache.set(shop_owner, limit, activities)
         
-        # Format activities for frontend
-        activities = []
-        for sale in recent_sales:
-            # Get customer details
-            customer_id = sale.get('customer_id')
-            customer = customer_collection.find_one({'_id': ObjectId(customer_id)}) if customer_id else None
-            
-            customer_name = 'Walk-in Customer'
-            if customer:
-                customer_name = customer.get('customer_name', 'Unknown Customer')
-            
-            # Create activity record
-            activity = {
-                'id': str(sale['_id']),
-                'name': customer_name,
-                'action': 'Placed Order',
-                'value': float(sale.get('total_amount', 0)),
-                'time': calculate_time_ago(sale.get('created_at')),
-                'image': None,  # No images stored yet
-            }
-            activities.append(activity)
+        # Relative times are computed per request so cached entries stay accurate
+        formatted_activities = []
+        for activity in activities:
+            activity = dict(activity)
+            activity['time'] = calculate_time_ago(activity.pop('created_at'))
+            formatted_activities.append(activity)
         
-        return jsonify(activities), 200
+        return jsonify(formatted_activities), 200
         
     except Exception as e:
         logging.error(f"Error fetching recent activity: {str(e)}")
@@ -2,11 +2,18 @@ from flask import Blueprint, request, jsonify, render_template, current_app, ses
 import logging
 from datetime import datetime
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from Product.models import Medicine, Stock
+from Product.queries import stock_listing_pipeline
+from Product.expiry import expiry_timestamp
 from Product.image_processor import ImageProcessor
+from Prescription.services.image_preprocessing import prepare_image
 from Medicine.enrichment_service import MedicineEnrichmentService
+from Medicine.search_index import MedicineSearch, medicine_name_key
+from Medicine.catalogue import MedicineCatalogue
+from Medicine.structured_data import extraction_stats
+from config import Config
 import cloudinary.uploader
-import base64
 
 # Create product blueprint
 product_bp = Blueprint('product', __name__)
@@ -15,6 +22,8 @@ product_bp = Blueprint('product', __name__)
 medicine_collection = None
 stock_collection = None
 enrichment_service = None
+medicine_search = None
+medicine_catalogue = None
 
 # Helper function to recursively convert MongoDB objects to JSON serializable format
 def convert_mongo_document(doc):
@@ -31,11 +40,20 @@ def convert_mongo_document(doc):
 
 def init_product_bp(app):
     """Initialize product blueprint with app's database"""
-    global medicine_collection, stock_collection, enrichment_service
+    global medicine_collection, stock_collection, enrichment_service, medicine_search, medicine_catalogue
     
     # Set up collections from app's database
     medicine_collection = app.db.medicine_collection
     stock_collection = app.db.stock_collection
+    medicine_search = MedicineSearch(medicine_collection)
+    
+    # Build the in-memory catalogue used for typo-tolerant autocomplete
+    medicine_catalogue = MedicineCatalogue(medicine_collection)
+    try:
+        medicine_catalogue.load()
+    except Exception as e:
+        # It will be loaded on first use instead
+        logging.error(f"Could not load medicine catalogue: {str(e)}")
     
     # Initialize the enrichment service with debug mode based on environment
     debug_mode = app.config.get('DEBUG', False)
@@ -57,13 +75,13 @@ def search_medicine():
         # Add debug logging
         logging.debug(f"Searching for medicine: '{search_term}', auto_enrich={auto_enrich}")
 
-        # First try normal database search
-        medicines = list(medicine_collection.find({
-            '$or': [
-                {'product_name': {'$regex': search_term, '$options': 'i'}},
-                {'product_manufactured': {'$regex': search_term, '$options': 'i'}}
-            ]
-        }))
+        limit = request.args.get('limit', type=int)
+        if limit is None and 'limit' in request.args:
+            return jsonify({'error': "limit must be a whole number"}), 400
+        limit = min(max(20 if limit is None else limit, 1), 100)
+
+        # First try the indexed database search
+        medicines = medicine_search.search(search_term, limit=limit)
         
         logging.debug(f"Database search found {len(medicines)} results")
 
@@ -74,6 +92,10 @@ def search_medicine():
         # If medicines found, return them
         if medicines:
             return jsonify(medicines), 200
+
+        # Without enrichment, fall back to typo-tolerant suggestions from memory
+        if not auto_enrich:
+            return jsonify(medicine_catalogue.autocomplete(search_term, limit=limit)), 200
             
         # If no medicines found and auto-enrich enabled, try to get from online sources
         if auto_enrich:
@@ -97,6 +119,24 @@ def search_medicine():
         logging.exception("Detailed exception information:")
         return jsonify({'error': str(e)}), 500
 
+@product_bp.route('/medicine/autocomplete', methods=['GET'])
+def autocomplete_medicine():
+    """Typo-tolerant medicine suggestions served from the in-memory catalogue"""
+    try:
+        search_term = request.args.get('term', '').strip()
+        if not search_term:
+            return jsonify([]), 200
+
+        limit = request.args.get('limit', type=int)
+        if limit is None and 'limit' in request.args:
+            return jsonify({'error': "limit must be a whole number"}), 400
+        limit = min(max(10 if limit is None else limit, 1), 50)
+        return jsonify(medicine_catalogue.autocomplete(search_term, limit=limit)), 200
+
+    except Exception as e:
+        logging.error(f"Error in medicine autocomplete: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @product_bp.route('/medicine', methods=['GET', 'POST'])
 def medicine():
     if request.method == 'GET':
@@ -104,13 +144,14 @@ def medicine():
             product_name = request.args.get('product_name')
             manufacturer = request.args.get('manufacturer')
             
-            query = {}
-            if product_name:
-                query['product_name'] = {'$regex': product_name, '$options': 'i'}
-            if manufacturer:
-                query['product_manufactured'] = {'$regex': manufacturer, '$options': 'i'}
-            
-            medicines = list(medicine_collection.find(query))
+            if product_name or manufacturer:
+                limit = request.args.get('limit', type=int)
+                if limit is None and 'limit' in request.args:
+                    return jsonify({'error': "limit must be a whole number"}), 400
+                limit = min(max(20 if limit is None else limit, 1), 100)
+                medicines = medicine_search.search(product_name, manufacturer=manufacturer, limit=limit)
+            else:
+                medicines = list(medicine_collection.find({}, MedicineSearch.projection))
             
             for med in medicines:
                 med['_id'] = str(med['_id'])
@@ -131,11 +172,12 @@ def medicine():
             if not all([product_name, manufacturer]):
                 return jsonify({'error': 'Product name and manufacturer are required'}), 400
 
-            # Check if medicine exists
-            existing_medicine = medicine_collection.find_one({
-                'product_name': product_name,
+            # Check if medicine exists under the same canonical name
+            key_filter = {
+                'name_key': medicine_name_key(product_name),
                 'product_manufactured': manufacturer
-            })
+            }
+            existing_medicine = medicine_collection.find_one(key_filter, MedicineSearch.projection)
 
             if existing_medicine:
                 existing_medicine['_id'] = str(existing_medicine['_id'])
@@ -150,7 +192,18 @@ def medicine():
                 product_manufactured=manufacturer,
                 salt_composition=salt_composition or 'Not specified'
             )
-            result = medicine_collection.insert_one(new_medicine.to_dict())
+            try:
+                result = medicine_collection.insert_one(new_medicine.to_dict())
+            except DuplicateKeyError:
+                # A concurrent request created it first; the unique name key index kept one copy
+                existing_medicine = medicine_collection.find_one(key_filter, MedicineSearch.projection)
+                if not existing_medicine:
+                    raise
+                existing_medicine['_id'] = str(existing_medicine['_id'])
+                return jsonify({
+                    'medicine': existing_medicine,
+                    'message': 'Medicine found'
+                }), 200
             
             return jsonify({
                 'medicine_id': str(result.inserted_id),
@@ -177,11 +230,12 @@ def process_image():
         if not medicine:
             return jsonify({"error": "Medicine not found"}), 404
 
-        image_file = request.files['image']
+        # Oriented, cropped and downscaled before upload
+        image = prepare_image(request.files['image'], "product")
         
         # Upload the complete image to Cloudinary
         upload_result = cloudinary.uploader.upload(
-            image_file,
+            image.file(),
             folder="product_images",
             resource_type="auto"
         )
@@ -196,9 +250,8 @@ def process_image():
         try:
             # Check if cropped image was provided
             if 'cropped_image' in request.files:
-                cropped_image_file = request.files['cropped_image']
-                cropped_image_data = cropped_image_file.read()
-                cropped_image_base64 = base64.b64encode(cropped_image_data).decode('utf-8')
+                cropped_image = prepare_image(request.files['cropped_image'], "product")
+                cropped_image_base64 = cropped_image.base64()
                 
                 # Initialize image processor with API key
                 together_api_key = current_app.config.get('TOGETHER_API_KEY')
@@ -258,6 +311,7 @@ def update_stock():
         update_data = {
             'mfg_date': data['mfg_date'],
             'exp_date': data['exp_date'],
+            'exp_date_ts': expiry_timestamp(data['exp_date']),
             'mrp': float(data['mrp']),
             'quantity': int(data['quantity']),
             'updated_at': datetime.utcnow()
@@ -280,7 +334,8 @@ def update_stock():
                 exp_date=data['exp_date'],
                 mrp=float(data['mrp']),
                 quantity=int(data['quantity']),
-                image_url=data['image_url']
+                image_url=data['image_url'],
+                shop_owner=session.get('user')
             )
             result = stock_collection.insert_one(stock.to_dict())
             message = 'New stock entry created successfully'
@@ -307,12 +362,11 @@ def get_stock():
             logging.info(f"Searching stock with term: '{search_term}'")
             
             # First try to find medicines matching the search term
-            matching_medicines = list(medicine_collection.find({
-                '$or': [
-                    {'product_name': {'$regex': search_term, '$options': 'i'}},
-                    {'product_manufactured': {'$regex': search_term, '$options': 'i'}}
-                ]
-            }))
+            limit = request.args.get('limit', type=int)
+            if limit is None and 'limit' in request.args:
+                return jsonify({'error': "limit must be a whole number"}), 400
+            limit = min(max(50 if limit is None else limit, 1), 200)
+            matching_medicines = medicine_search.search(search_term, limit=limit)
             
             # Convert all ObjectId to string for JSON serialization
             matching_medicines = convert_mongo_document(matching_medicines)
@@ -349,50 +403,8 @@ def get_stock():
             return jsonify(result_stocks), 200
         else:
             # Standard stock listing mode
-            # Fetch all stocks
-            stocks = list(stock_collection.find())
-            
-            # Prepare the result in the same format as the search mode
-            result_stocks = []
-            
-            for stock in stocks:
-                try:
-                    # Convert ObjectIds to strings
-                    stock_id = str(stock['_id'])
-                    medicine_id = str(stock['medicine_id']) if 'medicine_id' in stock else None
-                    
-                    if medicine_id:
-                        # Fetch the associated medicine
-                        medicine = medicine_collection.find_one({'_id': ObjectId(medicine_id)})
-                        if medicine:
-                            # Build the stock item in the same format as search mode
-                            stock_data = {
-                                'id': stock_id,
-                                'name': medicine.get('product_name', 'Unknown Product'),
-                                'manufacturer': medicine.get('product_manufactured', 'Unknown'),
-                                'category': medicine.get('sub_category', 'Uncategorized'),
-                                'batch': stock.get('batch_no', 'N/A'),
-                                'price': float(stock.get('mrp', 0)),
-                                'expiry': stock.get('exp_date', ''),
-                                'stock': int(stock.get('quantity', 0))
-                            }
-                            result_stocks.append(stock_data)
-                        else:
-                            # Medicine not found but we still want to show the stock
-                            stock_data = {
-                                'id': stock_id,
-                                'name': f"Unknown (ID: {medicine_id})",
-                                'manufacturer': 'Unknown',
-                                'category': 'Uncategorized',
-                                'batch': stock.get('batch_no', 'N/A'),
-                                'price': float(stock.get('mrp', 0)),
-                                'expiry': stock.get('exp_date', ''),
-                                'stock': int(stock.get('quantity', 0))
-                            }
-                            result_stocks.append(stock_data)
-                except Exception as e:
-                    logging.error(f"Error processing stock item: {str(e)}")
-                    # Continue to next stock item
+            # Join every stock entry with its medicine in a single aggregation
+            result_stocks = list(stock_collection.aggregate(stock_listing_pipeline()))
             
             logging.info(f"Returning {len(result_stocks)} stock items from standard listing")
             return jsonify(result_stocks), 200
@@ -448,6 +460,28 @@ def enrich_medicine():
         logging.error(f"Error in medicine enrichment: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@product_bp.route('/medicine/enrich/misses', methods=['DELETE'])
+def purge_enrichment_misses():
+    """Forget cached failed online lookups, for one name (?term=) or all (admin only)"""
+    if session.get('user') not in Config.ADMIN_EMAILS:
+        return jsonify({'error': 'Admin access required'}), 403
+
+    try:
+        term = request.args.get('term', '').strip()
+        deleted = enrichment_service.miss_cache.purge(term or None)
+        return jsonify({'message': 'Enrichment misses purged', 'deleted': deleted}), 200
+    except Exception as e:
+        logging.error(f"Error purging enrichment misses: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@product_bp.route('/medicine/enrich/stats', methods=['GET'])
+def enrichment_stats():
+    """Per-source share of scraped pages read from structured data without an LLM call (admin only)"""
+    if session.get('user') not in Config.ADMIN_EMAILS:
+        return jsonify({'error': 'Admin access required'}), 403
+
+    return jsonify(extraction_stats.snapshot()), 200
+
 @product_bp.route('/medicine/verify', methods=['POST'])
 def verify_medicine():
     """Verify and save medicine data after user review"""
@@ -1,5 +1,10 @@
 from flask import Blueprint, request, jsonify, session, redirect, url_for, current_app
 from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne
+from Product.allocator import plan_fefo_allocation
+from Customer.stats import record_sale, revert_sale
+from Customer.activity_cache import activity_cache
 from Prescription.services.db_service import DatabaseService
 
 from dotenv import load_dotenv
@@ -12,16 +17,48 @@ sales_bp = Blueprint('sales', __name__)
 db_service = None
 sales_collection = None
 stock_collection = None
+customer_collection = None
 
 def init_sales_bp(app, oauth=None):  # Made oauth parameter optional
-    global db_service, sales_collection, stock_collection
+    global db_service, sales_collection, stock_collection, customer_collection
     
     # Set up database connection using app's database service
     db_service = app.db
     sales_collection = db_service.sales_collection
     stock_collection = db_service.stock_collection
+    customer_collection = db_service.customers_collection
     app.register_blueprint(sales_bp)
 
+class InsufficientStockError(Exception):
+    """Raised inside the sale transaction when a line cannot be fulfilled"""
+
+    def __init__(self, requested, oversold=None):
+        super().__init__("Insufficient stock")
+        self.requested = requested
+        self.oversold = oversold
+
+def _to_object_id(value):
+    """Stock and sale ids arrive from the frontend as strings"""
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+def _find_oversold(requested):
+    """Report the lines whose stock could not cover the requested quantity"""
+    available = {
+        stock['_id']: stock.get('quantity', 0)
+        for stock in stock_collection.find({'_id': {'$in': list(requested)}}, {'quantity': 1})
+    }
+    oversold = []
+    for stock_id, quantity in requested.items():
+        if stock_id not in available or available[stock_id] < quantity:
+            oversold.append({
+                'stock_id': str(stock_id),
+                'requested': quantity,
+                'available': available.get(stock_id, 0)
+            })
+    return oversold
+
 @sales_bp.route("/sales", methods=["POST"])
 def sales():
     data = request.json
@@ -32,37 +69,109 @@ def sales():
     discount_format = data.get('discountFormat')
     total_amount = data.get('totalAmount')
 
-    stock_medicines = []
+    # Lines either name a stock batch, or only a medicine and let the server
+    # pick batches first-expiry-first-out
+    stock_lines = []
+    fefo_lines = []
     for medicine in data.get('medicines', []):
         stock_id = medicine.get('stock_id')
-        quantity = medicine.get('quantity')
-        
-        stock_medicines.append({
-            'stock_id': stock_id,
-            'quantity': quantity
-        })
+        medicine_id = medicine.get('medicine_id')
+        try:
+            quantity = int(medicine.get('quantity'))
+        except (TypeError, ValueError):
+            quantity = 0
+
+        if quantity <= 0 or not (stock_id or ObjectId.is_valid(str(medicine_id))):
+            return jsonify({"error": f"Invalid sale line: {medicine}"}), 400
         
-        stock = stock_collection.find_one({"_id": stock_id})
-        if stock:
-            stock_collection.update_one(
-                {"_id": stock_id},
-                {"$set": {"quantity": stock['quantity'] - quantity}}
+        if stock_id:
+            stock_lines.append({
+                'stock_id': stock_id,
+                'quantity': quantity
+            })
+        else:
+            fefo_lines.append({
+                'medicine_id': ObjectId(str(medicine_id)),
+                'quantity': quantity
+            })
+
+    def apply_sale(db_session):
+        # Rebuilt on every attempt since with_transaction retries on write conflicts
+        stock_medicines = list(stock_lines)
+        # Total quantity per stock batch, so each batch gets exactly one update
+        requested = {}
+        for line in stock_lines:
+            key = _to_object_id(line['stock_id'])
+            requested[key] = requested.get(key, 0) + line['quantity']
+
+        for line in fefo_lines:
+            allocations, shortfall = plan_fefo_allocation(
+                stock_collection,
+                shop_owner,
+                line['medicine_id'],
+                line['quantity'],
+                reserved=requested,
+                session=db_session
             )
+            if shortfall:
+                raise InsufficientStockError(requested, oversold=[{
+                    'medicine_id': str(line['medicine_id']),
+                    'requested': line['quantity'],
+                    'available': line['quantity'] - shortfall
+                }])
 
-    new_sales = {
-        'shop_owner': shop_owner,
-        'customer_id': customer_id,
-        'stock_medicines': stock_medicines,
-        'subtotal': subtotal,
-        'discount': discount,
-        'discount_format': discount_format,
-        'total_amount': total_amount,
-        'created_at': datetime.now()
-    }
+            for stock_id, quantity in allocations:
+                requested[stock_id] = requested.get(stock_id, 0) + quantity
+                stock_medicines.append({
+                    'stock_id': str(stock_id),
+                    'medicine_id': str(line['medicine_id']),
+                    'quantity': quantity
+                })
+
+        # One round trip for the whole basket; the quantity guard makes each
+        # decrement atomic, so concurrent sales can never drive stock negative
+        if requested:
+            result = stock_collection.bulk_write([
+                UpdateOne(
+                    {'_id': stock_id, 'quantity': {'$gte': quantity}},
+                    {'$inc': {'quantity': -quantity}}
+                )
+                for stock_id, quantity in requested.items()
+            ], ordered=False, session=db_session)
+
+            if result.matched_count < len(requested):
+                raise InsufficientStockError(requested)
+
+        new_sales = {
+            'shop_owner': shop_owner,
+            'customer_id': customer_id,
+            'stock_medicines': stock_medicines,
+            'subtotal': subtotal,
+            'discount': discount,
+            'discount_format': discount_format,
+            'total_amount': total_amount,
+            'created_at': datetime.now()
+        }
+        sale = sales_collection.insert_one(new_sales, session=db_session)
+        # Keep the customer's lifetime-value counters in step with the sale
+        record_sale(customer_collection, new_sales, session=db_session)
+        return str(sale.inserted_id), stock_medicines
 
     try:
-        sale = sales_collection.insert_one(new_sales)
-        return jsonify({"message": "Successful", "sale_id": str(sale.inserted_id)}), 201
+        with db_service.client.start_session() as db_session:
+            sale_id, stock_medicines = db_session.with_transaction(apply_sale)
+        activity_cache.invalidate(shop_owner)
+        return jsonify({
+            "message": "Successful",
+            "sale_id": sale_id,
+            "stock_medicines": stock_medicines
+        }), 201
+    except InsufficientStockError as e:
+        # The transaction was rolled back, nothing has been decremented
+        return jsonify({
+            "error": "Insufficient stock for one or more items",
+            "oversold": e.oversold or _find_oversold(e.requested)
+        }), 409
     except Exception as e:
         logging.error(f"Database sales save error: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -76,7 +185,7 @@ def delete_sale(sale_id):
             return jsonify({"error": "Unauthorized"}), 401
             
         # Find the sale
-        sale = sales_collection.find_one({"_id": sale_id})
+        sale = sales_collection.find_one({"_id": _to_object_id(sale_id)})
         if not sale:
             return jsonify({"error": "Sale not found"}), 404
             
@@ -84,20 +193,29 @@ def delete_sale(sale_id):
         if sale.get('shop_owner') != user:
             return jsonify({"error": "Unauthorized to delete this sale"}), 403
             
-        # Restore stock quantities
-        for medicine in sale.get('stock_medicines', []):
-            stock_id = medicine.get('stock_id')
-            quantity = medicine.get('quantity')
+        def remove_sale(db_session):
+            # Delete first so a concurrent delete of the same sale restores nothing
+            result = sales_collection.delete_one({"_id": sale['_id']}, session=db_session)
+            if result.deleted_count == 0:
+                return 0
             
-            stock_collection.update_one(
-                {"_id": stock_id},
-                {"$inc": {"quantity": quantity}}
-            )
+            # Restore stock quantities in one round trip
+            restores = [
+                UpdateOne({"_id": _to_object_id(medicine.get('stock_id'))}, {"$inc": {"quantity": medicine.get('quantity')}})
+                for medicine in sale.get('stock_medicines', [])
+            ]
+            if restores:
+                stock_collection.bulk_write(restores, ordered=False, session=db_session)
             
-        # Delete the sale
-        result = sales_collection.delete_one({"_id": sale_id})
+            # Take the sale off the customer's counters
+            revert_sale(customer_collection, sales_collection, sale, session=db_session)
+            return result.deleted_count
+        
+        with db_service.client.start_session() as db_session:
+            deleted_count = db_session.with_transaction(remove_sale)
+        activity_cache.invalidate(user)
         
-        if result.deleted_count > 0:
+        if deleted_count > 0:
             return jsonify({"message": "Sale deleted successfully"}), 200
         else:
             return jsonify({"error": "Failed to delete sale"}), 500
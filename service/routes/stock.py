@@ -1,8 +1,10 @@
 from flask import Blueprint, request, jsonify, session, render_template
 from datetime import datetime, timedelta
 from bson import ObjectId
+from Product.expiry import expiry_timestamp
+from Product.allocator import stock_quantity
+from Medicine.search_index import search_fields
 import logging
-import re
 
 stock_bp = Blueprint('stock', __name__, url_prefix='/stock')
 
@@ -19,43 +21,6 @@ def init_stock_bp(app):
     app.register_blueprint(stock_bp)
     logging.info("Stock blueprint registered with URL prefix: /stock")
 
-def parse_expiry_date(exp_date_str):
-    """Parse expiry date from various formats"""
-    if not exp_date_str or exp_date_str == "Not Available":
-        return None
-    
-    try:
-        # Try different date formats
-        
-        # Format: DD/MM/YYYY or MM/DD/YYYY
-        if re.match(r'^\d{1,2}/\d{1,2}/\d{4}$', exp_date_str):
-            parts = exp_date_str.split('/')
-            # Try both DD/MM/YYYY and MM/DD/YYYY
-            try:
-                return datetime(int(parts[2]), int(parts[1]), int(parts[0]))
-            except ValueError:
-                return datetime(int(parts[2]), int(parts[0]), int(parts[1]))
-        
-        # Format: MM/YYYY
-        if re.match(r'^\d{1,2}/\d{4}$', exp_date_str):
-            month, year = exp_date_str.split('/')
-            return datetime(int(year), int(month), 1) + timedelta(days=30)
-        
-        # Format: YYYY-MM-DD
-        if re.match(r'^\d{4}-\d{1,2}-\d{1,2}$', exp_date_str):
-            return datetime.fromisoformat(exp_date_str)
-        
-        # Format: YYYY-MM-DD with time
-        if 'T' in exp_date_str:
-            return datetime.fromisoformat(exp_date_str.replace('Z', '+00:00'))
-        
-        # Try general parsing for other formats
-        from dateutil import parser
-        return parser.parse(exp_date_str)
-    except Exception as e:
-        logging.debug(f"Could not parse date '{exp_date_str}': {str(e)}")
-        return None
-
 @stock_bp.route('/products-to-purchase', methods=['GET'])
 def products_to_purchase():
     if 'user' not in session:
@@ -116,58 +81,56 @@ def expiring_soon():
         shop_owner = session['user']
         logging.debug(f"Searching for expiring products for shop owner: {shop_owner}")
         
-        today = datetime.utcnow()
-        three_months_from_now = today + timedelta(days=90)
+        # Look-ahead window in days, 90 by default
+        window_days = request.args.get('days', type=int)
+        limit = request.args.get('limit', type=int)
+        if (window_days is None and 'days' in request.args) or (limit is None and 'limit' in request.args):
+            return jsonify({'error': "days and limit must be whole numbers"}), 400
+        window_days = min(max(90 if window_days is None else window_days, 1), 3650)
+        limit = min(max(500 if limit is None else limit, 1), 5000)
         
-        logging.debug(f"Date range: {today.isoformat()} to {three_months_from_now.isoformat()}")
+        today = datetime.utcnow()
+        window_end = today + timedelta(days=window_days)
         
-        # Query for all products and filter manually to handle different date formats
-        all_products = list(stock_collection.find())
-        expiring_products = []
+        logging.debug(f"Date range: {today.isoformat()} to {window_end.isoformat()}")
         
-        for product in all_products:
-            try:
-                exp_date_str = product.get('exp_date')
-                
-                # Parse expiry date using our helper function
-                expiry_date = None
-                if isinstance(exp_date_str, datetime):
-                    expiry_date = exp_date_str
-                elif isinstance(exp_date_str, str):
-                    expiry_date = parse_expiry_date(exp_date_str)
-                
-                # Check if date is within range
-                if expiry_date and today <= expiry_date <= three_months_from_now:
-                    expiring_products.append(product)
-            except Exception as product_error:
-                logging.error(f"Error processing product expiry: {str(product_error)}")
+        # Bounded range query on the indexed, normalized expiry timestamp
+        expiring_products = list(stock_collection.find(
+            {'exp_date_ts': {'$gte': today, '$lte': window_end}},
+            {'medicine_id': 1, 'quantity': 1, 'exp_date': 1, 'exp_date_ts': 1}
+        ).sort('exp_date_ts', 1).limit(limit))
         
         logging.info(f"Found {len(expiring_products)} products expiring soon")
         
+        # Resolve all medicines in one query
+        medicine_ids = []
+        for product in expiring_products:
+            try:
+                medicine_ids.append(ObjectId(product['medicine_id']))
+            except Exception:
+                continue
+        medicines = {
+            str(medicine['_id']): medicine
+            for medicine in medicine_collection.find(
+                {'_id': {'$in': medicine_ids}},
+                {'product_name': 1, 'product_manufactured': 1}
+            )
+        }
+        
         result = []
         for product in expiring_products:
             try:
-                medicine = medicine_collection.find_one({'_id': ObjectId(product['medicine_id'])})
+                medicine = medicines.get(str(product.get('medicine_id')))
                 if medicine:
-                    # Parse expiry date for calculation
                     exp_date_str = product.get('exp_date')
-                    expiry_date = None
-                    
-                    if isinstance(exp_date_str, datetime):
-                        expiry_date = exp_date_str
-                    elif isinstance(exp_date_str, str):
-                        expiry_date = parse_expiry_date(exp_date_str)
-                    
-                    days_to_expiry = (expiry_date - today).days if expiry_date else 30
+                    expiry_date = product['exp_date_ts']
                     
                     result.append({
                         'name': medicine.get('product_name', 'Unknown'),
                         'manufacturer': medicine.get('product_manufactured', 'Unknown'),
                         'quantity': product['quantity'],
-                        'daysToExpiry': days_to_expiry,
-                        'expiryDate': exp_date_str if isinstance(exp_date_str, str) else (
-                            expiry_date.strftime('%Y-%m-%d') if expiry_date else 'Unknown'
-                        )
+                        'daysToExpiry': (expiry_date - today).days,
+                        'expiryDate': exp_date_str if isinstance(exp_date_str, str) else expiry_date.strftime('%Y-%m-%d')
                     })
             except Exception as item_error:
                 logging.error(f"Error processing individual expiring product: {str(item_error)}")
@@ -336,8 +299,12 @@ def bulk_add_stock():
                 'category': item.get('category', 'Other'),
                 'batch': item.get('batch'),
                 'expiry': item.get('expiry'),
+                'exp_date_ts': expiry_timestamp(item.get('expiry')),
                 'price': item.get('price'),
                 'stock': item.get('stock'),
+                # Sales allocate from 'quantity' within the shop's own batches
+                'quantity': stock_quantity(item.get('stock')),
+                'shop_owner': session.get('user'),
                 'created_at': datetime.now(),
                 'updated_at': datetime.now()
             }
@@ -346,19 +313,20 @@ def bulk_add_stock():
             existing_medicine = medicine_collection.find_one({'name': item.get('name')})
             
             if existing_medicine:
-                new_stock['medicine_id'] = str(existing_medicine['_id'])
+                new_stock['medicine_id'] = existing_medicine['_id']
             else:
                 # Create a new medicine entry
                 new_medicine = {
                     'name': item.get('name'),
                     'manufacturer': item.get('manufacturer', 'Unknown'),
                     'category': item.get('category', 'Other'),
-                    'created_at': datetime.now(),
-                    'updated_at': datetime.now()
+                    'created_at': datetime.utcnow(),
+                    'updated_at': datetime.utcnow()
                 }
+                new_medicine.update(search_fields(new_medicine['name'], new_medicine['manufacturer']))
                 
                 medicine_id = medicine_collection.insert_one(new_medicine).inserted_id
-                new_stock['medicine_id'] = str(medicine_id)
+                new_stock['medicine_id'] = medicine_id
             
             # Insert the stock entry
             stock_id = stock_collection.insert_one(new_stock).inserted_id